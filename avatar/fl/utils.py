@@ -3,7 +3,7 @@ from typing import Dict, List, Optional, Union
 import os
 import json
 import openai
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from avatar.utils.retry import RetryPolicy, call_with_retry, get_circuit_breaker
 
 def get_llm_output(
     prompt: str,
@@ -30,7 +30,6 @@ def get_llm_output(
         Generated text from LLM
     """
     
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
     def _call_llm_api():
         if "gpt" in model:
             # Set API key from environment
@@ -50,7 +49,8 @@ def get_llm_output(
             raise ValueError(f"Unsupported model: {model}")
 
     try:
-        response = _call_llm_api()
+        response = call_with_retry(_call_llm_api, RetryPolicy(max_attempts=6, max_delay=60),
+                                   get_circuit_breaker(model), description=model)
         
         if return_raw:
             return response
@@ -7,6 +7,7 @@ from .avatar import AvaTaR
 from .llmv_reranker import LLMvReranker
 from .dense_retriever import DenseRetrieval
 from .react import React
+from .hybrid import HybridRetriever
 
 
 def get_model(args, kb):
@@ -16,7 +17,23 @@ def get_model(args, kb):
             kb,
             emb_model=args.emb_model,
             query_emb_dir=args.query_emb_dir, 
-            candidates_emb_dir=args.node_emb_dir
+            candidates_emb_dir=args.node_emb_dir,
+            device=args.device,
+            emb_dtype=args.emb_dtype,
+            ann_index=args.ann_index,
+            ann_probe=args.ann_probe
+        )
+    if model_name == 'Hybrid':
+        return HybridRetriever(
+            kb,
+            emb_model=args.emb_model,
+            query_emb_dir=args.query_emb_dir, 
+            candidates_emb_dir=args.node_emb_dir,
+            fusion=args.fusion,
+            alpha=args.hybrid_alpha,
+            device=args.device,
+            emb_dtype=args.emb_dtype,
+            ann_index=args.ann_index
         )
     if model_name == 'MultiVSS':
         return MultiVSS(
@@ -36,7 +53,10 @@ def get_model(args, kb):
                            query_emb_dir=args.query_emb_dir, 
                            candidates_emb_dir=args.node_emb_dir,
                            max_cnt = args.max_retry,
-                           max_k=args.llm_topk
+                           max_k=args.llm_topk,
+                           mode=args.rerank_mode,
+                           window_size=args.rerank_window,
+                           max_prompt_tokens=args.rerank_max_prompt_tokens
                            )
     if model_name == 'LLMvReranker':
         return LLMvReranker(kb, 
@@ -60,6 +80,10 @@ def get_model(args, kb):
                       topk_test=args.topk_test,
                       dataset=args.dataset,
                       num_processes=args.num_processes,
+                      emb_dtype=args.emb_dtype,
+                      ann_index=args.ann_index,
+                      ann_probe=args.ann_probe,
+                      parent_retriever=args.parent_retriever
                       )
     if 'DenseRetriever' in model_name:
         return DenseRetrieval(
@@ -88,5 +112,8 @@ def get_model(args, kb):
                     n_init_candidates=args.n_init_candidates, # 20
                     dataset=args.dataset,
                     vision=args.vision,
+                    emb_dtype=args.emb_dtype,
+                    ann_index=args.ann_index,
+                    ann_probe=args.ann_probe
                 )
     raise NotImplementedError(f'{model_name} not implemented')
\ No newline at end of file
@@ -12,18 +12,22 @@ import traceback
 from functools import partial
 from datetime import datetime
 from subprocess import Popen
-from typing import Any, Union, List, Dict
+from typing import Any, Union, List, Dict, Tuple
 from tqdm import tqdm
 
 from avatar.tools import assigned_funcs, customized_funcs, general_funcs
+from avatar.models.hybrid import HybridRetriever
 from avatar.models.model import ModelForQA
 from avatar.models.vss import VSS
 from avatar.utils.device import auto_select_device
 from avatar.utils.error_handler import string_exec_error_handler
+from avatar.utils.node_types import get_node_types
+from avatar.utils.api import get_llm_output
+from avatar.utils.retry import INVALID_OUTPUT, InvalidOutputError, RetryPolicy, call_with_retry
 from stark_qa.tools.io import read_from_file, write_to_file
 from avatar.utils.timer import exit_after
+from avatar.utils.topk import RankedResult
 from stark_qa.skb import SKB
-from stark_qa.tools.api import get_llm_output
 
 
 class MemoryBank:
@@ -71,7 +75,11 @@ class AvaTaR(ModelForQA):
                  topk_test: int = 200,
                  num_processes: int = 4,
                  dataset: str = 'amazon',
-                 time_limit_unit: int = 20
+                 time_limit_unit: int = 20,
+                 emb_dtype: str = 'float32',
+                 ann_index: str = None,
+                 ann_probe: int = 32,
+                 parent_retriever: str = 'VSS'
                  ):
         """
         Initialize the AvaTaR class.
@@ -90,6 +98,14 @@ class AvaTaR(ModelForQA):
             num_processes (int, optional): The number of processes to use for parallel processing. Default is 4.
             dataset (str, optional): The name of the dataset being used. Default is 'amazon'.
             time_limit_unit (int, optional): The time limit unit to constrain the execution time 
+            emb_dtype (str, optional): Storage dtype of the node embeddings used by the parent VSS and the 
+                                       embedding tools ('float32', 'float16', 'bfloat16' or 'int8'). Default is 'float32'.
+            ann_index (str, optional): ANN index type ('ivfpq' or 'hnswpq') used by the parent VSS to retrieve 
+                                       the initial candidates. Default is None, i.e., exact search. 
+                                       Not supported by the 'Hybrid' parent retriever.
+            ann_probe (int, optional): Recall-vs-latency knob of the ANN index. Default is 32.
+            parent_retriever (str, optional): Retriever of the initial candidates, 'VSS' or 'Hybrid' (VSS fused with 
+                                              BM25 keyword scores). Default is 'VSS'.
         """
 
         super().__init__(kb=kb)
@@ -109,6 +125,7 @@ class AvaTaR(ModelForQA):
         self.num_processes = num_processes
         self.dataset = dataset
         self.time_limit_unit = time_limit_unit
+        self.emb_dtype = emb_dtype
 
         ###########################################################
         #                    Modulize components                  # 
@@ -123,7 +140,12 @@ class AvaTaR(ModelForQA):
 
         # Initialize parent VSS model
         self.parent_pred_path = None
-        self.parent_vss = VSS(kb, query_emb_dir, node_emb_dir, emb_model=emb_model)
+        if parent_retriever == 'Hybrid':
+            self.parent_vss = HybridRetriever(kb, query_emb_dir, node_emb_dir, emb_model=emb_model, emb_dtype=emb_dtype,
+                                              ann_index=ann_index, ann_probe=ann_probe)
+        else:
+            self.parent_vss = VSS(kb, query_emb_dir, node_emb_dir, emb_model=emb_model, emb_dtype=emb_dtype,
+                                  ann_index=ann_index, ann_probe=ann_probe)
 
         # Set up debug print paths
         self.debug_print_dir = osp.join(output_dir, 'debug_print')
@@ -157,6 +179,7 @@ class AvaTaR(ModelForQA):
             'chunk_size': self.chunk_size,
             'chunk_emb_dir': self.chunk_emb_dir,
             'node_emb_dir': self.node_emb_dir,
+            'emb_dtype': self.emb_dtype,
             'debug_print_path': self.debug_print_path,
             'n_limit': self.n_limit
         }
@@ -216,7 +239,7 @@ class AvaTaR(ModelForQA):
                 prompt = prompt.replace('<topk_test>', str(self.topk_test))
                 prompt = prompt.replace('<func_call_description>', func_call_description)
                 prompt = prompt.replace('<candidate_types>', 
-                                        str(set([self.kb.get_node_type_by_id(node_id) for node_id in self.kb.candidate_ids])))
+                                        str(set(get_node_types(self.kb, self.kb.candidate_ids))))
                 prompt = prompt.replace('<pattern>', pattern)
                 prompt = prompt.replace('<example_queries>', example_queries)
             elif self.dataset == 'flickr30k_entities':
@@ -809,8 +832,7 @@ class AvaTaR(ModelForQA):
                                        torch.LongTensor(answer_ids), 
                                        metrics=metrics)
                 result['idx'], result['query_id'] = idx, query_id
-                result['pred_rank'] = torch.LongTensor(list(pred_dict.keys()))[
-                    torch.argsort(torch.tensor(list(pred_dict.values())), descending=True)[:1000]].tolist()
+                result['pred_rank'] = RankedResult.from_dict(pred_dict).topk(1000).ids.tolist()
             else:
                 try:
                     result = {'idx': idx, 'query_id': query_id, 'pred_rank': []}
@@ -935,24 +957,25 @@ class AvaTaR(ModelForQA):
         chunk_size = total_size // num_chunks
         return [range(i * chunk_size, min((i + 1) * chunk_size, total_size)) for i in range(num_chunks)]
 
-    def get_parent_topk(self, query: str, query_id: int, topk: int = 100) -> Union[Dict[int, float], List[int]]:
+    def get_parent_topk(self, query: str, query_id: int, topk: int = 100) -> Tuple[RankedResult, List[int]]:
+        """
+        Get the top `topk` of the parent ranking of `query` and their candidate ids, from the saved parent
+        predictions if any, or from the parent VSS, which may then answer from its ANN index.
+        If topk <= 0, the full ranking is returned.
+        """
         if self.parent_pred_path and osp.exists(self.parent_pred_path):
             csv = pd.read_csv(self.parent_pred_path)
             csv = csv[['query_id', 'pred_rank']]
             csv = csv[csv['query_id'] == query_id]
             if len(csv):
                 pred_rank = eval(csv['pred_rank'].iloc[0])
-                initial_score_dict = {node_id: 1. / (rank + 1) for rank, node_id in enumerate(pred_rank)}
-                return initial_score_dict, pred_rank[:topk]
-
-        initial_score_dict = self.parent_vss(query, query_id)
-        node_ids = list(initial_score_dict.keys())
-        node_scores = list(initial_score_dict.values())
-        top_k_idx = torch.topk(torch.FloatTensor(node_scores),
-                               min(topk, len(node_scores)),
-                               dim=-1).indices.view(-1).tolist()
+                pred_rank = pred_rank[:topk] if topk > 0 else pred_rank
+                initial_score_dict = RankedResult(pred_rank, [1. / (rank + 1) for rank in range(len(pred_rank))], 
+                                                  is_sorted=True)
+                return initial_score_dict, pred_rank
 
-        vss_top_candidates = [node_ids[i] for i in top_k_idx]
+        initial_score_dict = self.parent_vss(query, query_id, topk=topk)
+        vss_top_candidates = initial_score_dict.ids.tolist()
         return initial_score_dict, vss_top_candidates
 
     def get_group_id(self, query_idx: int, split: str = None) -> int:
@@ -1012,16 +1035,23 @@ class AvaTaR(ModelForQA):
         group, group_patterns = self.load_group(surfix=append_to)
         prompt = self._get_prompt(name='assign_group', query=query, group_patterns=group_patterns)
 
-        while True:
+        cnt = 0
+
+        def _assign():
+            nonlocal cnt
+            cnt += 1
+            output = self.preprocessor(prompt, read_cache=cnt == 1)
             try:
-                output = self.preprocessor(prompt)
                 output = json.loads(output)
                 output = {int(key): int(output[key]) for key in output.keys()}
-                assert set(list(output.keys())) == set([i for i in range(len(indices))])
-                assert set(list(output.values())).issubset(set(list(range(len(group)))))
-                break
-            except:
-                import pdb; pdb.set_trace()
+            except (json.JSONDecodeError, TypeError, ValueError, AttributeError) as err:
+                raise InvalidOutputError(f'assign_group - output is not a JSON dict of ints: {err}')
+            if set(output.keys()) != set(range(len(indices))) or not set(output.values()).issubset(set(range(len(group)))):
+                raise InvalidOutputError(f'assign_group - invalid assignment {output} of {len(indices)} queries to {len(group)} groups')
+            return output
+
+        # API errors are already retried by get_llm_output, only invalid outputs are retried here
+        output = call_with_retry(_assign, RetryPolicy(retry_on=(INVALID_OUTPUT,)), description='assign_group')
         for query_idx, group_id in output.items():
             group[group_id]['query_idx'] = list(set(group[group_id]['query_idx'] + [indices[query_idx]]))
         self.save_group(group, surfix=append_to)
@@ -1108,15 +1138,17 @@ class AvaTaR(ModelForQA):
         fail_exec, actions, _ = self._exec_actions_from_output(actions_best)
         globals().update(self.APIs)
         
+        if fail_exec:
+            import pdb; pdb.set_trace()
+            # Fall back to the full parent ranking rather than its top `topk_test` candidates
+            initial_score_dict, _ = self.get_parent_topk(query, query_id, topk=-1)
+            return initial_score_dict
+
         ############## Use VSS to filter ##############
         initial_score_dict, candidate_ids = self.get_parent_topk(query, query_id, topk=self.topk_test)
 
         get_node_score_dict = globals().get('get_node_score_dict')
         parameter_dict = globals().get('parameter_dict') 
 
-        if fail_exec:
-            import pdb; pdb.set_trace()
-            return initial_score_dict
-
         pred_dict = get_node_score_dict(query, candidate_ids, **parameter_dict)
         return pred_dict
\ No newline at end of file
@@ -0,0 +1,83 @@
+import torch
+from typing import Any
+from avatar.models.model import ModelForQA
+from avatar.models.vss import VSS
+from avatar.utils.bm25 import bm25_index_path, load_bm25_index
+from avatar.utils.topk import RankedResult
+
+
+class HybridRetriever(ModelForQA):
+
+    def __init__(self,
+                 kb,
+                 query_emb_dir: str,
+                 candidates_emb_dir: str,
+                 emb_model: str = 'text-embedding-ada-002',
+                 fusion: str = 'rrf',
+                 alpha: float = 0.5,
+                 rrf_k: int = 60,
+                 **vss_kwargs: Any):
+        """
+        Hybrid retrieval fusing dense (VSS) and BM25 keyword scores of all candidates.
+
+        Args:
+            kb: Knowledge base.
+            query_emb_dir (str): Directory to query embeddings.
+            candidates_emb_dir (str): Directory to candidate embeddings. The BM25 index is saved next to them.
+            emb_model (str): Embedding model name.
+            fusion (str): 'rrf' for reciprocal rank fusion, or 'linear' for a weighted sum of min-max normalized scores.
+            alpha (float): Weight of the dense scores in 'linear' fusion, and of the dense ranks in 'rrf' fusion.
+            rrf_k (int): Rank offset of reciprocal rank fusion.
+            **vss_kwargs: Arguments passed to `VSS`, e.g., `emb_dtype` or `device`. An ANN index is not supported, 
+                          since the dense scores of all candidates are fused.
+        """
+        super().__init__(kb)
+        assert fusion in ['rrf', 'linear'], f"fusion should be 'rrf' or 'linear', but got {fusion}"
+        assert vss_kwargs.get('ann_index') is None, \
+            'Hybrid retrieval scores all candidates exactly and does not support an ANN index'
+        self.emb_model = emb_model
+        self.query_emb_dir = query_emb_dir
+        self.fusion = fusion
+        self.alpha = alpha
+        self.rrf_k = rrf_k
+        self.vss = VSS(kb, query_emb_dir, candidates_emb_dir, emb_model=emb_model, **vss_kwargs)
+        self.bm25_index = load_bm25_index(bm25_index_path(candidates_emb_dir), kb)
+        self.candidate_id_tensor = torch.LongTensor(self.candidate_ids)
+
+    @staticmethod
+    def _ranks(scores: torch.FloatTensor) -> torch.FloatTensor:
+        ranks = torch.empty_like(scores)
+        ranks[torch.argsort(scores, descending=True)] = torch.arange(1, len(scores) + 1, dtype=scores.dtype)
+        return ranks
+
+    @staticmethod
+    def _min_max(scores: torch.FloatTensor) -> torch.FloatTensor:
+        span = scores.max() - scores.min()
+        return (scores - scores.min()) / span if span > 0 else torch.zeros_like(scores)
+
+    def forward(self,
+                query: str,
+                query_id: int,
+                topk: int = -1,
+                **kwargs: Any) -> RankedResult:
+        """
+        Forward pass to compute fused scores for the given query.
+
+        Args:
+            query (str): Query string.
+            query_id (int): Query index.
+            topk (int): Number of top candidates to keep. If topk <= 0, keep all candidates.
+
+        Returns:
+            pred_dict (RankedResult): Candidate ids and their corresponding fused scores.
+        """
+        query_emb = self.vss.get_query_emb(query, query_id)
+        dense = self.vss.score(query_emb).view(-1).float().cpu()
+        sparse = torch.from_numpy(self.bm25_index.score(query, self.candidate_ids))
+        if self.fusion == 'rrf':
+            scores = self.alpha / (self.rrf_k + self._ranks(dense)) + \
+                     (1 - self.alpha) / (self.rrf_k + self._ranks(sparse))
+        else:
+            scores = self.alpha * self._min_max(dense) + (1 - self.alpha) * self._min_max(sparse)
+        pred_dict = RankedResult(self.candidate_id_tensor, scores)
+        return pred_dict.topk(topk) if topk > 0 else pred_dict
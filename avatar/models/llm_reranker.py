@@ -4,7 +4,10 @@ import re
 
 from avatar.models.vss import VSS
 from avatar.models.model import ModelForQA
-from stark_qa.tools.api import get_llm_output
+from avatar.utils.doc_cache import get_doc_info
+from avatar.utils.node_types import get_node_types
+from avatar.utils.api import iter_llm_outputs
+from avatar.utils.listwise import DEFAULT_LISTWISE_MAX_PROMPT_TOKENS, format_candidates, run_listwise
 
 
 def find_floating_number(text: str) -> List[float]:
@@ -32,7 +35,10 @@ class LLMReranker(ModelForQA):
                  candidates_emb_dir: str,
                  sim_weight: float = 0.1,
                  max_cnt: int = 3,
-                 max_k: int = 100):
+                 max_k: int = 100,
+                 mode: str = 'pointwise',
+                 window_size: int = 10,
+                 max_prompt_tokens: int = DEFAULT_LISTWISE_MAX_PROMPT_TOKENS):
         """
         Initializes the LLMReranker model.
 
@@ -45,8 +51,16 @@ class LLMReranker(ModelForQA):
             sim_weight (float): Weight for similarity score.
             max_cnt (int): Maximum count for retrying LLM response.
             max_k (int): Maximum number of top candidates to consider.
+            mode (str): 'pointwise' to score each candidate with its own prompt, or 'listwise' to score
+                windows of candidates with one prompt each.
+            window_size (int): Maximum number of candidates per prompt in 'listwise' mode.
+            max_prompt_tokens (int): Token budget of the candidate documents per prompt in 'listwise' mode.
         """
         super(LLMReranker, self).__init__(kb)
+        assert mode in ['pointwise', 'listwise'], f"mode should be 'pointwise' or 'listwise', but got {mode}"
+        self.mode = mode
+        self.window_size = window_size
+        self.max_prompt_tokens = max_prompt_tokens
         self.max_k = max_k
         self.emb_model = emb_model
         self.llm_model = llm_model
@@ -72,22 +86,46 @@ class LLMReranker(ModelForQA):
             pred_dict (dict): A dictionary of predicted scores or answer ids.
         """
         initial_score_dict = self.parent_vss(query, query_id)
-        node_ids = list(initial_score_dict.keys())
-        node_scores = list(initial_score_dict.values())
 
         # Get the ids with top k highest scores
-        top_k_idx = torch.topk(
-            torch.FloatTensor(node_scores), 
-            min(self.max_k, len(node_scores)), 
-            dim=-1
-        ).indices.view(-1).tolist()
-        top_k_node_ids = [node_ids[i] for i in top_k_idx]
+        top_k = initial_score_dict.topk(self.max_k)
+        top_k_node_ids = top_k.ids.tolist()
         cand_len = len(top_k_node_ids)
 
+        node_types = get_node_types(self.skb, top_k_node_ids)
+        docs = [get_doc_info(self.skb, node_id, add_rel=True) for node_id in top_k_node_ids]
+        if self.mode == 'listwise':
+            llm_scores = self._listwise_scores(query, docs, node_types)
+        else:
+            llm_scores = self._pointwise_scores(query, docs, node_types)
+        llm_scores = {top_k_node_ids[pos]: score for pos, score in llm_scores.items()}
+        todo_node_ids = [node_id for node_id in top_k_node_ids if node_id not in llm_scores]
+
+        if len(todo_node_ids) > 0:
+            # Stand in for missing LLM scores with the similarity scores, min-max normalized over the top k
+            sim = top_k.scores.float()
+            sim = (sim - sim.min()) / (sim.max() - sim.min()) if sim.max() > sim.min() else torch.ones_like(sim)
+            fallback = dict(zip(top_k_node_ids, sim.tolist()))
+            print(f'llm_reranker - {len(todo_node_ids)}/{cand_len} candidates scored by similarity')
+            llm_scores.update({node_id: fallback[node_id] for node_id in todo_node_ids})
+
         pred_dict = {}
         for idx, node_id in enumerate(top_k_node_ids):
-            node_type = self.skb.get_node_type_by_id(node_id)
-            prompt = (
+            sim_score = (cand_len - idx) / cand_len
+            pred_dict[node_id] = llm_scores[node_id] + self.sim_weight * sim_score
+        return pred_dict
+
+    def _pointwise_scores(self, query: str, docs: List[str], node_types: List[str]) -> Dict[int, float]:
+        """
+        Score each candidate with its own prompt, sending all prompts concurrently and retrying
+        only the candidates without a usable answer.
+
+        Returns:
+            Dict[int, float]: LLM scores by candidate position. Candidates without a usable answer are missing.
+        """
+        prompts = []
+        for doc, node_type in zip(docs, node_types):
+            prompts.append(
                 f'You are a helpful assistant that examines if a {node_type} '
                 f'satisfies a given query and assign a score from 0.0 to 1.0. '
                 f'If the {node_type} does not satisfy the query, the score should be 0.0. '
@@ -96,33 +134,57 @@ class LLMReranker(ModelForQA):
                 f'evidence exists, the score should be between 0.0 and 1.0.\n'
                 f'Here is the query:\n\"{query}\"\n'
                 f'Here is the information about the {node_type}:\n' +
-                self.skb.get_doc_info(node_id, add_rel=True) + '\n\n' +
+                doc + '\n\n' +
                 f'Please score the {node_type} based on how well it satisfies the query. '
                 f'ONLY output the floating point score WITHOUT anything else. '
                 f'Output: The numeric score of this {node_type} is: '
             )
 
-            success = False
-            for _ in range(self.max_cnt):
-                try:
-                    answer = get_llm_output(
-                        prompt, 
-                        self.llm_model, 
-                        max_tokens=5
-                    )
-                    answer = find_floating_number(answer)
-                    if len(answer) == 1:
-                        answer = answer[0]
-                        success = True
-                        break
-                except Exception as e:
-                    print(f'Error: {e}, retrying...')
-
-            if success:
-                llm_score = float(answer)
-                sim_score = (cand_len - idx) / cand_len
-                score = llm_score + self.sim_weight * sim_score
-                pred_dict[node_id] = score
-            else:
-                return initial_score_dict
-        return pred_dict
+        llm_scores = {}
+        todo = list(range(len(prompts)))
+        for cnt in range(self.max_cnt):
+            for pos, answer in iter_llm_outputs([prompts[i] for i in todo], model=self.llm_model, max_tokens=5, read_cache=cnt == 0):
+                if isinstance(answer, Exception):
+                    print(f'Error: {answer}, retrying...')
+                    continue
+                answer = find_floating_number(answer)
+                if len(answer) == 1:
+                    llm_scores[todo[pos]] = float(answer[0])
+            todo = [i for i in todo if i not in llm_scores]
+            if len(todo) == 0:
+                break
+        return llm_scores
+
+    def _listwise_scores(self, query: str, docs: List[str], node_types: List[str]) -> Dict[int, float]:
+        """
+        Score windows of up to `window_size` candidates with one prompt each, see `avatar.utils.listwise.run_listwise`.
+
+        Returns:
+            Dict[int, float]: LLM scores by candidate position. Candidates without a usable answer are missing.
+        """
+        def build_prompt(window: List[int]) -> str:
+            return (
+                f'You are a helpful assistant that examines if each of the following candidates '
+                f'satisfies a given query and assigns each a score from 0.0 to 1.0. '
+                f'If a candidate does not satisfy the query, its score should be 0.0. '
+                f'If there exists explicit and strong evidence supporting that a candidate '
+                f'satisfies the query, its score should be 1.0. If partial evidence or weak '
+                f'evidence exists, the score should be between 0.0 and 1.0.\n'
+                f'Here is the query:\n\"{query}\"\n'
+                f'Here is the information about the {len(window)} candidates:\n\n' +
+                format_candidates([docs[pos] for pos in window], [node_types[pos] for pos in window]) + '\n\n' +
+                f'Please score every candidate independently based on how well it satisfies the query. '
+                f'Output exactly {len(window)} lines, one line "[i] score" for each candidate i from 1 to {len(window)}, '
+                f'e.g., "[1] 0.8", with ONLY the floating point score and WITHOUT anything else. Output:\n'
+            )
+
+        def parse_line(line: str) -> Union[float, None]:
+            score = find_floating_number(line)
+            return float(score[0]) if len(score) == 1 else None
+
+        return run_listwise(build_prompt, parse_line, [len(doc) for doc in docs],
+                            model=self.llm_model,
+                            window_size=self.window_size,
+                            max_prompt_tokens=self.max_prompt_tokens,
+                            max_cnt=self.max_cnt,
+                            max_tokens_per_candidate=8)
@@ -4,7 +4,7 @@ import re
 
 from avatar.models.vss import VSS
 from avatar.models.model import ModelForQA
-from avatar.utils.api_vision import get_llm_vision_outputs
+from avatar.utils.api import get_llm_vision_outputs
 import re
 
 
@@ -58,14 +58,8 @@ class LLMvReranker(ModelForQA):
                 query_id=None,
                 **kwargs: Any):
         
-        initial_score_dict = self.parent_vss(query, query_id)
-        node_ids = list(initial_score_dict.keys())
-        node_scores = list(initial_score_dict.values())
         # get the ids with top k highest scores
-        top_k_idx = torch.topk(torch.FloatTensor(node_scores),
-                               min(self.max_k, len(node_scores)),
-                               dim=-1).indices.view(-1).tolist()
-        top_k_node_ids = [node_ids[i] for i in top_k_idx]
+        top_k_node_ids = self.parent_vss(query, query_id, topk=self.max_k).ids.tolist()
         cand_len = len(top_k_node_ids)
 
         prompt = (
@@ -4,9 +4,11 @@ from typing import Any, Union, List, Dict
 
 import torch
 import torch.nn as nn
-from stark_qa.tools.api import get_openai_embedding
 from stark_qa.evaluator import Evaluator
 from avatar.tools import GetCLIPTextEmbedding
+from avatar.utils.emb_cache import get_text_embedding
+from avatar.utils.emb_store import EmbeddingStore, query_store_path
+from avatar.utils.topk import RankedResult
 
 
 class ModelForQA(nn.Module):
@@ -23,7 +25,7 @@ class ModelForQA(nn.Module):
 
         self.candidate_ids = kb.candidate_ids
         self.num_candidates = kb.num_candidates
-        self.query_emb_dict = {}
+        self.query_emb_store = None
         self.evaluator = Evaluator(self.candidate_ids)
     
     def forward(self, 
@@ -47,39 +49,33 @@ class ModelForQA(nn.Module):
     def get_query_emb(self, 
                        query: str, 
                        query_id: int, 
-                       emb_model: str = 'text-embedding-ada-002') -> torch.Tensor:
+                       emb_model: str = None) -> torch.Tensor:
         """
         Retrieves or computes the embedding for the given query.
         
         Args:
             query (str): Query string.
             query_id (int): Query index.
-            emb_model (str): Embedding model to use.
+            emb_model (str): Embedding model to use. Defaults to `self.emb_model`. The saved query embeddings 
+                             are only used for `self.emb_model`.
             
         Returns:
             query_emb (torch.Tensor): Query embedding.
         """
-        if query_id is None:
-            query_emb = get_openai_embedding(query, model=self.emb_model)
-        elif len(self.query_emb_dict) > 0:
-            query_emb = self.query_emb_dict[query_id]
-        else:
-            query_emb_dic_path = osp.join(self.query_emb_dir, 'query_emb_dict.pt')
-            if os.path.exists(query_emb_dic_path):
-                print(f'Load query embeddings from {query_emb_dic_path}')
-                self.query_emb_dict = torch.load(query_emb_dic_path)
-                query_emb = self.query_emb_dict[query_id]
-            else:
-                query_emb_dir = osp.join(self.query_emb_dir, 'query_embs')
-                if not os.path.exists(query_emb_dir):
-                    os.makedirs(query_emb_dir)
-                query_emb_path = osp.join(query_emb_dir, f'query_{query_id}.pt')
-                query_emb = get_openai_embedding(query, model=self.emb_model)
-                torch.save(query_emb, query_emb_path)
-        return query_emb
+        emb_model = emb_model or self.emb_model
+        if query_id is not None and emb_model == self.emb_model:
+            if self.query_emb_store is None:
+                self.query_emb_store = EmbeddingStore.load_or_convert(
+                    query_store_path(self.query_emb_dir), osp.join(self.query_emb_dir, 'query_emb_dict.pt')
+                )
+                if self.query_emb_store is not None:
+                    print(f'Load query embeddings from {self.query_emb_store.path}')
+            if self.query_emb_store is not None and query_id in self.query_emb_store:
+                return self.query_emb_store.get([query_id])
+        return get_text_embedding(query, model=emb_model)
     
     def evaluate(self, 
-                 pred_dict: Dict[int, float], 
+                 pred_dict: Union[Dict[int, float], RankedResult], 
                  answer_ids: torch.LongTensor, 
                  metrics: List[str] = ['mrr', 'hit@3', 'recall@20'], 
                  **kwargs: Any) -> Dict[str, float]:
@@ -87,7 +83,8 @@ class ModelForQA(nn.Module):
         Evaluates the predictions using the specified metrics.
         
         Args:
-            pred_dict (Dict[int, float]): Predicted answer ids or scores.
+            pred_dict (Union[Dict[int, float], RankedResult]): Predicted answer ids or scores. A RankedResult 
+                                                                is consumed directly without building a dictionary.
             answer_ids (torch.LongTensor): Ground truth answer ids.
             metrics (List[str]): A list of metrics to be evaluated, including 'mrr', 'hit@k', 'recall@k', 
                                  'precision@k', 'map@k', 'ndcg@k'.
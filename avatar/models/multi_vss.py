@@ -1,9 +1,12 @@
 import os.path as osp
 import torch
-from typing import Any, Union, List, Dict
+from typing import Any, Union, List, Tuple
 from avatar.models.model import ModelForQA
 from avatar.models.vss import VSS
-from stark_qa.tools.api import get_openai_embeddings
+from avatar.utils.doc_cache import get_doc_info
+from avatar.utils.emb_store import EmbeddingStore, chunk_store_path
+from avatar.utils.topk import RankedResult, aggregate_segments
+from avatar.utils.api import get_openai_embeddings
 from stark_qa.tools.process_text import chunk_text
 
 
@@ -41,11 +44,12 @@ class MultiVSS(ModelForQA):
         self.chunk_emb_dir = chunk_emb_dir
         self.candidates_emb_dir = candidates_emb_dir
         self.parent_vss = VSS(kb, query_emb_dir, candidates_emb_dir, emb_model=emb_model)
+        self.chunk_emb_store = EmbeddingStore.open(chunk_store_path(chunk_emb_dir, chunk_size))
 
     def forward(self, 
                 query: Union[str, List[str]],
                 query_id: Union[int, List[int]],
-                **kwargs: Any) -> Dict[int, float]:
+                **kwargs: Any) -> RankedResult:
         """
         Forward pass to compute predictions for the given query using MultiVSS.
 
@@ -54,43 +58,57 @@ class MultiVSS(ModelForQA):
             query_id (Union[int, list]): Query index.
             
         Returns:
-            pred_dict (dict): A dictionary of predicted scores or answer ids.
+            pred_dict (RankedResult): Top-k node ids and their aggregated chunk scores.
         """
         query_emb = self.get_query_emb(query, query_id)
 
-        initial_score_dict = self.parent_vss(query, query_id)
-        node_ids = list(initial_score_dict.keys())
-        node_scores = list(initial_score_dict.values())
-
         # Get the ids with top k highest scores
-        top_k_idx = torch.topk(
-            torch.FloatTensor(node_scores),
-            min(self.max_k, len(node_scores)),
-            dim=-1
-        ).indices.view(-1).tolist()
-        top_k_node_ids = [node_ids[i] for i in top_k_idx]
+        top_k_node_ids = self.parent_vss(query, query_id, topk=self.max_k).ids.tolist()
+
+        # Score the chunks of all nodes with one matmul and aggregate them per node
+        chunk_embs, counts = self.get_chunk_embs(top_k_node_ids)
+        device = self.parent_vss.device
+        similarity = torch.matmul(chunk_embs.to(device), query_emb.view(-1).to(device).float())
+        scores = aggregate_segments(similarity, counts, self.aggregate)
+        return RankedResult(torch.LongTensor(top_k_node_ids), scores.cpu())
 
-        pred_dict = {}
-        for node_id in top_k_node_ids:
-            doc = self.kb.get_doc_info(node_id, add_rel=True, compact=True)
-            chunks = chunk_text(doc, chunk_size=self.chunk_size)
-            chunk_path = osp.join(self.chunk_emb_dir, f'{node_id}_size={self.chunk_size}.pt')
-            if osp.exists(chunk_path):
-                chunk_embs = torch.load(chunk_path)
-            else:
-                chunk_embs = get_openai_embeddings(chunks, model=self.emb_model)
-                torch.save(chunk_embs, chunk_path)
-            print(f'chunk_embs.shape: {chunk_embs.shape}')
+    def get_chunk_embs(self, node_ids: List[int]) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Get the chunk embeddings of nodes. Chunks missing from the chunk store are embedded in one batch
+        (or loaded from legacy per-node files) and appended to the store.
 
-            similarity = torch.matmul(query_emb.cuda(), chunk_embs.cuda().T).cpu().view(-1)
-            if self.aggregate == 'max':
-                pred_dict[node_id] = torch.max(similarity).item()
-            elif self.aggregate == 'avg':
-                pred_dict[node_id] = torch.mean(similarity).item()
-            elif 'top' in self.aggregate:
-                k = int(self.aggregate.split('_')[0][len('top'):])
-                pred_dict[node_id] = torch.mean(
-                    torch.topk(similarity, k=min(k, len(chunks)), dim=-1).values
-                ).item()
+        Args:
+            node_ids (List[int]): Node ids.
+
+        Returns:
+            chunk_embs (torch.FloatTensor): Concatenated chunk embeddings of all nodes, of size (sum(counts), hidden_dim).
+            counts (torch.LongTensor): Number of chunks of each node.
+        """
+        store = self.chunk_emb_store
+        missing = [node_id for node_id in node_ids if store is None or node_id not in store]
+        if len(missing) > 0 and store is not None:
+            # other processes may have added them in the meantime
+            store.refresh()
+            missing = [node_id for node_id in missing if node_id not in store]
+        if len(missing) > 0:
+            embs, to_embed = {}, {}
+            for node_id in missing:
+                chunk_path = osp.join(self.chunk_emb_dir, f'{node_id}_size={self.chunk_size}.pt')
+                if osp.exists(chunk_path):
+                    embs[node_id] = torch.load(chunk_path).float()
+                else:
+                    doc = get_doc_info(self.kb, node_id, add_rel=True, compact=True)
+                    to_embed[node_id] = chunk_text(doc, chunk_size=self.chunk_size)
+            if len(to_embed) > 0:
+                chunks = sum(to_embed.values(), [])
+                print(f'Embedding {len(chunks)} chunks of {len(to_embed)} nodes')
+                new_embs = get_openai_embeddings(chunks, model=self.emb_model)
+                embs.update(zip(to_embed.keys(), torch.split(new_embs.float(), [len(c) for c in to_embed.values()])))
 
-        return pred_dict
+            if store is None:
+                store = EmbeddingStore.open_or_create(chunk_store_path(self.chunk_emb_dir, self.chunk_size), 
+                                                      dim=next(iter(embs.values())).size(-1))
+                self.chunk_emb_store = store
+            store.append(missing, torch.cat([embs[node_id].view(-1, store.dim) for node_id in missing], dim=0),
+                         counts=[embs[node_id].view(-1, store.dim).size(0) for node_id in missing])
+        return store.get_ragged(node_ids)
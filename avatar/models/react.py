@@ -8,12 +8,11 @@ import requests
 from PIL import Image
 from typing import Any, Dict
 
-from avatar.tools import assigned_funcs, customized_funcs, general_funcs
+from avatar.tools import assigned_funcs, customized_funcs, general_funcs, Print2File
 from avatar.utils.timer import exit_after
 
 from avatar.models.vss import VSS
 from avatar.models.model import ModelForQA
-from stark_qa.tools.api import get_openai_embedding
 from avatar.tools.react.api import get_llm_output_tools
 from avatar.utils.error_handler import string_exec_error_handler
 from avatar.utils.image import image_to_base64
@@ -33,6 +32,7 @@ class ReactEnv:
         initial_temperature=0.2,
         n_init_candidates=20,
         use_chunk=False,
+        emb_dtype='float32',
     ):
         """
         Initialize the environment.
@@ -57,6 +57,7 @@ class ReactEnv:
         self.use_chunk = use_chunk
         self.dataset = dataset
         self.n_init_candidates = n_init_candidates
+        self.emb_dtype = emb_dtype
         self.APIs = self._get_APIs()
         self.embedding_list = []
 
@@ -82,6 +83,7 @@ class ReactEnv:
             'chunk_size': self.chunk_size,
             'chunk_emb_dir': self.chunk_emb_dir,
             'node_emb_dir': self.node_emb_dir,
+            'emb_dtype': self.emb_dtype,
             'debug_print_path': self.debug_print_path,
             'n_limit': self.n_limit
         }
@@ -98,6 +100,14 @@ class ReactEnv:
         variables.update({'exit_after': exit_after})
         return variables
 
+    def close(self):
+        """
+        Release the resources of the APIs, i.e., write the pending debug prints.
+        """
+        for func in self.funcs:
+            if isinstance(func, Print2File):
+                func.close()
+
     def reset(self, seed=None, return_info=False, options=None):
         # We need the following line to seed self.np_random
         # super().reset(seed=seed)
@@ -363,7 +373,10 @@ class React(ModelForQA):
         n_init_candidates=20,
         n_limit=100,
         dataset="amazon",
-        vision=False
+        vision=False,
+        emb_dtype="float32",
+        ann_index=None,
+        ann_probe=32
     ):
         """
         Answer the query by GPT model.
@@ -388,10 +401,12 @@ class React(ModelForQA):
         self.database = database
         self.dataset = dataset
         self.vision = vision
+        self.emb_dtype = emb_dtype
         self.debug_print_dir = osp.join(output_dir, "debug_print")
         self.debug_print_path = osp.join(self.debug_print_dir, f"{os.getpid()}.txt")
         os.makedirs(self.debug_print_dir, exist_ok=True)
-        self.parent_vss = VSS(database, query_emb_dir, node_emb_dir)
+        self.parent_vss = VSS(database, query_emb_dir, node_emb_dir, emb_dtype=emb_dtype, 
+                              ann_index=ann_index, ann_probe=ann_probe)
 
     def step(self, env, action, action_param):
         attempts = 0
@@ -746,6 +761,7 @@ class React(ModelForQA):
             initial_temperature=0.2,
             n_init_candidates=self.n_init_candidates,
             use_chunk=False,
+            emb_dtype=self.emb_dtype,
         )
         env.reset()
         print("React env setup done")
@@ -755,15 +771,19 @@ class React(ModelForQA):
         initial_score_dict, vss_top_candidates = self.get_parent_topk(
             query, query_id, topk=self.n_init_candidates
         )
-        succ, final_answers, r, info, history, fail_flag = self.react_think(
-            env, 
-            query, 
-            prompt, 
-            vss_top_candidates=vss_top_candidates, 
-            model_name=self.llm_func_model,
-            tool_list=tool_list,
-            in_context_examples=in_context_examples,
-            key_insights=key_insights)
+        try:
+            succ, final_answers, r, info, history, fail_flag = self.react_think(
+                env, 
+                query, 
+                prompt, 
+                vss_top_candidates=vss_top_candidates, 
+                model_name=self.llm_func_model,
+                tool_list=tool_list,
+                in_context_examples=in_context_examples,
+                key_insights=key_insights)
+        finally:
+            # An environment is built per query
+            env.close()
         
         print("Found the answer:", final_answers)
         # print(f'{type(final_answers)=}')
@@ -828,29 +848,8 @@ class React(ModelForQA):
         return fail_exec, code
 
     def get_parent_topk(self, query, query_id, topk=100):
-        if query_id is None:
-            query_emb = get_openai_embedding(query)
-        else:
-            query_emb_path = osp.join(self.query_emb_dir, f"query_{query_id}.pt")
-            if os.path.exists(query_emb_path):
-                query_emb = torch.load(query_emb_path).view(1, -1)
-            else:
-                query_emb = get_openai_embedding(query)
-                torch.save(query_emb, query_emb_path)
-
-        initial_score_dict = self.parent_vss(query, query_id)
-        node_ids = list(initial_score_dict.keys())
-        node_scores = list(initial_score_dict.values())
-
         # get the ids with top k highest scores
-        top_k_idx = (
-            torch.topk(
-                torch.FloatTensor(node_scores), min(topk, len(node_scores)), dim=-1
-            )
-            .indices.view(-1)
-            .tolist()
-        )
-
-        vss_top_candidates = [node_ids[i] for i in top_k_idx]
+        initial_score_dict = self.parent_vss(query, query_id, topk=topk)
+        vss_top_candidates = initial_score_dict.ids.tolist()
         return initial_score_dict, vss_top_candidates
 
@@ -1,8 +1,18 @@
 import os.path as osp
+import numpy as np
 import torch
-from typing import Any
+from typing import Any, List, Tuple
 from avatar.models.model import ModelForQA
-from tqdm import tqdm
+from avatar.utils.ann_index import ANNIndex
+from avatar.utils.emb_store import (
+    EmbeddingStore,
+    build_store_from_files,
+    candidate_store_path,
+    dequantize,
+    load_store,
+    quantized_matmul
+)
+from avatar.utils.topk import RankedResult
 
 
 class VSS(ModelForQA):
@@ -11,7 +21,13 @@ class VSS(ModelForQA):
                  kb, 
                  query_emb_dir: str, 
                  candidates_emb_dir: str, 
-                 emb_model: str = 'text-embedding-ada-002'):
+                 emb_model: str = 'text-embedding-ada-002',
+                 device: str = None,
+                 keep_resident: bool = True,
+                 emb_dtype: str = 'float32',
+                 ann_index: str = None,
+                 ann_probe: int = 32,
+                 ann_refine: int = 4):
         """
         Vector Similarity Search
 
@@ -20,43 +36,177 @@ class VSS(ModelForQA):
             query_emb_dir (str): Directory to query embeddings.
             candidates_emb_dir (str): Directory to candidate embeddings.
             emb_model (str): Embedding model name.
+            device (str): Device to score candidates on. Defaults to cuda if available, otherwise cpu.
+            keep_resident (bool): Keep the candidate matrix resident on `device`. If False on GPU, 
+                                  the matrix stays in pinned host memory and is copied per call.
+            emb_dtype (str): Storage dtype of the candidate matrix ('float32', 'float16', 'bfloat16' or 'int8').
+                             Non-float32 matrices are kept in the storage dtype and dequantized when scoring.
+            ann_index (str): If set ('ivfpq' or 'hnswpq'), top-k retrieval queries an approximate nearest-neighbour 
+                             index persisted next to the candidate embeddings. Requires faiss.
+            ann_probe (int): Recall-vs-latency knob of the ANN index (`nprobe` for 'ivfpq', `efSearch` for 'hnswpq').
+            ann_refine (int): The ANN index shortlists `ann_refine * topk` candidates, which are then re-scored exactly.
         """
         super().__init__(kb)
         self.emb_model = emb_model
         self.query_emb_dir = query_emb_dir
         self.candidates_emb_dir = candidates_emb_dir
+        self.device = torch.device(device if device else ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.keep_resident = keep_resident
+        self.emb_dtype = emb_dtype
 
         candidate_emb_path = osp.join(candidates_emb_dir, 'candidate_emb_dict.pt')
-        if osp.exists(candidate_emb_path):
-            candidate_emb_dict = torch.load(candidate_emb_path)
-            print(f'Loaded candidate_emb_dict from {candidate_emb_path}!')
+        store_path = candidate_store_path(candidates_emb_dir)
+        # Shared with the embedding tools and other models through the process-wide store registry
+        candidate_store = load_store(store_path, candidate_emb_path, ids=self.candidate_ids)
+        if candidate_store is None or (candidate_store.positions(self.candidate_ids) < 0).any():
+            # Load the missing candidates from per-candidate files, resuming any earlier partial build
+            build_store_from_files(store_path, self.candidate_ids, 
+                                   lambda idx: osp.join(candidates_emb_dir, f'{idx}.pt'), 
+                                   check_stale=False)
+            candidate_store = load_store(store_path)
+            if candidate_store is not None:
+                candidate_store.refresh()
+        assert candidate_store is not None and (candidate_store.positions(self.candidate_ids) >= 0).all(), \
+            f'Embeddings of some candidates are missing in {candidates_emb_dir}'
+        print(f'Loaded candidate embeddings from {store_path}!')
+
+        self.ann_index = None
+        self.ann_refine = ann_refine
+        if ann_index is not None:
+            ann_index_path = osp.join(candidates_emb_dir, f'candidate_ann_{ann_index}.index')
+            self.ann_index = ANNIndex.load_or_build(ann_index_path, self._aligned(candidate_store)[0], 
+                                                    ids=self.candidate_ids, 
+                                                    version=candidate_store.meta.get('version', 0),
+                                                    index_type=ann_index, probe=ann_probe)
+
+        # Only the rows in the storage dtype are moved to the device; they are dequantized when scoring
+        if emb_dtype != 'float32':
+            candidate_store = load_store(store_path, dtype=emb_dtype)
+        self.candidate_store = candidate_store
+        candidate_embs, candidate_scales = self._aligned(candidate_store)
+        candidate_embs = candidate_embs.contiguous()
+        if self.device.type == 'cuda' and not keep_resident:
+            candidate_embs = candidate_embs.pin_memory()
         else:
-            print('Loading candidate embeddings...')
-            candidate_emb_dict = {}
-            for idx in tqdm(self.candidate_ids):
-                candidate_emb_dict[idx] = torch.load(osp.join(candidates_emb_dir, f'{idx}.pt'))
-            torch.save(candidate_emb_dict, candidate_emb_path)
-            print(f'Saved candidate_emb_dict to {candidate_emb_path}!')
+            candidate_embs = candidate_embs.to(self.device)
+        self.register_buffer('candidate_embs', candidate_embs, persistent=False)
+        self.register_buffer('candidate_scales', 
+                             None if candidate_scales is None else candidate_scales.to(self.device), 
+                             persistent=False)
+        self.candidate_id_tensor = torch.LongTensor(self.candidate_ids)
 
-        assert len(candidate_emb_dict) == len(self.candidate_ids)
-        candidate_embs = [candidate_emb_dict[idx].view(1, -1) for idx in self.candidate_ids]
-        self.candidate_embs = torch.cat(candidate_embs, dim=0)
+    def _aligned(self, store: EmbeddingStore) -> Tuple[torch.Tensor, torch.FloatTensor]:
+        """
+        Rows of `store` (in the storage dtype) and their int8 scales, in the order of `self.candidate_ids`.
+        """
+        if np.array_equal(store.ids, self.candidate_ids):
+            # zero-copy view of the memory-mapped matrix
+            return store.embs, store.scales
+        rows = torch.from_numpy(store.offsets[store.positions(self.candidate_ids)])
+        return store.embs[rows], None if store.scales is None else store.scales[rows]
 
     def forward(self, 
                 query: str, 
                 query_id: int, 
-                **kwargs: Any) -> dict:
+                topk: int = -1,
+                **kwargs: Any) -> RankedResult:
         """
         Forward pass to compute similarity scores for the given query.
 
         Args:
             query (str): Query string.
             query_id (int): Query index.
+            topk (int): Number of top candidates to keep. If topk <= 0, keep all candidates.
+
+        Returns:
+            pred_dict (RankedResult): Candidate ids and their corresponding similarity scores.
+        """
+        query_emb = self.get_query_emb(query, query_id)
+        if topk > 0 and self.ann_index is not None:
+            topk_ids, topk_scores = self.search(query_emb, topk)
+            valid = topk_ids[0] >= 0
+            return RankedResult(topk_ids[0][valid], topk_scores[0][valid], is_sorted=True)
+        similarity = self.score(query_emb).view(-1)
+        pred_dict = RankedResult(self.candidate_id_tensor, similarity.cpu())
+        return pred_dict.topk(topk) if topk > 0 else pred_dict
+
+    def score(self, query_embs: torch.Tensor) -> torch.FloatTensor:
+        """
+        Compute similarity scores between query embeddings and all candidates on `self.device`.
+
+        Args:
+            query_embs (torch.Tensor): Query embeddings of size (n, hidden_dim).
+
+        Returns:
+            similarity (torch.FloatTensor): Similarity scores of size (n, num_candidates) on `self.device`.
+        """
+        candidate_embs = self.candidate_embs
+        if candidate_embs.device != self.device:
+            candidate_embs = candidate_embs.to(self.device, non_blocking=True)
+        return quantized_matmul(query_embs.to(self.device), candidate_embs, self.candidate_scales)
+
+    def forward_batch(self, 
+                      queries: List[str], 
+                      query_ids: List[int], 
+                      topk: int = 100) -> Tuple[torch.LongTensor, torch.FloatTensor]:
+        """
+        Score a batch of queries against all candidates with a single matmul.
+
+        Args:
+            queries (List[str]): Query strings.
+            query_ids (List[int]): Query indices, aligned with `queries`.
+            topk (int): Number of top candidates to keep per query. If topk <= 0, rank all candidates.
+
+        Returns:
+            topk_ids (torch.LongTensor): Candidate ids of size (len(queries), k), sorted by descending score.
+            topk_scores (torch.FloatTensor): Similarity scores of size (len(queries), k).
+        """
+        assert len(queries) == len(query_ids), 'queries and query_ids should have the same length'
+        query_embs = torch.cat([
+            self.get_query_emb(query, query_id).view(1, -1)
+            for query, query_id in zip(queries, query_ids)
+        ], dim=0)
+
+        return self.search(query_embs, topk)
+
+    def search(self, 
+               query_embs: torch.Tensor, 
+               topk: int = 100) -> Tuple[torch.LongTensor, torch.FloatTensor]:
+        """
+        Retrieve the top-k candidates for each query embedding, through the ANN index if there is one.
+
+        Args:
+            query_embs (torch.Tensor): Query embeddings of size (n, hidden_dim).
+            topk (int): Number of top candidates to keep per query. If topk <= 0, rank all candidates exactly.
 
         Returns:
-            pred_dict (dict): A dictionary of candidate ids and their corresponding similarity scores.
+            topk_ids (torch.LongTensor): Candidate ids of size (n, k), sorted by descending score. 
+                                         Slots the ANN index could not fill have id -1 and score -inf.
+            topk_scores (torch.FloatTensor): Similarity scores of size (n, k).
         """
-        query_emb = self.get_query_emb(query, query_id, emb_model=self.emb_model)
-        similarity = torch.matmul(query_emb.cuda(), self.candidate_embs.cuda().T).cpu().view(-1)
-        pred_dict = {self.candidate_ids[i]: similarity[i] for i in range(len(self.candidate_ids))}
-        return pred_dict
+        if topk <= 0 or self.ann_index is None:
+            similarity = self.score(query_embs)
+            k = len(self.candidate_ids) if topk <= 0 else min(topk, len(self.candidate_ids))
+            topk_scores, topk_idx = torch.topk(similarity, k=k, dim=-1, sorted=True)
+            topk_ids = self.candidate_id_tensor[topk_idx.cpu()]
+            return topk_ids, topk_scores.cpu()
+
+        # Shortlist with the ANN index, then re-score the shortlist exactly
+        k = min(topk, len(self.candidate_ids))
+        _, rows = self.ann_index.search(query_embs, min(k * self.ann_refine, len(self.candidate_ids)))
+        valid = rows >= 0
+        rows = rows.clamp(min=0)
+        candidate_rows = rows.to(self.candidate_embs.device)
+        candidate_embs = dequantize(
+            self.candidate_embs[candidate_rows],
+            None if self.candidate_scales is None else self.candidate_scales[candidate_rows.to(self.device)]
+        ).to(self.device)
+        query_embs = query_embs.view(len(rows), 1, -1).to(self.device).float()
+        scores = torch.matmul(query_embs, candidate_embs.transpose(1, 2)).view(len(rows), -1).cpu()
+        scores[~valid] = float('-inf')
+
+        topk_scores, topk_idx = torch.topk(scores, k=min(k, scores.size(1)), dim=-1, sorted=True)
+        topk_rows = torch.gather(rows, 1, topk_idx)
+        topk_ids = self.candidate_id_tensor[topk_rows]
+        topk_ids[torch.isinf(topk_scores)] = -1
+        return topk_ids, topk_scores
@@ -1,12 +1,12 @@
 from .clip import GetCLIPImageEmbedding, GetCLIPTextEmbedding
-from .compute_metrics import ComputeExactMatchDirect, ComputeExactMatchScore, ComputeF1Direct, ComputeF1Score, ComputeRecallDirect, ComputeRecallScore
+from .compute_metrics import ComputeBM25Score, ComputeExactMatchDirect, ComputeExactMatchScore, ComputeF1Direct, ComputeF1Score, ComputeRecallDirect, ComputeRecallScore
 from .debug_print import Print2File
 from .embedding import ComputeCosineSimilarity, ComputeQueryNodeSimilarity, ComputeSimilarity, GetNodeEmbedding, GetTextEmbedding
 from .flickr30k_entities import GetBagOfPhrases, GetFlickrTextInfo, GetImagePatchByPhraseId, GetImages, GetPatchID2PhraseDict
 from .llm_funcs import LLMCheck, LLMClassification, LLMClassifyNode, LLMExtractInfo, LLMScore, LLMSummarize, LLMVQA, LLMVisualAttribute
-from .nodes import GetNodeIDs, GetNodeType
+from .nodes import FilterNodesByType, GetNodeIDs, GetNodeType, GetNodeTypes
 from .parser import QueryParser
-from .relational_extraction import GetRelatedNodes, GetRelationDict, GetRelationTypes
+from .relational_extraction import GetKHopNeighbors, GetRelatedNodes, GetRelationDict, GetRelationDicts, GetRelationTypes
 from .text_extraction import GetFullInfo, GetRelevantChunk, GetRelationInfo, GetTextInfo
 
 
@@ -16,6 +16,8 @@ assigned_funcs = {
         "parse_query",
         "get_node_ids_by_type",
         "get_node_type_by_id",
+        "get_node_types_by_ids",
+        "filter_node_ids_by_type",
         "get_full_info",
         "get_text_info",
         "get_relation_info",
@@ -24,10 +26,13 @@ assigned_funcs = {
         "get_node_embedding",
         "get_relation_dict",
         "get_related_nodes",
+        "get_relation_dicts",
+        "get_k_hop_neighbors",
         "compute_query_node_similarity",
         "compute_exact_match_score",
         "compute_cosine_similarity",
         "compute_recall_score",
+        "compute_bm25_score",
         "summarize_texts_by_llm",
         "classify_by_llm", 
         "extract_relevant_info_by_llm",
@@ -58,6 +63,8 @@ general_funcs = {
     'parse_query': QueryParser,
     'get_node_ids_by_type': GetNodeIDs,
     'get_node_type_by_id': GetNodeType,
+    'get_node_types_by_ids': GetNodeTypes,
+    'filter_node_ids_by_type': FilterNodesByType,
     'get_text_info': GetTextInfo,
     'get_relation_info': GetRelationInfo,
     'get_full_info': GetFullInfo,
@@ -69,12 +76,15 @@ general_funcs = {
     'get_relation_types': GetRelationTypes,
     'get_relation_dict': GetRelationDict,
     'get_related_nodes': GetRelatedNodes,
+    'get_relation_dicts': GetRelationDicts,
+    'get_k_hop_neighbors': GetKHopNeighbors,
     'compute_similarity': ComputeSimilarity,
     'compute_cosine_similarity': ComputeCosineSimilarity,
     'compute_query_node_similarity': ComputeQueryNodeSimilarity,
     'compute_exact_match_score': ComputeExactMatchScore,
     'compute_recall_score': ComputeRecallScore,
     'compute_f1_score': ComputeF1Score,
+    'compute_bm25_score': ComputeBM25Score,
     'compute_exact_match': ComputeExactMatchDirect,
     'compute_recall': ComputeRecallDirect,
     'compute_f1': ComputeF1Direct,
@@ -1,7 +1,9 @@
 from typing import List
+from avatar.utils.bm25 import BM25Index, bm25_index_path, load_bm25_index
 from avatar.utils.format import format_checked
+from avatar.utils.lexical import get_lexical_index
 from avatar.tools.tool import Tool
-from stark_qa.tools.process_text import exact_match_score, recall_score, f1_score
+from stark_qa.tools.process_text import recall_score, f1_score
 
 
 class ComputeF1Score(Tool): 
@@ -29,8 +31,7 @@ class ComputeF1Score(Tool):
         Returns:
             List[float]: List of F1 scores for each node.
         """
-        docs = [self.kb.get_doc_info(node_id, add_rel=False, compact=True) for node_id in node_ids]
-        return [f1_score(string.lower(), doc.lower()) for doc in docs]
+        return get_lexical_index(self.kb, add_rel=False, compact=True).f1_scores(string, node_ids)
 
     def __str__(self):
         return 'compute_f1_score(string: str, node_ids: List[int]) -> f1_match_score: List[float]'
@@ -67,8 +68,7 @@ class ComputeRecallScore(Tool):
         Returns:
             List[float]: List of recall scores for each node.
         """
-        docs = [self.kb.get_doc_info(node_id, add_rel=False, compact=True) for node_id in node_ids]
-        return [recall_score(string.lower(), doc.lower()) for doc in docs]
+        return get_lexical_index(self.kb, add_rel=False, compact=True).recall_scores(string, node_ids)
 
     def __str__(self):
         return 'compute_recall_score(string: str, node_ids: List[int]) -> recall: List[float]'
@@ -105,8 +105,7 @@ class ComputeExactMatchScore(Tool):
         Returns:
             List[float]: List of exact match scores for each node.
         """
-        docs = [self.kb.get_doc_info(node_id, add_rel=False, compact=True) for node_id in node_ids]
-        return [int(string.lower() in doc.lower()) for doc in docs]
+        return get_lexical_index(self.kb, add_rel=False, compact=True).exact_match_scores(string, node_ids)
 
     def __str__(self):
         return 'compute_exact_match_score(string: str, node_ids: List[int]) -> exact_match_score: List[float].'
@@ -117,6 +116,47 @@ class ComputeExactMatchScore(Tool):
                 "indicating that 'H&M' is included in the full information of the brand node with ID 3000 but not in the brand node with ID 2000.")
 
 
+class ComputeBM25Score(Tool): 
+    """
+    Class to compute BM25 keyword scores for a given query against a list of nodes in the knowledge base.
+    
+    Args:
+        kb: The knowledge base containing the nodes.
+        node_emb_dir (str): The directory where the BM25 index of the candidates is saved or loaded.
+        **kwargs: Additional arguments.
+    """
+
+    def __init__(self, kb, node_emb_dir: str, **kwargs):
+        assert hasattr(kb, 'get_doc_info'), "kb must have a method 'get_doc_info'"
+        super().__init__(kb=kb)
+        self.index_path = bm25_index_path(node_emb_dir)
+        # Built up front, so that the first call of a timed action does not index all candidates
+        self.index: BM25Index = load_bm25_index(self.index_path, kb)
+
+    @format_checked
+    def __call__(self, query: str, node_ids: List[int]) -> List[float]:
+        """
+        Compute BM25 scores between the query and the full information of nodes in the knowledge base.
+
+        Args:
+            query (str): The query or keywords to match.
+            node_ids (List[int]): List of node IDs in the knowledge base.
+
+        Returns:
+            List[float]: List of BM25 scores for each node.
+        """
+        return self.index.score(query, node_ids).tolist()
+
+    def __str__(self):
+        return 'compute_bm25_score(query: str, node_ids: List[int]) -> bm25_score: List[float]'
+
+    def __repr__(self):
+        return ("For each node in `node_ids`, compute the BM25 keyword matching score between `query` and the full information of the node. "
+                "For example, compute_bm25_score(query='waterproof hiking boots', node_ids=[2000, 3000]) returns a list of non-negative scores, e.g., [0.0, 7.3], "
+                "where higher scores mean that more (and rarer) words of `query` occur in the node information. Scores are not normalized to [0, 1]. "
+                "This function is much cheaper than reading the node information and complements the embedding similarity.")
+
+
 class ComputeF1Direct(Tool): 
     """
     Class to compute F1 score for a given string against a list of other strings.
@@ -1,21 +1,69 @@
+import atexit
 import os
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
 from avatar.tools.tool import Tool
 
 
+# A single writer thread shared by all loggers keeps the operations on each file in order
+_writer, _writer_pid = None, None
+_writer_lock = threading.Lock()
+_loggers = weakref.WeakSet()
+
+
+def _submit(fn: Callable, *args: Any) -> Future:
+    global _writer, _writer_pid
+    with _writer_lock:
+        # The writer thread does not survive a fork
+        if _writer is None or _writer_pid != os.getpid():
+            _writer, _writer_pid = ThreadPoolExecutor(max_workers=1, thread_name_prefix='debug-print'), os.getpid()
+        return _writer.submit(fn, *args)
+
+
+def _shutdown_writer_if_unused():
+    global _writer
+    with _writer_lock:
+        if len(_loggers) > 0 or _writer is None or _writer_pid != os.getpid():
+            return
+        writer, _writer = _writer, None
+    # Writes already submitted are completed before the thread exits
+    writer.shutdown(wait=True)
+
+
+@atexit.register
+def _flush_at_exit():
+    # The writer thread has already finished its queue when the interpreter exits
+    for logger in list(_loggers):
+        logger._flush_now()
+
+
 class Print2File(Tool):
     """
     A class to write debug strings to a specified file.
 
+    Strings are kept in memory and appended to the file by a background thread, once `flush_size` characters
+    are pending or when the logger is disabled, so that debug prints in loops do not cost a write each.
+
     Args:
         debug_print_path (str): The file path to write debug strings.
         size (int): The maximum number of characters to read back from the file.
+        flush_size (int): The number of pending characters that triggers a write to the file.
         **kwargs: Additional arguments.
     """
-    
-    def __init__(self, debug_print_path: str, size: int = 1024, **kwargs):
+
+    def __init__(self, debug_print_path: str, size: int = 1024, flush_size: int = 65536, **kwargs):
         self.active = False
         self.debug_print_path = debug_print_path
         self.size = size
+        self.flush_size = flush_size
+        # The first `size` characters written since the last `clean_file`, which is all `get_written` returns
+        self.head, self.head_len = [], 0
+        # Strings not yet appended to the file
+        self.pending, self.pending_len = [], 0
+        self.lock = threading.Lock()
+        _loggers.add(self)
         super().__init__()
 
     def __call__(self, string: str):
@@ -30,21 +78,72 @@ class Print2File(Tool):
                 string = str(string)
             except Exception as e:
                 raise ValueError(f'Cannot convert {string} to string: {e}')
-            with open(self.debug_print_path, 'a+') as f:
-                f.write(string + '\n')
+            string = string + '\n'
+            with self.lock:
+                if self.head_len < self.size:
+                    self.head.append(string[:self.size - self.head_len])
+                    self.head_len += len(self.head[-1])
+                self.pending.append(string)
+                self.pending_len += len(string)
+                pending_len = self.pending_len
+            if pending_len >= self.flush_size:
+                self.flush()
+
+    def _append(self, string: str):
+        with open(self.debug_print_path, 'a+') as f:
+            f.write(string)
+
+    def _remove(self):
+        if os.path.exists(self.debug_print_path):
+            os.remove(self.debug_print_path)
+
+    def flush(self, wait: bool = False):
+        """
+        Append the pending strings to the file in the background.
+
+        Args:
+            wait (bool): Whether to wait until all writes so far have reached the file.
+        """
+        with self.lock:
+            string = ''.join(self.pending)
+            self.pending, self.pending_len = [], 0
+        if string:
+            _submit(self._append, string)
+        if wait:
+            _submit(lambda: None).result()
+
+    def _flush_now(self):
+        with self.lock:
+            string = ''.join(self.pending)
+            self.pending, self.pending_len = [], 0
+        if string:
+            self._append(string)
+
+    def close(self):
+        """
+        Write the pending strings to the file and stop logging. The writer thread is shut down once no
+        logger is left, and started again if needed.
+        """
+        self.active = False
+        self.flush(wait=True)
+        _loggers.discard(self)
+        _shutdown_writer_if_unused()
 
     def clean_file(self):
         """
         Remove the debug file if it exists.
         """
-        if os.path.exists(self.debug_print_path):
-            os.remove(self.debug_print_path)
+        with self.lock:
+            self.head, self.head_len = [], 0
+            self.pending, self.pending_len = [], 0
+        _submit(self._remove)
 
     def disable(self):
         """
         Disable the logging functionality.
         """
         self.active = False
+        self.flush()
 
     def enable(self):
         """
@@ -54,16 +153,13 @@ class Print2File(Tool):
 
     def get_written(self) -> str:
         """
-        Read the contents of the debug file up to the specified size.
+        Read the contents of the debug file up to the specified size, without waiting for pending writes.
 
         Returns:
             str: The contents of the debug file.
         """
-        if not os.path.exists(self.debug_print_path):
-            return ''
-        with open(self.debug_print_path, 'r') as f:
-            string = f.read(self.size)
-        return string
+        with self.lock:
+            return ''.join(self.head)
 
     def __str__(self):
         return 'debug_print(string: str) -> NoneType'
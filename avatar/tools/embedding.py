@@ -1,11 +1,20 @@
 import os.path as osp
+import numpy as np
 import torch
 from typing import List, Union
-from tqdm import tqdm
 
 from avatar.utils.format import format_checked
 from avatar.tools.tool import Tool
-from stark_qa.tools.api import get_openai_embedding, get_openai_embeddings
+from avatar.utils.doc_cache import get_doc_info
+from avatar.utils.emb_cache import get_text_embedding, get_text_embeddings
+from avatar.utils.emb_store import (
+    EmbeddingStore,
+    all_node_store_path,
+    candidate_store_path,
+    extra_node_store_path,
+    load_store
+)
+from avatar.utils.api import get_openai_embeddings
 
 
 class GetNodeEmbedding(Tool):
@@ -16,11 +25,13 @@ class GetNodeEmbedding(Tool):
         kb: The knowledge base containing node information.
         node_emb_dir (str): The directory to save or load node embeddings.
         emb_model (str): The name of the model to use for generating embeddings.
+        emb_dtype (str): Storage dtype of the node embeddings ('float32', 'float16', 'bfloat16' or 'int8').
     """
 
     def __init__(self, kb, 
                  node_emb_dir: str, 
                  emb_model: str = 'text-embedding-ada-002',
+                 emb_dtype: str = 'float32',
                  **kwargs):
         assert hasattr(kb, 'get_doc_info'), "kb must have a method 'get_doc_info'"
         super().__init__(kb=kb)
@@ -30,15 +41,16 @@ class GetNodeEmbedding(Tool):
         self.nodes_emb_path = osp.join(node_emb_dir, 'all_node_emb_dict.pt')
         self.candidate_emb_path = osp.join(node_emb_dir, 'candidate_emb_dict.pt')
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-        if osp.exists(self.nodes_emb_path):
-            self.node_emb_dict = torch.load(self.nodes_emb_path)
-            self.node_embs = torch.cat([self.node_emb_dict[i] for i in range(len(self.node_emb_dict))], dim=0)
-        else:
-            if osp.exists(self.candidate_emb_path):
-                self.node_emb_dict = torch.load(self.candidate_emb_path)
         self.candidate_ids = self.kb.candidate_ids
 
+        # Embeddings of all nodes if available, otherwise of the candidates only
+        self.node_emb_store = load_store(all_node_store_path(node_emb_dir), self.nodes_emb_path, dtype=emb_dtype)
+        if self.node_emb_store is None:
+            self.node_emb_store = load_store(candidate_store_path(node_emb_dir), self.candidate_emb_path, 
+                                             ids=self.candidate_ids, dtype=emb_dtype)
+        # Float32 embeddings of nodes outside of the store above, which are computed on demand
+        self.extra_emb_store = None
+
     @format_checked
     def __call__(self, node_ids: Union[int, List[int]]) -> torch.Tensor:
         """
@@ -52,25 +64,78 @@ class GetNodeEmbedding(Tool):
         """
         if isinstance(node_ids, int):
             node_ids = [node_ids]
-
-        embs = []
         print(f'get_node_embedding - input node_ids {len(node_ids)}')
-        if osp.exists(self.nodes_emb_path):
-            return self.node_embs[node_ids]
-        for node_id in node_ids:
-            emb_path = osp.join(self.node_emb_dir, f'{node_id}.pt')
-            if node_id in self.candidate_ids:
-                print('get_node_embedding - load from candidate_ids')
-                emb = self.node_emb_dict[node_id]
-            elif osp.exists(emb_path):
-                print(f'get_node_embedding - load from {emb_path}')
-                emb = torch.load(emb_path)
-            else:
-                print(f'get_node_embedding - compute embedding and save to {emb_path}')
-                emb = get_openai_embedding(self.kb.get_doc_info(node_id, add_rel=True, compact=True), model=self.emb_model)
-                torch.save(emb, emb_path)
-            embs.append(emb)
-        return torch.cat(embs, dim=0).view(len(node_ids), -1)
+        return self.get_embs(node_ids)
+
+    def get_embs(self, node_ids: List[int]) -> torch.Tensor:
+        """
+        Get embeddings for a list of node IDs with one gather over the node embedding store.
+        Unlike `__call__`, this is meant to be called by other tools and skips the argument checks and logging.
+
+        Args:
+            node_ids (List[int]): A list of node IDs.
+
+        Returns:
+            torch.Tensor: A tensor of size (len(node_ids), hidden_dim).
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64).reshape(-1)
+        if self.node_emb_store is not None:
+            pos = self.node_emb_store.positions(node_ids)
+            if (pos >= 0).all():
+                return self.node_emb_store.get(node_ids)
+            missing = pos < 0
+        else:
+            missing = np.ones(len(node_ids), dtype=bool)
+
+        missing_ids, inverse = np.unique(node_ids[missing], return_inverse=True)
+        extra_embs = self.get_extra_embs(missing_ids)
+        embs = torch.empty(len(node_ids), extra_embs.size(-1))
+        embs[torch.from_numpy(missing)] = extra_embs[torch.from_numpy(inverse)]
+        if not missing.all():
+            embs[torch.from_numpy(~missing)] = self.node_emb_store.get(node_ids[~missing])
+        return embs
+
+    def get_extra_embs(self, node_ids: np.ndarray) -> torch.Tensor:
+        """
+        Get embeddings for unique node IDs that are not in the node embedding store. Nodes that are not yet in
+        the extra node store are loaded from legacy `{node_id}.pt` files or embedded in one batched API call,
+        and appended to the extra node store so that later calls only gather them.
+
+        Args:
+            node_ids (np.ndarray): Unique node IDs.
+
+        Returns:
+            torch.Tensor: A tensor of size (len(node_ids), hidden_dim).
+        """
+        store_path = extra_node_store_path(self.node_emb_dir)
+        if self.extra_emb_store is None:
+            self.extra_emb_store = EmbeddingStore.open(store_path)
+        elif not (self.extra_emb_store.positions(node_ids) >= 0).all():
+            # Nodes might have been added by another process
+            self.extra_emb_store.refresh()
+        if self.extra_emb_store is not None:
+            new_ids = node_ids[self.extra_emb_store.positions(node_ids) < 0]
+        else:
+            new_ids = node_ids
+
+        if len(new_ids) > 0:
+            new_embs, api_ids = {}, []
+            for node_id in new_ids.tolist():
+                emb_path = osp.join(self.node_emb_dir, f'{node_id}.pt')
+                if osp.exists(emb_path):
+                    new_embs[node_id] = torch.load(emb_path).view(1, -1).float()
+                else:
+                    api_ids.append(node_id)
+            if len(api_ids) > 0:
+                print(f'get_node_embedding - compute embeddings of {len(api_ids)} nodes')
+                docs = [get_doc_info(self.kb, node_id, add_rel=True, compact=True) for node_id in api_ids]
+                api_embs = get_openai_embeddings(docs, model=self.emb_model).view(len(api_ids), -1).float().cpu()
+                new_embs.update({node_id: emb.view(1, -1) for node_id, emb in zip(api_ids, api_embs)})
+            new_ids = new_ids.tolist()
+            new_embs = torch.cat([new_embs[node_id] for node_id in new_ids], dim=0)
+            self.extra_emb_store = EmbeddingStore.open_or_create(store_path, dim=new_embs.size(-1))
+            self.extra_emb_store.append(new_ids, new_embs)
+        return self.extra_emb_store.get(node_ids)
 
     def __str__(self):
         return 'get_node_embedding(node_ids: Union[int, List[int]]) -> embedding: torch.Tensor'
@@ -108,7 +173,7 @@ class GetTextEmbedding(Tool):
         if isinstance(string, str):
             string = [string]
         assert all([len(s) > 0 for s in string]), 'every string in the list to be embedded should be non-empty'
-        embs = get_openai_embeddings(string, model=self.emb_model)
+        embs = get_text_embeddings(string, model=self.emb_model)
         print(f'get_text_embedding - input {string} - output shape {embs.size()}')
         return embs
 
@@ -130,6 +195,7 @@ class ComputeSimilarity(Tool):
         chunk_emb_dir (str): The directory to save or load chunk embeddings.
         node_emb_dir (str): The directory to save or load node embeddings.
         emb_model (str): The name of the model to use for generating embeddings.
+        emb_dtype (str): Storage dtype of the node embeddings ('float32', 'float16', 'bfloat16' or 'int8').
     """
 
     def __init__(self, kb, 
@@ -137,15 +203,14 @@ class ComputeSimilarity(Tool):
                  chunk_emb_dir: str, 
                  node_emb_dir: str, 
                  emb_model: str = 'text-embedding-ada-002',
+                 emb_dtype: str = 'float32',
                  **kwargs):
         assert hasattr(kb, 'get_doc_info'), "kb must have a method 'get_doc_info'"
         super().__init__(kb=kb)
         self.node_emb_dir = node_emb_dir
         self.emb_model = emb_model
-        candidate_emb_path = osp.join(node_emb_dir, 'candidate_emb_dict.pt')
-        self.candidate_emb_dict = torch.load(candidate_emb_path)
         self.candidate_ids = self.kb.candidate_ids
-        self.get_emb = GetNodeEmbedding(kb, node_emb_dir)
+        self.get_emb = GetNodeEmbedding(kb, node_emb_dir, emb_model=emb_model, emb_dtype=emb_dtype)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     @format_checked
@@ -164,13 +229,10 @@ class ComputeSimilarity(Tool):
 
         if len(node_ids) == 0:
             return []
-        query_emb = get_openai_embedding(query, model=self.emb_model).to(self.device)
+        query_emb = get_text_embedding(query, model=self.emb_model).to(self.device)
         print(f'compute_similarity - query emb {query_emb.size()}')
 
-        embs = []
-        for node_id in node_ids:
-            embs.append(self.get_emb(node_id))
-        embs = torch.cat(embs, dim=0).to(self.device)
+        embs = self.get_emb.get_embs(node_ids).to(self.device)
         sim = torch.matmul(query_emb, embs.T).view(-1)
         print(f'compute_similarity - sim {sim.size()}')
         return sim.cpu().tolist()
@@ -195,6 +257,7 @@ class ComputeQueryNodeSimilarity(Tool):
         chunk_emb_dir (str): The directory to save or load chunk embeddings.
         node_emb_dir (str): The directory to save or load node embeddings.
         emb_model (str): The name of the model to use for generating embeddings.
+        emb_dtype (str): Storage dtype of the node embeddings ('float32', 'float16', 'bfloat16' or 'int8').
     """
 
     def __init__(self, kb, 
@@ -202,15 +265,14 @@ class ComputeQueryNodeSimilarity(Tool):
                  chunk_emb_dir: str, 
                  node_emb_dir: str, 
                  emb_model: str = 'text-embedding-ada-002',
+                 emb_dtype: str = 'float32',
                  **kwargs):
         assert hasattr(kb, 'get_doc_info'), "kb must have a method 'get_doc_info'"
         super().__init__(kb=kb)
         self.emb_model = emb_model
         self.node_emb_dir = node_emb_dir
-        candidate_emb_path = osp.join(node_emb_dir, 'candidate_emb_dict.pt')
-        self.candidate_emb_dict = torch.load(candidate_emb_path)
         self.candidate_ids = self.kb.candidate_ids
-        self.get_emb = GetNodeEmbedding(kb, node_emb_dir)
+        self.get_emb = GetNodeEmbedding(kb, node_emb_dir, emb_model=emb_model, emb_dtype=emb_dtype)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     @format_checked
@@ -226,13 +288,10 @@ class ComputeQueryNodeSimilarity(Tool):
             torch.Tensor: A tensor of similarity scores.
         """
         print(f'compute_query_node_similarity - input query {query}, node_ids {len(node_ids)}')
-        query_emb = get_openai_embedding(query, model=self.emb_model).to(self.device)
+        query_emb = get_text_embedding(query, model=self.emb_model).to(self.device)
         print(f'compute_query_node_similarity - query emb {query_emb.size()}')
 
-        embs = []
-        for node_id in node_ids:
-            embs.append(self.get_emb(node_id))
-        embs = torch.cat(embs, dim=0).to(self.device)
+        embs = self.get_emb.get_embs(node_ids).to(self.device)
         sim = torch.matmul(query_emb, embs.T).view(-1)
         print(f'compute_query_node_similarity - sim {sim.size()}')
         return sim.cpu()
@@ -9,13 +9,21 @@ import PIL
 import json
 from tqdm import tqdm
 
+from avatar.utils.doc_cache import get_doc_info
 from avatar.utils.format import format_checked
+from avatar.utils.node_types import get_node_types
 from avatar.tools.text_extraction import GetRelevantChunk
 from avatar.tools.tool import Tool
-from stark_qa.tools.api import get_llm_output, get_llm_outputs
-from avatar.utils.api_vision import get_llm_vision_outputs
+from avatar.utils.api import get_llm_output, get_llm_outputs, get_llm_vision_outputs
+from avatar.utils.listwise import DEFAULT_LISTWISE_WINDOW, format_candidates, run_listwise
 
 MAX_RETRY = 5
+# Rounds of windowed prompts before the candidates left are prompted for separately
+MAX_LISTWISE_RETRY = 2
+
+
+def _listwise_temperature(initial_temperature: float):
+    return lambda cnt: min(initial_temperature * 2 ** (cnt - 1), 1)
 
 class LLMSummarize(Tool):
     """
@@ -112,17 +120,20 @@ class LLMCheck(Tool):
         n_limit (int): The maximum number of times this function can be used.
         initial_temperature (float): The initial temperature for the LLM model.
         use_chunk (bool): Whether to use chunking for processing.
+        listwise_window (int): Number of nodes checked with one prompt, 0 or 1 to check each node with its own prompt.
     """
 
     def __init__(self, kb, 
                  model_name: str, chunk_size: int = None, chunk_emb_dir: str = None,
-                 n_limit: int = 100, initial_temperature: float = 0.2, use_chunk: bool = False, **kwargs):
+                 n_limit: int = 100, initial_temperature: float = 0.2, use_chunk: bool = False,
+                 listwise_window: int = DEFAULT_LISTWISE_WINDOW, **kwargs):
         assert hasattr(kb, 'get_doc_info'), "kb must have a method 'get_doc_info'"
         assert hasattr(kb, 'get_node_type_by_id'), "kb must have a method 'get_node_type_by_id'"
         self.n_limit = n_limit
         self.use_chunk = use_chunk
         self.model_name = model_name
         self.initial_temperature = initial_temperature
+        self.listwise_window = listwise_window
         if use_chunk:
             self.chunk_emb_dir = chunk_emb_dir
             self.chunk_size = chunk_size
@@ -134,13 +145,14 @@ class LLMCheck(Tool):
         if isinstance(node_ids, int):
             node_ids = [node_ids]
 
-        prompts = {}
-        for node_id in node_ids:
+        prompts, docs = {}, {}
+        node_types = get_node_types(self.kb, node_ids)
+        for node_id, node_type in zip(node_ids, node_types):
             if self.use_chunk:
                 doc = self.chunk_tool(node_id, requirement, k=10, chunk_size=self.chunk_size)
             else:
-                doc = self.kb.get_doc_info(node_id, add_rel=True, compact=False)
-            node_type = self.kb.get_node_type_by_id(node_id)
+                doc = get_doc_info(self.kb, node_id, add_rel=True, compact=False)
+            docs[node_id] = doc
             prompt = (
                 f'Your task is to check if a {node_type} meets the following requirement:\n'
                 f' "{requirement}"\n\n'
@@ -160,6 +172,9 @@ class LLMCheck(Tool):
         temperature = self.initial_temperature
         scores, rationale = {}, {}
         print(f'check_req_by_llm - {len(node_ids)} nodes to check')
+        if self.listwise_window > 1 and len(node_ids) > 1:
+            for node_id, (score, reason) in self._check_listwise(node_ids, node_types, docs, requirement).items():
+                scores[node_id], rationale[node_id] = score, reason
         while len(scores) < len(node_ids):
             cnt += 1
             if cnt > MAX_RETRY // 5:
@@ -169,7 +184,7 @@ class LLMCheck(Tool):
 
             todo_node_ids = [node_id for node_id in node_ids if node_id not in scores.keys()]
             prompt_lst = [prompts[node_id] for node_id in todo_node_ids]
-            answers = get_llm_outputs(prompt_lst, model=self.model_name, temperature=temperature)
+            answers = get_llm_outputs(prompt_lst, model=self.model_name, temperature=temperature, read_cache=cnt == 1)
 
             for node_id, answer in zip(todo_node_ids, answers):
                 if '=>' in answer:
@@ -194,6 +209,42 @@ class LLMCheck(Tool):
             return score_lst, rationale_lst
         return score_lst
 
+    def _check_listwise(self, node_ids: List[int], node_types: List[str], docs: Dict[int, str], requirement: str) -> Dict[int, tuple]:
+        """
+        Check windows of `listwise_window` nodes with one prompt each.
+
+        Returns:
+            Dict[int, tuple]: (result, rationale) by node ID. Nodes without a usable answer are missing.
+        """
+        def build_prompt(window: List[int]) -> str:
+            return (
+                f'Your task is to check if each of the following {len(window)} candidates meets the following requirement:\n'
+                f' "{requirement}"\n\n'
+                f'I will provide you with the information of the candidates:\n\n' +
+                format_candidates([docs[node_ids[pos]] for pos in window], [node_types[pos] for pos in window]) + '\n\n' +
+                f'Check every candidate independently and respond with exactly one line per candidate, in the format "[i] evidence => yes" '
+                f'if the requirement is met, or "[i] your reason => no" if it is not, for each candidate i from 1 to {len(window)}. '
+                f'Example: "[1] the product is from Radio Flyer and the safety certifications indicate it\'s safe for kids => yes".\n\n'
+                f'Note that you should break down the requirement if multiple demands are presented and find the evidence individually. '
+                f'Use "=>" only once per line to indiate your final decision and avoid adding any additional comments after "yes" or "no".\nYour output:\n'
+            )
+
+        def parse_line(line: str) -> Union[tuple, None]:
+            if '=>' not in line:
+                return None
+            parsed_answer = line.split('=>')[1].strip(' "\'\n').split(' ')[0].strip('. "\'\n').lower()
+            if parsed_answer not in ['yes', 'no']:
+                return None
+            return parsed_answer == 'yes', line.split('=>')[0].strip(' \n')
+
+        results = run_listwise(build_prompt, parse_line, [len(docs[node_id]) for node_id in node_ids],
+                               model=self.model_name,
+                               window_size=self.listwise_window,
+                               max_cnt=MAX_LISTWISE_RETRY,
+                               temperature=_listwise_temperature(self.initial_temperature),
+                               max_tokens_per_candidate=256)
+        return {node_ids[pos]: result for pos, result in results.items()}
+
     def __str__(self):
         return 'check_req_by_llm(node_ids: Union[int, List[int]], requirement: str) -> result: List[bool]'
 
@@ -242,7 +293,7 @@ class LLMClassification(Tool):
                 f'Your output should be the class index (a number) only without additional comments. The class index: '
             )
 
-            pred_class = get_llm_output(prompt, self.model_name, temperature=temperature)
+            pred_class = get_llm_output(prompt, self.model_name, temperature=temperature, read_cache=cnt == 1)
             try:
                 pred_class = int(eval(pred_class) - 1)
                 if pred_class >= 0 and pred_class < len(classes):
@@ -301,13 +352,13 @@ class LLMClassifyNode(Tool):
             str_classes = '\n'.join([f'{i + 1}: {cls}' for i, cls in enumerate(classes)])
             prompts = [
                 (f'You are a helpful assistant that classifies a text into the most appropriate class in a list of given classes. \n'
-                 f'This is the text information:\n\n"{self.kb.get_doc_info(node_id, add_rel=False, compact=False)}"\n\n'
+                 f'This is the text information:\n\n"{get_doc_info(self.kb, node_id, add_rel=False, compact=False)}"\n\n'
                  f'Based on the text content, please classify the text into one of the following classes: \n{str_classes}\n'
                  f'Your output should be the class index (a number) only without additional comments. The class index: ')
                 for node_id in node_ids
             ]
 
-            pred_class = get_llm_outputs(prompts, model=self.model_name, temperature=temperature)
+            pred_class = get_llm_outputs(prompts, model=self.model_name, temperature=temperature, read_cache=cnt == 1)
             try:
                 for node_id, pred in zip(node_ids, pred_class):
                     pred = int(eval(pred) - 1)
@@ -341,12 +392,15 @@ class LLMScore(Tool):
         model_name (str): The name of the LLM model to use.
         n_limit (int): The maximum number of times this function can be used.
         initial_temperature (float): The initial temperature for the LLM model.
+        listwise_window (int): Number of nodes scored with one prompt, 0 or 1 to score each node with its own prompt.
     """
 
-    def __init__(self, kb, model_name: str, n_limit: int = 100, initial_temperature: float = 0.2, **kwargs):
+    def __init__(self, kb, model_name: str, n_limit: int = 100, initial_temperature: float = 0.2,
+                 listwise_window: int = DEFAULT_LISTWISE_WINDOW, **kwargs):
         self.model_name = model_name
         self.n_limit = n_limit
         self.initial_temperature = initial_temperature
+        self.listwise_window = listwise_window
         super().__init__(kb=kb)
 
     @format_checked
@@ -354,14 +408,15 @@ class LLMScore(Tool):
         if isinstance(node_ids, int):
             node_ids = [node_ids]
 
-        prompts = {}
-        for node_id in node_ids:
-            node_type = self.kb.get_node_type_by_id(node_id)
+        prompts, docs = {}, {}
+        node_types = get_node_types(self.kb, node_ids)
+        for node_id, node_type in zip(node_ids, node_types):
+            docs[node_id] = get_doc_info(self.kb, node_id, add_rel=True)
             prompt = (
                 f'You are a helpful assistant that examines if a {node_type} satisfies a given query and assign a score from 0.0 to 1.0 based on the degree of satisfaction. If the {node_type} does not satisfy the query, the score should be 0.0. If there exists explicit and strong evidence supporting that {node_type} satisfies the query, the score should be 1.0. If partial evidence or weak evidence exists, the score should be between 0.0 and 1.0.\n'
                 f'Here is the query:\n"{query}"\n'
                 f'Here is the information about the {node_type}:\n' +
-                self.kb.get_doc_info(node_id, add_rel=True) + '\n\n' +
+                docs[node_id] + '\n\n' +
                 f'Please score the {node_type} based on how well it satisfies the query. Your output format should be "your reasoning process => score". '
                 f'For example, the output could be "The product is safe for kids based on the safety certifications and the reviews => 1.0\", or "The product is safe but there is no evidence on its installation tools => 0.5". '
                 f'Please output your answer in the format described above. Use "=>" only once to indiate your final score and avoid adding any additional comments after the score. Your output: '
@@ -369,6 +424,8 @@ class LLMScore(Tool):
             prompts[node_id] = prompt
 
         scores = {}
+        if self.listwise_window > 1 and len(node_ids) > 1:
+            scores.update(self._score_listwise(node_ids, node_types, docs, query))
         cnt = 0
         temperature = self.initial_temperature
         while len(scores) < len(node_ids):
@@ -380,7 +437,7 @@ class LLMScore(Tool):
 
             todo_node_ids = [node_id for node_id in node_ids if node_id not in scores.keys()]
             prompt_lst = [prompts[node_id] for node_id in todo_node_ids]
-            answers = get_llm_outputs(prompt_lst, model=self.model_name, temperature=temperature)
+            answers = get_llm_outputs(prompt_lst, model=self.model_name, temperature=temperature, read_cache=cnt == 1)
 
             for node_id, answer in zip(todo_node_ids, answers):
                 if '=>' in answer:
@@ -394,6 +451,38 @@ class LLMScore(Tool):
         score_lst = [scores[node_id] for node_id in node_ids]
         return score_lst
 
+    def _score_listwise(self, node_ids: List[int], node_types: List[str], docs: Dict[int, str], query: str) -> Dict[int, float]:
+        """
+        Score windows of `listwise_window` nodes with one prompt each.
+
+        Returns:
+            Dict[int, float]: Scores by node ID. Nodes without a usable answer are missing.
+        """
+        def build_prompt(window: List[int]) -> str:
+            return (
+                f'You are a helpful assistant that examines if each of the following {len(window)} candidates satisfies a given query and assigns each a score from 0.0 to 1.0 based on the degree of satisfaction. If a candidate does not satisfy the query, its score should be 0.0. If there exists explicit and strong evidence supporting that a candidate satisfies the query, its score should be 1.0. If partial evidence or weak evidence exists, the score should be between 0.0 and 1.0.\n'
+                f'Here is the query:\n"{query}"\n'
+                f'Here is the information about the candidates:\n\n' +
+                format_candidates([docs[node_ids[pos]] for pos in window], [node_types[pos] for pos in window]) + '\n\n' +
+                f'Please score every candidate independently based on how well it satisfies the query. Output exactly one line per candidate in the format "[i] your reasoning process => score", for each candidate i from 1 to {len(window)}. '
+                f'For example, a line could be "[1] The product is safe for kids based on the safety certifications and the reviews => 1.0", or "[2] The product is safe but there is no evidence on its installation tools => 0.5". '
+                f'Use "=>" only once per line to indiate the final score and avoid adding any additional comments after the score. Your output:\n'
+            )
+
+        def parse_line(line: str) -> Union[float, None]:
+            if '=>' not in line:
+                return None
+            score = find_floating_number(line.split('=>')[1])
+            return score[0] if len(score) > 0 else None
+
+        results = run_listwise(build_prompt, parse_line, [len(docs[node_id]) for node_id in node_ids],
+                               model=self.model_name,
+                               window_size=self.listwise_window,
+                               max_cnt=MAX_LISTWISE_RETRY,
+                               temperature=_listwise_temperature(self.initial_temperature),
+                               max_tokens_per_candidate=256)
+        return {node_ids[pos]: score for pos, score in results.items()}
+
     def __str__(self):
         return 'get_scores_by_llm(node_ids: Union[int, List[int]], query: str) -> scores: List[float]'
 
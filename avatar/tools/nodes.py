@@ -1,6 +1,7 @@
 from typing import List
 from avatar.tools.tool import Tool
 from avatar.utils.format import format_checked
+from avatar.utils.node_types import get_node_type_index, get_node_types
 
 
 class GetNodeIDs(Tool):
@@ -27,6 +28,9 @@ class GetNodeIDs(Tool):
         Returns:
             List[int]: A list of node IDs of the specified type.
         """
+        index = get_node_type_index(self.kb)
+        if index is not None:
+            return index.get_node_ids_by_type(node_type).tolist()
         assert node_type in self.kb.node_type_lst(), f'node_type must be in {self.kb.node_type_lst()}, but got {node_type}'
         return self.kb.get_node_ids_by_type(node_type)
 
@@ -60,10 +64,82 @@ class GetNodeType(Tool):
         Returns:
             str: The type of the specified node.
         """
-        return self.kb.get_node_type_by_id(node_id)
+        return get_node_types(self.kb, [node_id])[0]
 
     def __str__(self):
         return 'get_node_type_by_id(node_id: int) -> node_type: str'
 
     def __repr__(self):
         return 'Return a string representing the node type of the node with id `node_id`.'
+
+
+class GetNodeTypes(Tool):
+    """
+    A class to retrieve the types of a list of node IDs from the knowledge base.
+
+    Args:
+        kb: The knowledge base object containing the node information.
+    """
+
+    def __init__(self, kb, **kwargs):
+        super().__init__(kb=kb)
+        assert hasattr(kb, 'get_node_type_by_id'), "kb must have a method 'get_node_type_by_id'"
+
+    @format_checked
+    def __call__(self, node_ids: List[int]) -> List[str]:
+        """
+        Retrieves the types of the specified node IDs.
+
+        Args:
+            node_ids (List[int]): The IDs of the nodes to retrieve the types for.
+
+        Returns:
+            List[str]: The types of the specified nodes, in the order of `node_ids`.
+        """
+        return get_node_types(self.kb, node_ids)
+
+    def __str__(self):
+        return 'get_node_types_by_ids(node_ids: List[int]) -> node_types: List[str]'
+
+    def __repr__(self):
+        return 'Return a list containing the node type of each node in `node_ids`, in the same order. It is much faster than calling get_node_type_by_id for each node.'
+
+
+class FilterNodesByType(Tool):
+    """
+    A class to keep the node IDs of specified types from a list of node IDs.
+
+    Args:
+        kb: The knowledge base object containing the node information.
+    """
+
+    def __init__(self, kb, **kwargs):
+        super().__init__(kb=kb)
+        assert hasattr(kb, 'node_type_lst'), "kb must have a method 'node_type_lst'"
+        assert hasattr(kb, 'get_node_type_by_id'), "kb must have a method 'get_node_type_by_id'"
+
+    @format_checked
+    def __call__(self, node_ids: List[int], node_types: List[str]) -> List[int]:
+        """
+        Keeps the node IDs whose type is one of the specified types.
+
+        Args:
+            node_ids (List[int]): The IDs of the nodes to filter.
+            node_types (List[str]): The types of nodes to keep.
+
+        Returns:
+            List[int]: The IDs of the nodes of the specified types, in the order of `node_ids`.
+        """
+        index = get_node_type_index(self.kb)
+        if index is not None:
+            return index.filter(node_ids, node_types).tolist()
+        for node_type in node_types:
+            assert node_type in self.kb.node_type_lst(), f'node_type must be in {self.kb.node_type_lst()}, but got {node_type}'
+        return [node_id for node_id in node_ids if self.kb.get_node_type_by_id(node_id) in node_types]
+
+    def __str__(self):
+        return 'filter_node_ids_by_type(node_ids: List[int], node_types: List[str]) -> node_ids: List[int]'
+
+    def __repr__(self):
+        return ("Return the IDs in `node_ids` of the nodes whose type is in `node_types`, keeping their order. "
+                "For example, filter_node_ids_by_type(node_ids=[10, 2000, 3000], node_types=['product']) returns [2000, 3000] if only nodes 2000 and 3000 are products.")
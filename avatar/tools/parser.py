@@ -3,7 +3,8 @@ import os.path as osp
 import json
 from typing import List, Dict
 from avatar.utils.format import format_checked
-from stark_qa.tools.api import get_llm_output
+from avatar.utils.api import get_llm_output
+from avatar.utils.retry import INVALID_OUTPUT, InvalidOutputError, RetryPolicy, call_with_retry
 from avatar.tools.tool import Tool
 
 
@@ -41,15 +42,23 @@ class QueryParser(Tool):
         prompt = prompt.replace('<query>', query)
         prompt = prompt.replace('<attributes>', str(attributes))
         
-        while True:
-            output = get_llm_output(prompt, model=self.parser_model, json_object=True)
-            output = json.loads(output)
+        cnt = 0
+
+        def _parse():
+            nonlocal cnt
+            cnt += 1
+            # A cached invalid response would fail every later call, so retries skip the cache
+            output = get_llm_output(prompt, model=self.parser_model, json_object=True, read_cache=cnt == 1)
             try:
-                assert set(list(output.keys())) == set(attributes)
-                break
-            except Exception as e:
-                print(f'parse_query - keys do not match attributes: {output.keys()} != {attributes}')
-                pass
+                output = json.loads(output)
+            except json.JSONDecodeError:
+                raise InvalidOutputError(f'output is not valid JSON: {output}')
+            if not isinstance(output, dict) or set(output.keys()) != set(attributes):
+                raise InvalidOutputError(f'keys do not match attributes: {output} != {attributes}')
+            return output
+
+        # API errors are already retried by get_llm_output, only invalid outputs are retried here
+        output = call_with_retry(_parse, RetryPolicy(retry_on=(INVALID_OUTPUT,)), description='parse_query')
         
         print('parse_query - query', query, 'attributes', attributes)
         print('parse_query - output', output)
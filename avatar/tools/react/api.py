@@ -2,14 +2,13 @@ import os
 import os.path as osp
 import warnings
 import json
-import time
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
 import anthropic
 import openai
-MAX_OPENAI_RETRY, OPENAI_SLEEP_TIME = 5, 60
-MAX_CLAUDE_RETRY, CLAUDE_SLEEP_TIME = 100, 5
+from avatar.utils.retry import DEFAULT_MAX_ATTEMPTS, DEFAULT_MAX_DELAY, InvalidOutputError, RetryPolicy, \
+    call_with_retry, get_circuit_breaker
 
 registered_text_completion_llms = {
     "gpt-4-1106-preview",
@@ -27,8 +26,8 @@ def get_gpt_output(message,
                    model="gpt-4-1106-preview", 
                    max_tokens=2048, 
                    temperature=1, 
-                   max_retry=5,
-                   sleep_time=60,
+                   max_retry=DEFAULT_MAX_ATTEMPTS,
+                   sleep_time=DEFAULT_MAX_DELAY,
                    json_object=False,
                    history=None,
                    tools=[],
@@ -45,39 +44,38 @@ def get_gpt_output(message,
         messages = history + messages
     kwargs = {"response_format": { "type": "json_object" }} if json_object else {}
 
-    for cnt in range(max_retry):
-        try:
-            chat = openai.OpenAI().chat.completions.create(
-                messages=messages,
-                model=model,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                **kwargs
-                )
-            result = chat.choices[0].message.content 
-        except Exception as e:
-            error = e
-            print(cnt, "=>", e, f' [sleep for {sleep_time} sec]')
-            time.sleep(sleep_time)
-            continue
-            
-        try:
-            if json_object:
-                result = result[result.find("{"):result.rfind("}")+1]
-                return json.loads(result)
-            return result
-        except Exception as e:
-            print(result)
-            print(cnt, "=> (json encode error) ", e)
-    raise error
+    def _request():
+        chat = openai.OpenAI().chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+            )
+        result = chat.choices[0].message.content 
+        if json_object:
+            result = result[result.find("{"):result.rfind("}")+1]
+            return _load_json(result)
+        return result
+
+    return call_with_retry(_request, RetryPolicy(max_attempts=max_retry, max_delay=sleep_time),
+                           get_circuit_breaker(model), description=model)
+
+
+def _load_json(result):
+    try:
+        return json.loads(result)
+    except json.JSONDecodeError as e:
+        print(result)
+        raise InvalidOutputError(f'json encode error: {e}')
 
 def complete_text_claude(message, 
                          model="claude-2.1",
                          json_object=False,
                          max_tokens=2048, 
                          temperature=1, 
-                         max_retry=1,
-                         sleep_time=0,
+                         max_retry=DEFAULT_MAX_ATTEMPTS,
+                         sleep_time=DEFAULT_MAX_DELAY,
                          tools=[],
                          history=None,
                          return_raw=False,
@@ -100,33 +98,24 @@ def complete_text_claude(message,
     if history is not None:
         messages = history + messages
 
-    result = None
-    e = None
-    for cnt in range(max_retry):
-        try:
-            result = anthropic_client.beta.tools.messages.create(
-                messages=messages,
-                model=model,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                tools=tools,
-                **kwargs
-            )
-            if not return_raw:
-                result = result.to_dict()["content"][0]['text']
-        except Exception as e:
-            print(cnt, "=>", e, f' [sleep for {sleep_time} sec]')
-            time.sleep(sleep_time)
-            continue
-        
-        try:
-            if json_object and not return_raw:
-                return json.loads(result)
+    def _request():
+        result = anthropic_client.beta.tools.messages.create(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            tools=tools,
+            **kwargs
+        )
+        if return_raw:
             return result
-        except Exception as e:
-            print(result)
-            print(cnt, "=> (json encode error) ", e)
-    raise e
+        result = result.to_dict()["content"][0]['text']
+        if json_object:
+            return _load_json(result)
+        return result
+
+    return call_with_retry(_request, RetryPolicy(max_attempts=max_retry, max_delay=sleep_time),
+                           get_circuit_breaker(model), description=model)
 
 loaded_hf_models = {}
 
@@ -154,26 +143,24 @@ def complete_text_hf(message,
                               return_tensors="pt", 
                               return_token_type_ids=False
                               ).to(device)
-    for cnt in range(max_retry):
-        try:
-            output = hf_model.generate(
-                **encoded_input,
-                temperature=temperature,
-                max_new_tokens=max_tokens,
-                do_sample=True,
-                return_dict_in_generate=True,
-                output_scores=True,
-                **kwargs,
-            )
-            sequences = output.sequences
-            sequences = [sequence[len(encoded_input.input_ids[0]) :] for sequence in sequences]
-            all_decoded_text = tokenizer.batch_decode(sequences)
-            completion = all_decoded_text[0]
-            return completion
-        except Exception as e:
-            print(cnt, "=>", e)
-            time.sleep(sleep_time)
-    raise e
+    def _generate():
+        output = hf_model.generate(
+            **encoded_input,
+            temperature=temperature,
+            max_new_tokens=max_tokens,
+            do_sample=True,
+            return_dict_in_generate=True,
+            output_scores=True,
+            **kwargs,
+        )
+        sequences = output.sequences
+        sequences = [sequence[len(encoded_input.input_ids[0]) :] for sequence in sequences]
+        all_decoded_text = tokenizer.batch_decode(sequences)
+        completion = all_decoded_text[0]
+        return completion
+
+    # A local model has no rate limits nor outages to wait for
+    return call_with_retry(_generate, RetryPolicy(max_attempts=max_retry, max_delay=sleep_time), description=model)
 
 def get_llm_output_tools(message,
                    tools=[],
@@ -199,10 +186,8 @@ def get_llm_output_tools(message,
               'return_raw': return_raw}
     
     if 'gpt-4' in model:
-        kwargs.update({'max_retry': MAX_OPENAI_RETRY, 'sleep_time': OPENAI_SLEEP_TIME})
         return get_gpt_output(**kwargs)
     elif 'claude' in model:
-        kwargs.update({'max_retry': MAX_CLAUDE_RETRY, 'sleep_time': CLAUDE_SLEEP_TIME})
         return complete_text_claude(**kwargs)
     elif 'huggingface' in model:
         return complete_text_hf(**kwargs)
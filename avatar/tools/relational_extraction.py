@@ -1,11 +1,13 @@
-from typing import List, Dict
+from typing import Dict, List, Union
+from avatar.utils.adjacency import RelationAdjacency, get_adjacency
 from avatar.utils.format import format_checked
 from avatar.tools.tool import Tool
 
 
-class GetRelatedNodes(Tool):
+class RelationTool(Tool):
     """
-    A class to get related nodes based on a given relation type.
+    Base class of tools on the relations of the knowledge base, answering neighbor queries
+    from the adjacency of `kb` when it exposes its edges, and from `kb.get_neighbor_nodes` otherwise.
 
     Args:
         kb: The knowledge base containing the node and relation information.
@@ -15,6 +17,23 @@ class GetRelatedNodes(Tool):
         super().__init__(kb=kb)
         assert hasattr(kb, 'rel_type_lst'), "kb must have a method 'rel_type_lst'"
         assert hasattr(kb, 'get_neighbor_nodes'), "kb must have a method 'get_neighbor_nodes'"
+
+    @property
+    def adjacency(self) -> Union[RelationAdjacency, None]:
+        # Built on first use and shared by all tools on the same kb
+        return get_adjacency(self.kb)
+
+
+class GetRelatedNodes(RelationTool):
+    """
+    A class to get related nodes based on a given relation type.
+
+    Args:
+        kb: The knowledge base containing the node and relation information.
+    """
+
+    def __init__(self, kb, **kwargs):
+        super().__init__(kb=kb)
         self.relation_list = self.kb.rel_type_lst()
 
     @format_checked
@@ -30,7 +49,10 @@ class GetRelatedNodes(Tool):
             List[int]: A list of IDs of related nodes.
         """
         assert relation_type in self.relation_list, f'relation_type must be in {self.relation_list}, but got {relation_type}'
-        nodes = self.kb.get_neighbor_nodes(node_id, relation_type)
+        if self.adjacency is not None:
+            nodes = self.adjacency.neighbors(node_id, relation_type)
+        else:
+            nodes = self.kb.get_neighbor_nodes(node_id, relation_type)
         print('get_related_nodes len', len(nodes))
         return nodes
 
@@ -44,7 +66,7 @@ class GetRelatedNodes(Tool):
         )
 
 
-class GetRelationTypes(Tool):
+class GetRelationTypes(RelationTool):
     """
     A class to get relation types of a node.
 
@@ -52,11 +74,6 @@ class GetRelationTypes(Tool):
         kb: The knowledge base containing the node and relation information.
     """
 
-    def __init__(self, kb, **kwargs):
-        super().__init__(kb=kb)
-        assert hasattr(kb, 'rel_type_lst'), "kb must have a method 'rel_type_lst'"
-        assert hasattr(kb, 'get_neighbor_nodes'), "kb must have a method 'get_neighbor_nodes'"
-
     @format_checked
     def __call__(self, node_id: int) -> List[str]:
         """
@@ -68,6 +85,10 @@ class GetRelationTypes(Tool):
         Returns:
             List[str]: A list of relation types.
         """
+        if self.adjacency is not None:
+            rel_types = self.adjacency.relation_types([node_id])[0]
+            print('get_relation_types', rel_types)
+            return rel_types
         rel_types = []
         for rel_type in self.kb.rel_type_lst():
             nodes = self.kb.get_neighbor_nodes(node_id, rel_type)
@@ -88,7 +109,7 @@ class GetRelationTypes(Tool):
         )
 
 
-class GetRelationDict(Tool):
+class GetRelationDict(RelationTool):
     """
     A class to get relation types and related nodes of a node.
 
@@ -96,11 +117,6 @@ class GetRelationDict(Tool):
         kb: The knowledge base containing the node and relation information.
     """
 
-    def __init__(self, kb, **kwargs):
-        super().__init__(kb=kb)
-        assert hasattr(kb, 'rel_type_lst'), "kb must have a method 'rel_type_lst'"
-        assert hasattr(kb, 'get_neighbor_nodes'), "kb must have a method 'get_neighbor_nodes'"
-
     @format_checked
     def __call__(self, node_id: int) -> Dict[str, List[int]]:
         """
@@ -112,6 +128,8 @@ class GetRelationDict(Tool):
         Returns:
             Dict[str, List[int]]: A dictionary with relation types as keys and lists of related nodes as values.
         """
+        if self.adjacency is not None:
+            return self.adjacency.relation_dicts([node_id])[0]
         relation_dict = {}
         for rel_type in self.kb.rel_type_lst():
             nodes = self.kb.get_neighbor_nodes(node_id, rel_type)
@@ -128,3 +146,89 @@ class GetRelationDict(Tool):
             "for the node with ID 2000. get_relation_dict(node_id=3000) may return {'has_brand': [], 'also_view': [303], 'also_buy': []} if the node with "
             "ID 3000 only has an 'also_view' relation with the node with ID 303."
         )
+
+
+class GetRelationDicts(RelationTool):
+    """
+    A class to get relation types and related nodes of a list of nodes.
+
+    Args:
+        kb: The knowledge base containing the node and relation information.
+    """
+
+    @format_checked
+    def __call__(self, node_ids: List[int]) -> List[Dict[str, List[int]]]:
+        """
+        Get relation types and related nodes of each node.
+
+        Args:
+            node_ids (List[int]): The IDs of the nodes.
+
+        Returns:
+            List[Dict[str, List[int]]]: For each node, a dictionary with relation types as keys and lists of related nodes as values.
+        """
+        if self.adjacency is not None:
+            return self.adjacency.relation_dicts(node_ids)
+        return [{rel_type: self.kb.get_neighbor_nodes(node_id, rel_type) for rel_type in self.kb.rel_type_lst()}
+                for node_id in node_ids]
+
+    def __str__(self):
+        return 'get_relation_dicts(node_ids: List[int]) -> relation_dicts: List[Dict[str, List[int]]]'
+
+    def __repr__(self):
+        return (
+            "This function extracts relation types and related nodes of each node in `node_ids` at once. The returned result is a list of dictionaries, one for each node "
+            "in the order of `node_ids`, with relation types as keys and lists of related nodes as values. For example, get_relation_dicts(node_ids=[2000, 3000]) returns a list, "
+            "e.g., [{'has_brand': [10], 'also_view': [2001, 2002], 'also_buy': [2003]}, {'has_brand': [], 'also_view': [303], 'also_buy': []}]. "
+            "It is much faster than calling get_relation_dict for each node."
+        )
+
+
+class GetKHopNeighbors(RelationTool):
+    """
+    A class to get the nodes within a number of hops from a list of nodes.
+
+    Args:
+        kb: The knowledge base containing the node and relation information.
+    """
+
+    def __init__(self, kb, **kwargs):
+        super().__init__(kb=kb)
+        self.relation_list = self.kb.rel_type_lst()
+
+    @format_checked
+    def __call__(self, node_ids: List[int], num_hops: int, relation_type: str = '*') -> List[int]:
+        """
+        Get the nodes reachable from any of the given nodes within `num_hops` hops.
+
+        Args:
+            node_ids (List[int]): The IDs of the nodes to start from.
+            num_hops (int): The maximum number of hops.
+            relation_type (str): The type of relation to follow at every hop, or '*' for any relation type.
+
+        Returns:
+            List[int]: Sorted IDs of the reachable nodes, excluding the nodes in `node_ids`.
+        """
+        assert relation_type == '*' or relation_type in self.relation_list, \
+            f'relation_type must be in {self.relation_list} or "*", but got {relation_type}'
+        if self.adjacency is not None:
+            nodes = self.adjacency.k_hop_neighbors(node_ids, num_hops, relation_type)
+        else:
+            visited, frontier = set(node_ids), set(node_ids)
+            for _ in range(num_hops):
+                frontier = {n for node_id in frontier for n in self.kb.get_neighbor_nodes(node_id, relation_type)} - visited
+                visited |= frontier
+            nodes = sorted(visited - set(node_ids))
+        print('get_k_hop_neighbors len', len(nodes))
+        return nodes
+
+    def __str__(self):
+        return 'get_k_hop_neighbors(node_ids: List[int], num_hops: int, relation_type: str = "*") -> node_ids: List[int]'
+
+    def __repr__(self):
+        return (
+            "This function extracts IDs of nodes reachable from any node in `node_ids` within `num_hops` hops, following relations of type `relation_type` "
+            "at every hop, or relations of any type if `relation_type` is '*'. The returned result is a sorted list of node IDs not including `node_ids`. "
+            "For example, get_k_hop_neighbors(node_ids=[2000], num_hops=2, relation_type='also_buy') returns the products bought together with product 2000 "
+            "and the products bought together with those, e.g., [2003, 2010]."
+        )
@@ -1,11 +1,15 @@
 import torch
 import os.path as osp
+from typing import List
 
+from avatar.utils.doc_cache import get_doc_info
+from avatar.utils.emb_cache import get_text_embedding
+from avatar.utils.emb_store import EmbeddingStore, chunk_store_path
 from avatar.utils.format import format_checked
 from avatar.utils.topk import get_top_k_indices 
 from avatar.tools.tool import Tool
 from stark_qa.tools.process_text import chunk_text
-from stark_qa.tools.api import get_openai_embedding, get_openai_embeddings
+from avatar.utils.api import get_openai_embeddings
 
 
 class GetFullInfo(Tool):
@@ -31,7 +35,7 @@ class GetFullInfo(Tool):
         Returns:
             str: The complete textual and relational information of the node.
         """
-        return self.kb.get_doc_info(node_id, add_rel=True, compact=False)
+        return get_doc_info(self.kb, node_id, add_rel=True, compact=False)
         
     def __str__(self):
         return 'get_full_info(node_id: int) -> full_info: str'
@@ -63,7 +67,7 @@ class GetTextInfo(Tool):
         Returns:
             str: The textual information of the node.
         """
-        return self.kb.get_doc_info(node_id, add_rel=False, compact=False)
+        return get_doc_info(self.kb, node_id, add_rel=False, compact=False)
             
     def __str__(self):
         return 'get_text_info(node_id: int) -> text_info: str'
@@ -126,6 +130,7 @@ class GetRelevantChunk(Tool):
         assert hasattr(kb, 'get_doc_info'), "kb must have a method 'get_doc_info'"
         self.emb_model = emb_model
         self.chunk_emb_dir = chunk_emb_dir
+        self.chunk_emb_stores = {}
 
     @format_checked
     def __call__(self, 
@@ -159,15 +164,10 @@ class GetRelevantChunk(Tool):
                 pass
         
         if len(chunk) == 0:
-            doc = self.kb.get_doc_info(node_id, add_rel=True, compact=True)
+            doc = get_doc_info(self.kb, node_id, add_rel=True, compact=True)
             chunks = chunk_text(doc, chunk_size=chunk_size)
-            chunk_path = osp.join(self.chunk_emb_dir, f'{node_id}_size={chunk_size}.pt')
-            if osp.exists(chunk_path):
-                chunk_embs = torch.load(chunk_path)
-            else:
-                chunk_embs = get_openai_embeddings(chunks, model=self.emb_model)
-                torch.save(chunk_embs, chunk_path)
-            attribute_emb = get_openai_embedding(attribute, model=self.emb_model)
+            chunk_embs = self.get_chunk_embs(node_id, chunks, chunk_size)
+            attribute_emb = get_text_embedding(attribute, model=self.emb_model)
             sel_ids, similarity = get_top_k_indices(attribute_emb, chunk_embs, return_similarity=True)
             
             if sum(similarity > threshold) > 0:
@@ -178,6 +178,32 @@ class GetRelevantChunk(Tool):
                 chunk = chunks[sel_ids[0]]
         return chunk
     
+    def get_chunk_embs(self, node_id: int, chunks: List[str], chunk_size: int) -> torch.Tensor:
+        """
+        Get the chunk embeddings of a node from the chunk store (see `scripts/chunk_emb_generate.py`).
+        Nodes missing from the store are embedded (or loaded from legacy per-node files) and appended to it.
+        """
+        store_path = chunk_store_path(self.chunk_emb_dir, chunk_size)
+        store = self.chunk_emb_stores.get(chunk_size)
+        if store is None:
+            store = EmbeddingStore.open(store_path)
+        elif node_id not in store:
+            store.refresh()
+        self.chunk_emb_stores[chunk_size] = store
+        if store is not None and node_id in store:
+            return store.get_ragged([node_id])[0]
+
+        chunk_path = osp.join(self.chunk_emb_dir, f'{node_id}_size={chunk_size}.pt')
+        if osp.exists(chunk_path):
+            chunk_embs = torch.load(chunk_path).float()
+        else:
+            chunk_embs = get_openai_embeddings(chunks, model=self.emb_model).float()
+        if store is None:
+            store = EmbeddingStore.open_or_create(store_path, dim=chunk_embs.size(-1))
+            self.chunk_emb_stores[chunk_size] = store
+        store.append([node_id], chunk_embs, counts=[len(chunk_embs.view(-1, store.dim))])
+        return chunk_embs
+
     def __str__(self):
         return 'get_relevant_chunk(node_id: int, attribute: str, k: int = 3, chunk_size: int = 256, threshold: float = 0.80) -> chunk: str'
     
@@ -0,0 +1,162 @@
+import threading
+import numpy as np
+import torch
+from typing import Dict, List, Tuple, Union
+
+
+class RelationAdjacency:
+    """
+    CSR adjacency of a knowledge base, one per relation type plus '*' for any relation type, built once from
+    `kb.edge_index` and `kb.edge_types`. Rows follow `kb.get_neighbor_nodes`, i.e., the neighbors of a node are
+    the sorted, deduplicated targets of the edges starting from it, so that neighbor queries of many nodes are
+    answered with a few array operations instead of a sparse tensor slice per node and relation type.
+
+    Args:
+        kb: The knowledge base, with `edge_index`, `edge_types` and `edge_type_dict` as in `stark_qa.skb.SKB`.
+    """
+
+    def __init__(self, kb):
+        self.num_nodes = kb.num_nodes()
+        edge_index = torch.as_tensor(kb.edge_index).cpu().numpy().astype(np.int64)
+        edge_types = torch.as_tensor(kb.edge_types).cpu().numpy().astype(np.int64)
+        self.rel_types = kb.rel_type_lst()
+        # relation type -> (indptr of size (num_nodes + 1,), neighbor indices)
+        self.csr: Dict[str, Tuple[np.ndarray, np.ndarray]] = {'*': self._build_csr(edge_index)}
+        for rel_id, rel_type in kb.edge_type_dict.items():
+            self.csr[rel_type] = self._build_csr(edge_index[:, edge_types == rel_id])
+
+    def _build_csr(self, edge_index: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        keys = np.unique(edge_index[0] * self.num_nodes + edge_index[1])
+        rows, cols = keys // self.num_nodes, keys % self.num_nodes
+        indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength=self.num_nodes))
+        return indptr, cols
+
+    def _check(self, node_ids: np.ndarray, rel_type: str):
+        if rel_type not in self.csr:
+            raise ValueError(f'relation_type must be in {self.rel_types} or "*", but got {rel_type}')
+        if len(node_ids) and (node_ids.min() < 0 or node_ids.max() >= self.num_nodes):
+            raise IndexError(f'node ids should be in [0, {self.num_nodes}), but got {node_ids[(node_ids < 0) | (node_ids >= self.num_nodes)][:5].tolist()}')
+
+    def degrees(self, node_ids: Union[List[int], np.ndarray], rel_type: str = '*') -> np.ndarray:
+        """
+        Count the neighbors of each node under `rel_type`.
+
+        Args:
+            node_ids (Union[List[int], np.ndarray]): Node IDs.
+            rel_type (str): Relation type, or '*' for any relation type.
+
+        Returns:
+            np.ndarray: Number of neighbors of each node, of size (len(node_ids),).
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64).reshape(-1)
+        self._check(node_ids, rel_type)
+        indptr = self.csr[rel_type][0]
+        return indptr[node_ids + 1] - indptr[node_ids]
+
+    def gather(self, node_ids: Union[List[int], np.ndarray], rel_type: str = '*') -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Collect the neighbors of all nodes under `rel_type` in one pass.
+
+        Args:
+            node_ids (Union[List[int], np.ndarray]): Node IDs.
+            rel_type (str): Relation type, or '*' for any relation type.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The number of neighbors of each node, and the concatenated neighbors
+                of all nodes in the order of `node_ids`.
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64).reshape(-1)
+        self._check(node_ids, rel_type)
+        indptr, indices = self.csr[rel_type]
+        starts = indptr[node_ids]
+        counts = indptr[node_ids + 1] - starts
+        offsets = np.cumsum(counts) - counts
+        positions = np.arange(counts.sum()) - np.repeat(offsets - starts, counts)
+        return counts, indices[positions]
+
+    def neighbors(self, node_id: int, rel_type: str = '*') -> List[int]:
+        """
+        Get the neighbors of a node under `rel_type`, same as `kb.get_neighbor_nodes(node_id, rel_type)`.
+        """
+        return self.gather([node_id], rel_type)[1].tolist()
+
+    def relation_types(self, node_ids: Union[List[int], np.ndarray]) -> List[List[str]]:
+        """
+        Get the relation types each node has at least one neighbor under.
+
+        Args:
+            node_ids (Union[List[int], np.ndarray]): Node IDs.
+
+        Returns:
+            List[List[str]]: Relation types of each node, in the order of `kb.rel_type_lst()`.
+        """
+        has_rel = np.stack([self.degrees(node_ids, rel_type) > 0 for rel_type in self.rel_types], axis=1) \
+            if self.rel_types else np.zeros((len(node_ids), 0), dtype=bool)
+        return [[self.rel_types[i] for i in np.flatnonzero(row)] for row in has_rel]
+
+    def relation_dicts(self, node_ids: Union[List[int], np.ndarray]) -> List[Dict[str, List[int]]]:
+        """
+        Get the neighbors of each node under every relation type.
+
+        Args:
+            node_ids (Union[List[int], np.ndarray]): Node IDs.
+
+        Returns:
+            List[Dict[str, List[int]]]: For each node, a dictionary with all relation types as keys and lists of
+                neighbors as values.
+        """
+        relation_dicts = [{} for _ in range(len(node_ids))]
+        for rel_type in self.rel_types:
+            counts, neighbors = self.gather(node_ids, rel_type)
+            for relation_dict, nodes in zip(relation_dicts, np.split(neighbors, np.cumsum(counts)[:-1])):
+                relation_dict[rel_type] = nodes.tolist()
+        return relation_dicts
+
+    def k_hop_neighbors(self,
+                        node_ids: Union[List[int], np.ndarray],
+                        num_hops: int,
+                        rel_type: str = '*') -> List[int]:
+        """
+        Get the nodes reachable from any of `node_ids` within `num_hops` hops under `rel_type`.
+
+        Args:
+            node_ids (Union[List[int], np.ndarray]): Node IDs to start from.
+            num_hops (int): Maximum number of hops.
+            rel_type (str): Relation type followed at every hop, or '*' for any relation type.
+
+        Returns:
+            List[int]: Sorted IDs of the reachable nodes, excluding the starting nodes.
+        """
+        frontier = np.unique(np.asarray(node_ids, dtype=np.int64).reshape(-1))
+        self._check(frontier, rel_type)
+        visited = np.zeros(self.num_nodes, dtype=bool)
+        visited[frontier] = True
+        reached = np.zeros(self.num_nodes, dtype=bool)
+        for _ in range(num_hops):
+            neighbors = np.unique(self.gather(frontier, rel_type)[1])
+            frontier = neighbors[~visited[neighbors]]
+            if len(frontier) == 0:
+                break
+            visited[frontier] = True
+            reached[frontier] = True
+        return np.flatnonzero(reached).tolist()
+
+
+_adjacencies: Dict[int, RelationAdjacency] = {}
+_adjacency_lock = threading.Lock()
+
+
+def get_adjacency(kb) -> Union[RelationAdjacency, None]:
+    """
+    Get the process-wide adjacency of `kb`, built on first use.
+
+    Returns:
+        RelationAdjacency: The adjacency, or None if `kb` does not expose its edges.
+    """
+    if not all(hasattr(kb, attr) for attr in ['edge_index', 'edge_types', 'edge_type_dict']):
+        return None
+    with _adjacency_lock:
+        if id(kb) not in _adjacencies:
+            _adjacencies[id(kb)] = RelationAdjacency(kb)
+        return _adjacencies[id(kb)]
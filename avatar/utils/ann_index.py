@@ -0,0 +1,175 @@
+import os
+import os.path as osp
+import numpy as np
+import torch
+from typing import Tuple
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+ANN_INDEX_TYPES = ['ivfpq', 'hnswpq']
+
+
+def _pq_subquantizers(dim: int, target: int) -> int:
+    """
+    Get the largest number of PQ sub-quantizers no larger than `target` that divides `dim`.
+    """
+    for m in range(min(target, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+class ANNIndex:
+    """
+    Approximate nearest-neighbour index over a candidate embedding matrix, scored by inner product.
+
+    Args:
+        index_type (str): 'ivfpq' (inverted file with product quantization) or 'hnswpq' (HNSW graph over PQ codes).
+        probe (int): The recall-vs-latency knob, i.e., `nprobe` for 'ivfpq' and `efSearch` for 'hnswpq'.
+                     Larger values give higher recall and higher latency.
+        pq_m (int): Target number of PQ sub-quantizers (rounded down to a divisor of the embedding dimension).
+        pq_nbits (int): Number of bits per PQ code.
+        nlist (int): Number of inverted lists for 'ivfpq'. Defaults to 4 * sqrt(num_candidates).
+        hnsw_m (int): Number of graph neighbours per node for 'hnswpq'.
+    """
+
+    def __init__(self,
+                 index_type: str = 'ivfpq',
+                 probe: int = 32,
+                 pq_m: int = 64,
+                 pq_nbits: int = 8,
+                 nlist: int = None,
+                 hnsw_m: int = 32):
+        if faiss is None:
+            raise ImportError('faiss is required for approximate nearest-neighbour search. '
+                              'Please install it with `pip install faiss-cpu` or `pip install faiss-gpu`.')
+        assert index_type in ANN_INDEX_TYPES, f'index_type must be in {ANN_INDEX_TYPES}, but got {index_type}'
+        self.index_type = index_type
+        self.probe = probe
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.nlist = nlist
+        self.hnsw_m = hnsw_m
+        self.index = None
+
+    def build(self, embs: torch.Tensor) -> 'ANNIndex':
+        """
+        Train the quantizers and add all rows of `embs` to the index. Row i is returned as i by `search`.
+        With fewer rows than the `2 ** pq_nbits` PQ centroids, the quantizers cannot be trained and the
+        index searches exactly instead.
+
+        Args:
+            embs (torch.Tensor): Candidate embedding matrix of size (num_candidates, hidden_dim).
+
+        Returns:
+            ANNIndex: The index itself.
+        """
+        embs = np.ascontiguousarray(embs.float().cpu().numpy())
+        num, dim = embs.shape
+        pq_m = _pq_subquantizers(dim, self.pq_m)
+        if num < 2 ** self.pq_nbits:
+            print(f'Only {num} candidates for {2 ** self.pq_nbits} PQ centroids, using exact search...')
+            factory = 'Flat'
+        elif self.index_type == 'ivfpq':
+            nlist = self.nlist or max(1, int(4 * np.sqrt(num)))
+            # faiss needs ~39 training points per centroid
+            nlist = max(1, min(nlist, num // 39))
+            factory = f'IVF{nlist},PQ{pq_m}x{self.pq_nbits}'
+        else:
+            factory = f'HNSW{self.hnsw_m},PQ{pq_m}x{self.pq_nbits}'
+        self.index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+        self.index.train(embs)
+        self.index.add(embs)
+        self.set_probe(self.probe)
+        return self
+
+    def set_probe(self, probe: int) -> None:
+        """
+        Set the recall-vs-latency knob (`nprobe` for 'ivfpq', `efSearch` for 'hnswpq').
+
+        Args:
+            probe (int): The number of inverted lists or graph candidates to visit per query.
+        """
+        self.probe = probe
+        if self.index is None or isinstance(self.index, faiss.IndexFlat):
+            return
+        if self.index_type == 'ivfpq':
+            faiss.extract_index_ivf(self.index).nprobe = probe
+        else:
+            faiss.downcast_index(self.index).hnsw.efSearch = probe
+
+    def search(self, query_embs: torch.Tensor, k: int) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Search the approximate top-k rows for each query.
+
+        Args:
+            query_embs (torch.Tensor): Query embeddings of size (n, hidden_dim).
+            k (int): Number of rows to retrieve per query.
+
+        Returns:
+            scores (torch.FloatTensor): Approximate inner products of size (n, k).
+            rows (torch.LongTensor): Row indices of size (n, k). Missing results are filled with -1.
+        """
+        query_embs = np.ascontiguousarray(query_embs.float().cpu().numpy().reshape(-1, self.index.d))
+        scores, rows = self.index.search(query_embs, k)
+        return torch.from_numpy(scores), torch.from_numpy(rows)
+
+    def save(self, path: str) -> None:
+        faiss.write_index(self.index, path)
+
+    def load(self, path: str) -> 'ANNIndex':
+        self.index = faiss.read_index(path)
+        self.set_probe(self.probe)
+        return self
+
+    def __len__(self) -> int:
+        return 0 if self.index is None else self.index.ntotal
+
+    @staticmethod
+    def _source_path(path: str) -> str:
+        return f'{path}.source.npz'
+
+    @classmethod
+    def load_or_build(cls, 
+                      path: str, 
+                      embs: torch.Tensor, 
+                      ids: np.ndarray, 
+                      version: int = 0, 
+                      **kwargs) -> 'ANNIndex':
+        """
+        Load the index persisted at `path`, or build it from `embs` and save it to `path`. The candidate ids and
+        the embedding store version are saved next to the index, which is rebuilt if either of them changed.
+
+        Args:
+            path (str): Path to the persisted index.
+            embs (torch.Tensor): Candidate embedding matrix used to build the index if it does not exist.
+            ids (np.ndarray): Candidate ids of the rows of `embs`.
+            version (int): Version of the embedding store `embs` is read from.
+            **kwargs: Arguments passed to the constructor.
+
+        Returns:
+            ANNIndex: The loaded or newly built index.
+        """
+        ann_index = cls(**kwargs)
+        ids = np.asarray(ids, dtype=np.int64)
+        source_path = cls._source_path(path)
+        if osp.exists(path) and osp.exists(source_path):
+            source = np.load(source_path)
+            if int(source['version']) == version and np.array_equal(source['ids'], ids):
+                ann_index.load(path)
+                print(f'Loaded ANN index from {path}!')
+                return ann_index
+            print(f'ANN index at {path} is stale, rebuilding...')
+        print(f'Building {ann_index.index_type} ANN index over {len(embs)} candidates...')
+        ann_index.build(embs)
+        ann_index.save(path)
+        # Written last, so that an interrupted save is detected as stale
+        tmp_path = f'{path}.source.tmp.npz'
+        np.savez(tmp_path, ids=ids, version=np.int64(version))
+        os.replace(tmp_path, source_path)
+        print(f'Saved ANN index to {path}!')
+        return ann_index
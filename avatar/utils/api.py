@@ -0,0 +1,224 @@
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterator, List, Tuple, Union
+import openai
+import torch
+from PIL import Image
+from stark_qa.tools.api import get_openai_embedding as _shortened_openai_embedding
+from avatar.utils.api_vision import LLM_PARALLEL_NODES, get_image_messages
+from avatar.utils.llm_cache import get_llm_cache
+from avatar.utils.llm_client import get_llm_client
+from avatar.utils.retry import call_with_retry, get_circuit_breaker
+
+
+# Per-request limits of the embedding API: number of texts, and tokens of about 4 characters
+EMB_BATCH_SIZE = int(os.getenv('AVATAR_EMB_BATCH_SIZE', 2048))
+EMB_BATCH_MAX_TOKENS = int(os.getenv('AVATAR_EMB_BATCH_MAX_TOKENS', 250000))
+
+
+def get_llm_output(message: Union[str, List[Dict]],
+                   model: str = "gpt-4-0125-preview",
+                   max_tokens: int = 2048,
+                   temperature: float = 1,
+                   json_object: bool = False,
+                   read_cache: bool = True) -> str:
+    """
+    Cached drop-in for `stark_qa.tools.api.get_llm_output`, sent through the process-wide LLM client
+    (see `avatar.utils.llm_client`). Requests at temperatures opted into the process-wide LLM cache
+    (see `avatar.utils.llm_cache`) are answered from the cache when possible.
+
+    Args:
+        message (Union[str, List[Dict]]): The input message or a list of message dicts.
+        model (str): The model to use for completion.
+        max_tokens (int): Maximum number of tokens to generate.
+        temperature (float): Sampling temperature.
+        json_object (bool): Whether to output in JSON format.
+        read_cache (bool): Whether a cached response may be returned. Set it to False when retrying after an unusable
+            response, the new response then replaces the cached one.
+
+    Returns:
+        str: The completed text generated by the model.
+    """
+    kwargs = {'model': model, 'max_tokens': max_tokens, 'temperature': temperature, 'json_object': json_object}
+    cache = get_llm_cache()
+    if not cache.caches(temperature):
+        return get_llm_client().complete(message, **kwargs)
+    key = cache.key(message=message, **kwargs)
+    output = cache.get(key) if read_cache else None
+    if output is None:
+        output = get_llm_client().complete(message, **kwargs)
+        cache.put(key, output)
+    return output
+
+
+def _cached_complete_many(messages: List[Any], keys: List[str], read_cache: bool, **kwargs: Any) -> List[Any]:
+    """
+    Answer `messages` from the cache where possible, and send the rest concurrently.
+    """
+    cache = get_llm_cache()
+    outputs = [cache.get(key) if read_cache else None for key in keys]
+    # Identical requests in a batch are sent once
+    missing = OrderedDict((key, x) for key, x, output in zip(keys, messages, outputs) if output is None)
+    if len(missing) > 0:
+        new_outputs = dict(zip(missing.keys(), get_llm_client().complete_many(list(missing.values()), **kwargs)))
+        for key, output in new_outputs.items():
+            cache.put(key, output)
+        outputs = [new_outputs[key] if output is None else output for key, output in zip(keys, outputs)]
+    return outputs
+
+
+def get_llm_outputs(messages: List[Union[str, List[Dict]]],
+                    model: str = "gpt-4-0125-preview",
+                    max_tokens: int = 2048,
+                    temperature: float = 1,
+                    json_object: bool = False,
+                    read_cache: bool = True) -> List[str]:
+    """
+    Cached drop-in for `stark_qa.tools.api.get_llm_outputs`, sending the requests that miss the cache
+    concurrently within the limits of `model`. See `get_llm_output` for the arguments.
+    """
+    kwargs = {'model': model, 'max_tokens': max_tokens, 'temperature': temperature, 'json_object': json_object}
+    cache = get_llm_cache()
+    if not cache.caches(temperature):
+        return get_llm_client().complete_many(messages, **kwargs)
+    keys = [cache.key(message=message, **kwargs) for message in messages]
+    return _cached_complete_many(messages, keys, read_cache, **kwargs)
+
+
+def iter_llm_outputs(messages: List[Union[str, List[Dict]]],
+                     model: str = "gpt-4-0125-preview",
+                     max_tokens: int = 2048,
+                     temperature: float = 1,
+                     json_object: bool = False,
+                     read_cache: bool = True) -> Iterator[Tuple[int, Union[str, Exception]]]:
+    """
+    Streaming version of `get_llm_outputs`, yielding cached responses first and the others as they arrive.
+    A request that fails yields its exception instead of stopping the others. See `get_llm_output` for the arguments.
+
+    Yields:
+        Tuple[int, Union[str, Exception]]: The index of a message in `messages` and its response or exception.
+    """
+    kwargs = {'model': model, 'max_tokens': max_tokens, 'temperature': temperature, 'json_object': json_object}
+    cache = get_llm_cache()
+    if not cache.caches(temperature):
+        yield from get_llm_client().iter_complete(messages, **kwargs)
+        return
+    keys = [cache.key(message=message, **kwargs) for message in messages]
+    # Identical requests are sent once, and answer all their indices
+    indices = OrderedDict()
+    for idx, (key, message) in enumerate(zip(keys, messages)):
+        output = cache.get(key) if read_cache and key not in indices else None
+        if output is not None:
+            yield idx, output
+        else:
+            indices.setdefault(key, []).append(idx)
+    missing = list(indices.keys())
+    for pos, output in get_llm_client().iter_complete([messages[indices[key][0]] for key in missing], **kwargs):
+        if not isinstance(output, Exception):
+            cache.put(missing[pos], output)
+        for idx in indices[missing[pos]]:
+            yield idx, output
+
+
+def _image_digest(image: Image.Image) -> str:
+    return hashlib.sha256(image.tobytes()).hexdigest() + f'-{image.mode}-{image.size}'
+
+
+def get_llm_vision_outputs(image_list: List[Image.Image],
+                           message: str,
+                           model: str = "claude-3-opus-20240229",
+                           max_tokens: int = 1024,
+                           temperature: float = 1,
+                           json_object: bool = False,
+                           read_cache: bool = True) -> List[Any]:
+    """
+    Cached drop-in for `avatar.utils.api_vision.get_llm_vision_outputs`, asking `message` about each image in
+    `image_list` concurrently. Responses are returned as text. Images are part of the cache key through a hash
+    of their pixels. See `get_llm_output` for the other arguments.
+    """
+    kwargs = {'model': model, 'max_tokens': max_tokens, 'temperature': temperature, 'json_object': json_object}
+    messages = [get_image_messages(image, message, model=model, json_object=json_object) for image in image_list]
+    cache = get_llm_cache()
+    if not cache.caches(temperature):
+        return get_llm_client().complete_many(messages, **kwargs)
+    keys = [cache.key(image=_image_digest(image), message=message, **kwargs) for image in image_list]
+    return _cached_complete_many(messages, keys, read_cache, **kwargs)
+
+
+def _openai_embedding(text: str, model: str) -> torch.FloatTensor:
+    try:
+        emb = openai.OpenAI().embeddings.create(input=[text], model=model)
+    except openai.BadRequestError as e:
+        # Texts beyond the context length are shortened until they fit
+        try:
+            return _shortened_openai_embedding(text, model=model)
+        except RuntimeError:
+            raise e
+    return torch.FloatTensor(emb.data[0].embedding).view(1, -1)
+
+
+def get_openai_embedding(text: str, model: str = "text-embedding-ada-002") -> torch.FloatTensor:
+    """
+    Drop-in for `stark_qa.tools.api.get_openai_embedding`, retrying failed requests with the policy
+    of `avatar.utils.retry` instead of failing on the first rate limit.
+
+    Args:
+        text (str): The input text to be embedded.
+        model (str): The embedding model.
+
+    Returns:
+        torch.FloatTensor: The embedding of size (1, hidden_dim).
+    """
+    assert isinstance(text, str) and len(text) > 0, 'text to be embedded should be a non-empty str'
+    return call_with_retry(partial(_openai_embedding, text, model), breaker=get_circuit_breaker(model), description=model)
+
+
+def _embedding_batches(texts: List[str]) -> List[List[str]]:
+    batches, batch, budget = [], [], 4 * EMB_BATCH_MAX_TOKENS
+    for text in texts:
+        if len(batch) > 0 and (len(batch) == EMB_BATCH_SIZE or budget < len(text)):
+            batches.append(batch)
+            batch, budget = [], 4 * EMB_BATCH_MAX_TOKENS
+        batch.append(text)
+        budget -= len(text)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def _openai_embedding_batch(texts: List[str], model: str) -> torch.FloatTensor:
+    response = openai.OpenAI().embeddings.create(input=texts, model=model)
+    return torch.FloatTensor([data.embedding for data in sorted(response.data, key=lambda data: data.index)])
+
+
+def _get_openai_embedding_batch(texts: List[str], model: str) -> torch.FloatTensor:
+    try:
+        return call_with_retry(partial(_openai_embedding_batch, texts, model),
+                               breaker=get_circuit_breaker(model), description=model)
+    except openai.BadRequestError:
+        # A text beyond the context length fails the whole batch, embed them one by one to shorten it alone
+        return torch.cat([get_openai_embedding(text, model=model) for text in texts], dim=0)
+
+
+def get_openai_embeddings(texts: List[str],
+                          n_max_nodes: int = LLM_PARALLEL_NODES,
+                          model: str = "text-embedding-ada-002") -> torch.FloatTensor:
+    """
+    Drop-in for `stark_qa.tools.api.get_openai_embeddings`, sending `texts` in batches within the per-request
+    limits of the API, with up to `n_max_nodes` batches in flight.
+
+    Returns:
+        torch.FloatTensor: The embeddings of size (len(texts), hidden_dim).
+    """
+    assert isinstance(texts, list), f'texts must be list, but got {type(texts)}'
+    assert all(isinstance(text, str) and len(text) > 0 for text in texts), 'texts to be embedded should be non-empty str'
+    batches = _embedding_batches(texts)
+    if len(batches) <= 1 or n_max_nodes <= 1:
+        embs = [_get_openai_embedding_batch(batch, model) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(batches), n_max_nodes)) as executor:
+            embs = list(executor.map(partial(_get_openai_embedding_batch, model=model), batches))
+    return torch.cat(embs, dim=0)
@@ -1,18 +1,16 @@
-import time
 import base64
 import json
+import anthropic
 import openai
 import requests
 import os
 from typing import List, Dict, Any
 from PIL import Image
-from stark_qa.tools.api import complete_text_claude, parallel_func
+from stark_qa.tools.api import parallel_func
 from avatar.utils.image import image_to_base64
+from avatar.utils.retry import DEFAULT_MAX_ATTEMPTS, DEFAULT_MAX_DELAY, InvalidOutputError, RetryPolicy, \
+    call_with_retry, get_circuit_breaker
 
-MAX_OPENAI_RETRY = int(os.getenv("MAX_OPENAI_RETRY", 5))
-OPENAI_SLEEP_TIME = int(os.getenv("OPENAI_SLEEP_TIME", 60))
-MAX_CLAUDE_RETRY = int(os.getenv("MAX_CLAUDE_RETRY", 10))
-CLAUDE_SLEEP_TIME = int(os.getenv("CLAUDE_SLEEP_TIME", 0))
 LLM_PARALLEL_NODES = int(os.getenv("LLM_PARALLEL_NODES", 5))
 
 
@@ -25,8 +23,8 @@ def complete_text_image_claude(image: Image.Image,
                                tools: List = [],
                                json_object: bool = False,
                                history: List[Dict[str, Any]] = None,
-                               max_retry: int = 3, 
-                               sleep_time: int = 0,
+                               max_retry: int = DEFAULT_MAX_ATTEMPTS, 
+                               max_delay: float = DEFAULT_MAX_DELAY,
                                **kwargs) -> Dict:
     """ Call the Claude API to complete a prompt."""
     if image is not None:
@@ -61,23 +59,33 @@ def complete_text_image_claude(image: Image.Image,
     if history is not None:
         messages = history + [{"role": "user", "content": message}]
     kwargs = {k: v for k, v in kwargs.items() if v is not None}
-    kwargs["max_retry"] = max_retry
-    kwargs["sleep_time"] = sleep_time
-    return complete_text_claude(messages,
-                                model=model,
-                                max_tokens=max_tokens,
-                                temperature=temperature,
-                                json_object=json_object,
-                                tools=tools,
-                                **kwargs)
+    if tools:
+        kwargs["tools"] = tools
+    # Same client and API key as `stark_qa.tools.api_lib`
+    from stark_qa.tools.api_lib import anthropic_client
+    client = anthropic_client if anthropic_client is not None else anthropic.Anthropic()
+
+    def _request():
+        # Called directly, so that the retry policy sees the original API errors
+        response = client.messages.create(messages=messages,
+                                          model=model,
+                                          max_tokens=max_tokens,
+                                          temperature=temperature,
+                                          **kwargs)
+        return response.content[0].text
+
+    return call_with_retry(_request,
+                           RetryPolicy(max_attempts=max_retry, max_delay=max_delay),
+                           get_circuit_breaker(model),
+                           description=model)
 
 
 def get_gpt4v_output(image: Image.Image, 
                      message: str, 
                      model: str = "gpt-4-turbo", 
                      max_tokens: int = 1024, 
-                     max_retry: int = 10, 
-                     sleep_time: int = 10,
+                     max_retry: int = DEFAULT_MAX_ATTEMPTS, 
+                     max_delay: float = DEFAULT_MAX_DELAY,
                      json_object: bool = False,
                      **kwargs) -> Dict:
     if json_object:
@@ -104,25 +112,54 @@ def get_gpt4v_output(image: Image.Image,
     }
     if json_object:
         payload['response_format'] = {"type": "json_object"}
-    for cnt in range(max_retry):
-        try:
-            response = requests.post("https://api.openai.com/v1/chat/completions", 
-                                     headers=headers, json=payload)
-            result = response.json()['choices'][0]['message']['content']
-        except Exception as e:
-            print(cnt, "=>", e, f' [sleep for {sleep_time} sec]')
-            time.sleep(sleep_time)
-            continue
-
-        try:
-            if json_object:
-                result = result[result.find("{"):result.rfind("}")+1]
+
+    def _request():
+        response = requests.post("https://api.openai.com/v1/chat/completions", 
+                                 headers=headers, json=payload)
+        # Error statuses raise with the response, whose Retry-After header is honored
+        response.raise_for_status()
+        result = response.json()['choices'][0]['message']['content']
+        if json_object:
+            result = result[result.find("{"):result.rfind("}")+1]
+            try:
                 return json.loads(result)
-            return result
-        except Exception as e:
-            print(result)
-            print(cnt, "=> (json encode error) ", e)
-    raise e
+            except json.JSONDecodeError as e:
+                print(result)
+                raise InvalidOutputError(f'json encode error: {e}')
+        return result
+
+    return call_with_retry(_request,
+                           RetryPolicy(max_attempts=max_retry, max_delay=max_delay),
+                           get_circuit_breaker(model),
+                           description=model)
+
+
+def get_image_messages(image: Image.Image,
+                       message: str,
+                       model: str = "claude-3-opus-20240229",
+                       json_object: bool = False) -> List[Dict]:
+    """
+    Build the messages asking `message` about `image`, in the format of the API of `model`,
+    the same way as `complete_text_image_claude` and `get_gpt4v_output`.
+    """
+    base64_image = image_to_base64(image)
+    if 'claude' in model:
+        if json_object:
+            message = "You are a helpful assistant designed to output in JSON format." + message
+        content = [
+            {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": base64_image}},
+            {"type": "text", "text": message}
+        ]
+    elif 'gpt-4' in model:
+        if json_object and 'json' not in message.lower():
+            message = 'You are a helpful assistant designed to output JSON. ' + message
+        content = [
+            {"type": "text", "text": message},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+        ]
+    else:
+        raise ValueError(f"Model {model} not recognized.")
+    return [{"role": "user", "content": content}]
 
 
 def get_llm_vision_output(image: Image.Image,
@@ -141,10 +178,8 @@ def get_llm_vision_output(image: Image.Image,
     }
     
     if 'claude' in model:
-        kwargs.update({'max_retry': MAX_CLAUDE_RETRY, 'sleep_time': CLAUDE_SLEEP_TIME})
         return complete_text_image_claude(**kwargs)
     if 'gpt-4' in model:
-        kwargs.update({'max_retry': MAX_OPENAI_RETRY, 'sleep_time': OPENAI_SLEEP_TIME})
         return get_gpt4v_output(**kwargs)
     else:
         raise ValueError(f"Model {model} not recognized.")
@@ -0,0 +1,216 @@
+import json
+import os
+import os.path as osp
+import shutil
+import threading
+import numpy as np
+from collections import Counter
+from tqdm import tqdm
+from typing import Dict, List, Union
+
+from avatar.utils.doc_cache import get_doc_info
+from stark_qa.tools.process_text import normalize_answer
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into normalized tokens, the same way as `stark_qa.tools.process_text.f1_score`.
+    """
+    return normalize_answer(text.lower()).split()
+
+
+class BM25Index:
+    """
+    A persistent inverted index over node documents with BM25 scoring, laid out as
+        meta.json:        k1, b and the document rendering settings
+        vocab.json:       term -> term id
+        doc_ids.npy:      indexed node ids, int64 of size (num_docs,)
+        doc_lens.npy:     number of tokens of each document, int32 of size (num_docs,)
+        term_offsets.npy: start of the posting list of each term, int64 of size (num_terms + 1,)
+        postings.npy:     document positions of all posting lists, int32
+        tfs.npy:          term frequencies aligned with postings.npy, int32
+
+    Args:
+        path (str): Directory of the index.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(osp.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        with open(osp.join(path, 'vocab.json')) as f:
+            self.vocab = json.load(f)
+        self.k1, self.b = self.meta['k1'], self.meta['b']
+        self.doc_ids = np.load(osp.join(path, 'doc_ids.npy'))
+        self.doc_lens = np.load(osp.join(path, 'doc_lens.npy'))
+        self.term_offsets = np.load(osp.join(path, 'term_offsets.npy'))
+        self.postings = np.load(osp.join(path, 'postings.npy'), mmap_mode='r')
+        self.tfs = np.load(osp.join(path, 'tfs.npy'), mmap_mode='r')
+
+        num_docs = len(self.doc_ids)
+        doc_freqs = np.diff(self.term_offsets)
+        self.idf = np.log(1 + (num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_doc_len = max(self.doc_lens.mean(), 1.) if num_docs else 1.
+        self.doc_norms = (self.k1 * (1 - self.b + self.b * self.doc_lens / avg_doc_len)).astype(np.float32)
+        self.id_to_pos = np.full(int(self.doc_ids.max()) + 1 if num_docs else 0, -1, dtype=np.int64)
+        self.id_to_pos[self.doc_ids] = np.arange(num_docs)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return osp.exists(osp.join(path, 'meta.json'))
+
+    @classmethod
+    def build(cls,
+              path: str,
+              kb,
+              node_ids: List[int],
+              add_rel: bool = True,
+              compact: bool = True,
+              k1: float = 1.5,
+              b: float = 0.75) -> 'BM25Index':
+        """
+        Index the documents of `node_ids` into a new index at `path`.
+
+        Args:
+            path (str): Directory of the index.
+            kb: The knowledge base.
+            node_ids (List[int]): Nodes to index, e.g., all candidates.
+            add_rel (bool): Whether documents include the relation information of the nodes.
+            compact (bool): Whether documents are rendered in their compact version.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+
+        Returns:
+            BM25Index: The new index.
+        """
+        vocab: Dict[str, int] = {}
+        doc_lens = np.zeros(len(node_ids), dtype=np.int32)
+        term_ids, tfs, doc_pos = [], [], []
+        for pos, node_id in enumerate(tqdm(node_ids, desc=f'Indexing documents into {path}')):
+            tokens = tokenize(get_doc_info(kb, node_id, add_rel=add_rel, compact=compact))
+            doc_lens[pos] = len(tokens)
+            counts = Counter(tokens)
+            term_ids.append(np.fromiter((vocab.setdefault(token, len(vocab)) for token in counts),
+                                        dtype=np.int64, count=len(counts)))
+            tfs.append(np.fromiter(counts.values(), dtype=np.int32, count=len(counts)))
+            doc_pos.append(np.full(len(counts), pos, dtype=np.int32))
+
+        term_ids = np.concatenate(term_ids) if len(term_ids) else np.zeros(0, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum(np.bincount(term_ids, minlength=len(vocab)))
+
+        # Build aside and rename, so that readers never see a half-written index
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(osp.join(tmp_path, 'doc_ids.npy'), np.asarray(node_ids, dtype=np.int64))
+        np.save(osp.join(tmp_path, 'doc_lens.npy'), doc_lens)
+        np.save(osp.join(tmp_path, 'term_offsets.npy'), term_offsets)
+        np.save(osp.join(tmp_path, 'postings.npy'),
+                np.concatenate(doc_pos)[order] if len(doc_pos) else np.zeros(0, dtype=np.int32))
+        np.save(osp.join(tmp_path, 'tfs.npy'), np.concatenate(tfs)[order] if len(tfs) else np.zeros(0, dtype=np.int32))
+        with open(osp.join(tmp_path, 'vocab.json'), 'w') as f:
+            json.dump(vocab, f)
+        with open(osp.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'k1': k1, 'b': b, 'add_rel': add_rel, 'compact': compact, 'num_docs': len(node_ids)}, f, indent=4)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process built it first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def score_all(self, query: str) -> np.ndarray:
+        """
+        Compute the BM25 scores of all indexed documents for `query`.
+
+        Args:
+            query (str): The query, e.g., keywords.
+
+        Returns:
+            np.ndarray: Scores aligned with `self.doc_ids`, of size (num_docs,).
+        """
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term, query_tf in Counter(tokenize(query)).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = np.asarray(self.postings[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            scores[docs] += query_tf * self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.doc_norms[docs])
+        return scores
+
+    def score(self, query: str, node_ids: List[int]) -> np.ndarray:
+        """
+        Compute the BM25 scores of the documents of `node_ids` for `query`. Nodes that are not indexed score 0.
+
+        Args:
+            query (str): The query, e.g., keywords.
+            node_ids (List[int]): Node IDs.
+
+        Returns:
+            np.ndarray: Scores of size (len(node_ids),).
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64).reshape(-1)
+        if len(self.doc_ids) == 0:
+            return np.zeros(len(node_ids), dtype=np.float32)
+        pos = np.full(len(node_ids), -1, dtype=np.int64)
+        in_range = (node_ids >= 0) & (node_ids < len(self.id_to_pos))
+        pos[in_range] = self.id_to_pos[node_ids[in_range]]
+        scores = self.score_all(query)
+        return np.where(pos >= 0, scores[np.maximum(pos, 0)], 0.).astype(np.float32)
+
+
+def bm25_index_path(node_emb_dir: str) -> str:
+    return osp.join(node_emb_dir, 'candidate_bm25_index')
+
+
+_bm25_indices: Dict[str, BM25Index] = {}
+_bm25_lock = threading.Lock()
+
+
+def load_bm25_index(path: str, 
+                    kb=None, 
+                    node_ids: List[int] = None, 
+                    add_rel: bool = True,
+                    compact: bool = True,
+                    k1: float = 1.5,
+                    b: float = 0.75) -> Union[BM25Index, None]:
+    """
+    Open the index at `path`, building it over the documents of `node_ids` (by default, all candidates of `kb`)
+    if it does not exist or was built with other settings. Indices are opened once per process.
+
+    Args:
+        path (str): Directory of the index.
+        kb: The knowledge base. If None, a missing or stale index is not built.
+        node_ids (List[int]): Nodes to index. Defaults to `kb.candidate_ids`.
+        add_rel (bool): Whether documents include the relation information of the nodes.
+        compact (bool): Whether documents are rendered in their compact version.
+        k1 (float): BM25 term frequency saturation.
+        b (float): BM25 document length normalization.
+
+    Returns:
+        BM25Index: The index, or None if it neither exists with these settings nor can be built.
+    """
+    settings = {'add_rel': add_rel, 'compact': compact, 'k1': k1, 'b': b}
+    key = osp.realpath(path)
+    with _bm25_lock:
+        index = _bm25_indices.get(key)
+        if index is None and BM25Index.exists(path):
+            index = BM25Index(path)
+        if index is not None and any(index.meta.get(name) != value for name, value in settings.items()):
+            print(f'BM25 index at {path} was built with other settings than {settings}')
+            index = None
+        if index is None:
+            if kb is None:
+                return None
+            # Readers of the stale index keep their memory maps of the removed files
+            shutil.rmtree(path, ignore_errors=True)
+            node_ids = kb.candidate_ids if node_ids is None else node_ids
+            index = BM25Index.build(path, kb, node_ids, **settings)
+        _bm25_indices[key] = index
+        return index
@@ -0,0 +1,172 @@
+import os
+import os.path as osp
+import shutil
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Union
+
+
+class DocTextStore:
+    """
+    A memory-mapped store of pre-rendered document texts, laid out as
+        texts.bin:   UTF-8 encoded texts, concatenated
+        ids.npy:     node ids, int64 of size (num_docs,)
+        offsets.npy: byte offsets into texts.bin, int64 of size (num_docs + 1,)
+
+    Args:
+        path (str): Directory of the store.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ids = np.load(osp.join(path, 'ids.npy'))
+        self.offsets = np.load(osp.join(path, 'offsets.npy'))
+        if self.offsets[-1] > 0:
+            self.texts = np.memmap(osp.join(path, 'texts.bin'), dtype=np.uint8, mode='r')
+        else:
+            self.texts = np.zeros(0, dtype=np.uint8)
+        self.id_to_pos = np.full(int(self.ids.max()) + 1 if len(self.ids) else 0, -1, dtype=np.int64)
+        self.id_to_pos[self.ids] = np.arange(len(self.ids))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return osp.exists(osp.join(path, 'offsets.npy'))
+
+    @classmethod
+    def open(cls, path: str) -> Union['DocTextStore', None]:
+        """
+        Open the store at `path`, or return None if it does not exist.
+        """
+        return cls(path) if cls.exists(path) else None
+
+    @classmethod
+    def write(cls, path: str, ids: List[int], texts: List[str]) -> 'DocTextStore':
+        """
+        Write `texts` of nodes `ids` into a new store at `path`, replacing any existing one.
+
+        Args:
+            path (str): Directory of the store.
+            ids (List[int]): Node ids.
+            texts (List[str]): Document text of each node.
+
+        Returns:
+            DocTextStore: The new store.
+        """
+        assert len(ids) == len(texts), 'ids and texts do not match'
+        # Build aside and rename, so that readers never see a half-written store
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        os.makedirs(tmp_path, exist_ok=True)
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        with open(osp.join(tmp_path, 'texts.bin'), 'wb') as f:
+            for i, text in enumerate(texts):
+                data = text.encode('utf-8')
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+        np.save(osp.join(tmp_path, 'ids.npy'), np.asarray(ids, dtype=np.int64))
+        np.save(osp.join(tmp_path, 'offsets.npy'), offsets)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, node_id: int) -> Union[str, None]:
+        """
+        Get the text of `node_id`, or None if it is not in the store.
+        """
+        if not 0 <= node_id < len(self.id_to_pos) or self.id_to_pos[node_id] < 0:
+            return None
+        pos = self.id_to_pos[node_id]
+        return self.texts[self.offsets[pos]:self.offsets[pos + 1]].tobytes().decode('utf-8')
+
+
+def doc_text_store_path(text_store_dir: str, add_rel: bool, compact: bool) -> str:
+    return osp.join(text_store_dir, f'doc_text_store_add_rel={add_rel}_compact={compact}')
+
+
+class DocTextCache:
+    """
+    A cache of `kb.get_doc_info` results keyed by (node_id, add_rel, compact). Texts are read from
+    pre-rendered stores in `text_store_dir` if available (see `scripts/doc_text_generate.py`), and
+    otherwise rendered once and kept in a bounded in-process LRU.
+
+    Args:
+        kb: The knowledge base.
+        capacity (int): Maximum number of texts kept in the LRU.
+        text_store_dir (str): Directory with pre-rendered `DocTextStore`s. If None, only the LRU is used.
+    """
+
+    def __init__(self, kb, capacity: int = 100000, text_store_dir: str = None):
+        self.kb = kb
+        self.capacity = capacity
+        self.text_store_dir = text_store_dir
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.text_stores = {}
+
+    def get_text_store(self, add_rel: bool, compact: bool) -> Union[DocTextStore, None]:
+        if self.text_store_dir is None:
+            return None
+        if (add_rel, compact) not in self.text_stores:
+            self.text_stores[(add_rel, compact)] = DocTextStore.open(doc_text_store_path(self.text_store_dir, add_rel, compact))
+        return self.text_stores[(add_rel, compact)]
+
+    def get(self, node_id: int, add_rel: bool = False, compact: bool = False) -> str:
+        """
+        Get the document text of `node_id`, equivalent to `kb.get_doc_info(node_id, add_rel=add_rel, compact=compact)`.
+
+        Args:
+            node_id (int): The node ID.
+            add_rel (bool): Whether to include the relation information of the node.
+            compact (bool): Whether to render the compact version of the text.
+
+        Returns:
+            str: The document text.
+        """
+        node_id = int(node_id)
+        text_store = self.get_text_store(add_rel, compact)
+        if text_store is not None:
+            text = text_store.get(node_id)
+            if text is not None:
+                return text
+
+        key = (node_id, add_rel, compact)
+        with self.lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                return self.lru[key]
+        text = self.kb.get_doc_info(node_id, add_rel=add_rel, compact=compact)
+        with self.lock:
+            self.lru[key] = text
+            while len(self.lru) > self.capacity:
+                self.lru.popitem(last=False)
+        return text
+
+
+_doc_caches: Dict[int, DocTextCache] = {}
+
+
+def get_doc_cache(kb) -> DocTextCache:
+    """
+    Get the process-wide document text cache of `kb`.
+    """
+    if id(kb) not in _doc_caches:
+        _doc_caches[id(kb)] = DocTextCache(kb)
+    return _doc_caches[id(kb)]
+
+
+def set_doc_cache(kb, capacity: int = 100000, text_store_dir: str = None) -> DocTextCache:
+    """
+    Replace the process-wide document text cache of `kb`, e.g., to read pre-rendered texts from `text_store_dir`.
+    """
+    _doc_caches[id(kb)] = DocTextCache(kb, capacity=capacity, text_store_dir=text_store_dir)
+    return _doc_caches[id(kb)]
+
+
+def get_doc_info(kb, node_id: int, add_rel: bool = False, compact: bool = False) -> str:
+    """
+    Cached drop-in for `kb.get_doc_info`, see `DocTextCache.get`.
+    """
+    return get_doc_cache(kb).get(node_id, add_rel=add_rel, compact=compact)
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import os.path as osp
+import sqlite3
+import threading
+import numpy as np
+import torch
+from collections import OrderedDict
+from typing import List, Tuple, Union
+from avatar.utils.api import get_openai_embedding, get_openai_embeddings
+
+
+# Set to an empty string to keep the cache in memory only
+DEFAULT_EMB_CACHE_PATH = os.getenv('AVATAR_EMB_CACHE_PATH', osp.join(osp.expanduser('~'), '.cache', 'avatar', 'emb_cache.db'))
+
+
+class EmbeddingCache:
+    """
+    A two-tier cache of text embeddings keyed by (embedding model, hash of the text): an in-process LRU
+    in front of a persistent SQLite table that is shared by all processes using the same `path`.
+
+    Args:
+        path (str): Path to the SQLite database. If None or empty, only the in-process tier is used.
+        capacity (int): Maximum number of embeddings kept in the in-process tier.
+    """
+
+    def __init__(self, path: str = DEFAULT_EMB_CACHE_PATH, capacity: int = 10000):
+        self.path = path
+        self.capacity = capacity
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    @staticmethod
+    def key(text: str, model: str) -> Tuple[str, str]:
+        return model, hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @property
+    def conn(self) -> Union[sqlite3.Connection, None]:
+        if not self.path:
+            return None
+        # connections cannot be shared with forked worker processes
+        if self._conn is None or self._conn_pid != os.getpid():
+            os.makedirs(osp.dirname(osp.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS embeddings '
+                               '(model TEXT, hash TEXT, emb BLOB, PRIMARY KEY (model, hash))')
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, text: str, model: str) -> Union[torch.FloatTensor, None]:
+        """
+        Look up the embedding of `text`, or return None if it is not cached.
+        """
+        key = self.key(text, model)
+        with self.lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                return self.lru[key]
+            if self.conn is None:
+                return None
+            row = self.conn.execute('SELECT emb FROM embeddings WHERE model = ? AND hash = ?', key).fetchone()
+        if row is None:
+            return None
+        emb = torch.from_numpy(np.frombuffer(row[0], dtype=np.float32).copy()).view(1, -1)
+        self._remember(key, emb)
+        return emb
+
+    def put(self, texts: List[str], model: str, embs: torch.Tensor) -> None:
+        """
+        Cache the embeddings of `texts`, given as a tensor of size (len(texts), hidden_dim).
+        """
+        embs = embs.detach().float().cpu().view(len(texts), -1)
+        keys = [self.key(text, model) for text in texts]
+        for key, emb in zip(keys, embs):
+            self._remember(key, emb.view(1, -1).clone())
+        with self.lock:
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)',
+                                          [(*key, emb.numpy().tobytes()) for key, emb in zip(keys, embs)])
+
+    def _remember(self, key: Tuple[str, str], emb: torch.FloatTensor) -> None:
+        with self.lock:
+            self.lru[key] = emb
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.capacity:
+                self.lru.popitem(last=False)
+
+    def get_embedding(self, text: str, model: str = 'text-embedding-ada-002') -> torch.FloatTensor:
+        """
+        Get the embedding of `text`, calling the embedding API only on a cache miss.
+
+        Args:
+            text (str): Text to embed, e.g., a query.
+            model (str): Embedding model name.
+
+        Returns:
+            torch.FloatTensor: The embedding of size (1, hidden_dim).
+        """
+        emb = self.get(text, model)
+        if emb is None:
+            emb = get_openai_embedding(text, model=model).float().view(1, -1)
+            self.put([text], model, emb)
+        return emb
+
+    def get_embeddings(self, texts: List[str], model: str = 'text-embedding-ada-002') -> torch.FloatTensor:
+        """
+        Get the embeddings of `texts`, embedding all cache misses in one batched API call.
+
+        Args:
+            texts (List[str]): Texts to embed.
+            model (str): Embedding model name.
+
+        Returns:
+            torch.FloatTensor: The embeddings of size (len(texts), hidden_dim).
+        """
+        embs = [self.get(text, model) for text in texts]
+        missing = list(OrderedDict.fromkeys(text for text, emb in zip(texts, embs) if emb is None))
+        if len(missing) > 0:
+            new_embs = get_openai_embeddings(missing, model=model).float().view(len(missing), -1)
+            self.put(missing, model, new_embs)
+            new_embs = dict(zip(missing, new_embs))
+            embs = [new_embs[text].view(1, -1) if emb is None else emb for text, emb in zip(texts, embs)]
+        return torch.cat(embs, dim=0)
+
+
+_emb_cache = None
+
+
+def get_emb_cache() -> EmbeddingCache:
+    """
+    Get the process-wide embedding cache.
+    """
+    global _emb_cache
+    if _emb_cache is None:
+        _emb_cache = EmbeddingCache()
+    return _emb_cache
+
+
+def set_emb_cache(path: str = DEFAULT_EMB_CACHE_PATH, capacity: int = 10000) -> EmbeddingCache:
+    """
+    Replace the process-wide embedding cache, e.g., to move its persistent tier or to disable it with `path=None`.
+    """
+    global _emb_cache
+    _emb_cache = EmbeddingCache(path, capacity=capacity)
+    return _emb_cache
+
+
+def get_text_embedding(text: str, model: str = 'text-embedding-ada-002') -> torch.FloatTensor:
+    """
+    Cached drop-in for `stark_qa.tools.api.get_openai_embedding`, see `EmbeddingCache.get_embedding`.
+    """
+    return get_emb_cache().get_embedding(text, model=model)
+
+
+def get_text_embeddings(texts: List[str], model: str = 'text-embedding-ada-002') -> torch.FloatTensor:
+    """
+    Cached drop-in for `stark_qa.tools.api.get_openai_embeddings`, see `EmbeddingCache.get_embeddings`.
+    """
+    return get_emb_cache().get_embeddings(texts, model=model)
@@ -0,0 +1,589 @@
+import fcntl
+import json
+import os
+import os.path as osp
+import shutil
+import threading
+import time
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from tqdm import tqdm
+from typing import Callable, Dict, List, Tuple, Union
+
+
+EMB_DTYPES = ['float32', 'float16', 'bfloat16', 'int8']
+# numpy has no bfloat16, so bfloat16 rows are kept as their int16 bit patterns
+_NUMPY_DTYPES = {'float32': np.float32, 'float16': np.float16, 'bfloat16': np.int16, 'int8': np.int8}
+
+
+def quantize(embs: torch.Tensor, dtype: str) -> Tuple[torch.Tensor, Union[torch.FloatTensor, None]]:
+    """
+    Convert float embeddings into a storage dtype.
+
+    Args:
+        embs (torch.Tensor): Embeddings of size (n, hidden_dim).
+        dtype (str): One of `EMB_DTYPES`. 'int8' uses symmetric per-row scales.
+
+    Returns:
+        codes (torch.Tensor): Embeddings in the storage dtype.
+        scales (torch.FloatTensor): Per-row scales of size (n,) for 'int8', otherwise None.
+    """
+    assert dtype in EMB_DTYPES, f'dtype must be in {EMB_DTYPES}, but got {dtype}'
+    embs = embs.float()
+    if dtype != 'int8':
+        return embs.to(getattr(torch, dtype)), None
+    scales = (embs.abs().amax(dim=-1) / 127.).clamp(min=1e-12)
+    codes = torch.round(embs / scales.unsqueeze(-1)).clamp(-127, 127).to(torch.int8)
+    return codes, scales
+
+
+def dequantize(codes: torch.Tensor, scales: torch.FloatTensor = None) -> torch.FloatTensor:
+    """
+    Inverse of `quantize`.
+    """
+    embs = codes.float()
+    if scales is not None:
+        embs = embs * scales.float().unsqueeze(-1)
+    return embs
+
+
+def quantized_matmul(query_embs: torch.Tensor, 
+                     embs: torch.Tensor, 
+                     scales: torch.FloatTensor = None, 
+                     block_size: int = 65536) -> torch.FloatTensor:
+    """
+    Inner products between float queries and stored embeddings, dequantizing the embeddings block by block
+    so that a float32 copy of the whole matrix is never materialized.
+
+    Args:
+        query_embs (torch.Tensor): Query embeddings of size (n, hidden_dim), on the same device as `embs`.
+        embs (torch.Tensor): Stored embeddings of size (num_rows, hidden_dim) in any of `EMB_DTYPES`.
+        scales (torch.FloatTensor): Per-row scales of size (num_rows,) for int8 embeddings.
+        block_size (int): Number of rows dequantized at a time.
+
+    Returns:
+        similarity (torch.FloatTensor): Similarity scores of size (n, num_rows).
+    """
+    query_embs = query_embs.view(-1, embs.size(-1))
+    if scales is None and (embs.dtype == torch.float32 or embs.device.type == 'cuda'):
+        # half precision matmuls are native on GPU
+        return torch.matmul(query_embs.to(embs.dtype), embs.T).float()
+    query_embs = query_embs.float()
+    similarity = []
+    for start in range(0, len(embs), block_size):
+        block = embs[start:start + block_size].float()
+        sim = torch.matmul(query_embs, block.T)
+        if scales is not None:
+            sim = sim * scales[start:start + block_size].float()
+        similarity.append(sim)
+    if len(similarity) == 0:
+        return torch.zeros(len(query_embs), 0, device=embs.device)
+    return torch.cat(similarity, dim=1)
+
+
+class EmbeddingStore:
+    """
+    A columnar on-disk embedding store that is memory-mapped and read zero-copy.
+
+    A store is a directory with
+        - `embs.bin`: a contiguous row-major matrix of size (num_rows, dim),
+        - `ids.npy`: the ids (e.g., node ids or query ids) in the store,
+        - `offsets.npy`: the rows of the i-th id are `offsets[i]:offsets[i + 1]`,
+        - `meta.json`: the dimension, dtype and number of rows,
+        - `scales.bin`: per-row float32 scales, only for the 'int8' dtype,
+        - `manifest.npz`: source file modification times, only for stores built by `build_store_from_files`.
+    Rows are stored as float32, float16, bfloat16 or int8 (see `quantize`) and dequantized on the fly when read.
+    Each id owns one row for node/query embeddings, or a contiguous range of rows for chunk embeddings.
+    Pages of `embs.bin` live in the OS page cache, so every process opening the same store shares them.
+
+    Args:
+        path (str): Directory of the store.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.refresh()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return osp.exists(osp.join(path, 'meta.json'))
+
+    @classmethod
+    def create(cls, path: str, dim: int, dtype: str = 'float32') -> 'EmbeddingStore':
+        """
+        Create an empty store.
+
+        Args:
+            path (str): Directory of the store.
+            dim (int): Embedding dimension.
+            dtype (str): Storage dtype, one of `EMB_DTYPES`.
+
+        Returns:
+            EmbeddingStore: The empty store.
+        """
+        assert dtype in EMB_DTYPES, f'dtype must be in {EMB_DTYPES}, but got {dtype}'
+        os.makedirs(path, exist_ok=True)
+        open(osp.join(path, 'embs.bin'), 'wb').close()
+        if dtype == 'int8':
+            open(osp.join(path, 'scales.bin'), 'wb').close()
+        np.save(osp.join(path, 'ids.npy'), np.zeros(0, dtype=np.int64))
+        np.save(osp.join(path, 'offsets.npy'), np.zeros(1, dtype=np.int64))
+        cls._write_meta(path, {'dim': dim, 'dtype': dtype, 'num_rows': 0, 'version': 0, 'created': time.time()})
+        return cls(path)
+
+    @classmethod
+    def open_or_create(cls, path: str, dim: int, dtype: str = 'float32') -> 'EmbeddingStore':
+        """
+        Open the store at `path`, or create an empty one if it does not exist.
+        """
+        with cls._lock(path):
+            if cls.exists(path):
+                return cls(path)
+            return cls.create(path, dim=dim, dtype=dtype)
+
+    @classmethod
+    def from_emb_dict(cls, 
+                      path: str, 
+                      emb_dict: Dict[int, torch.Tensor], 
+                      ids: List[int] = None, 
+                      **kwargs) -> 'EmbeddingStore':
+        """
+        Create a store from a dictionary mapping each id to a tensor of size (hidden_dim,) or (n_rows, hidden_dim).
+
+        Args:
+            path (str): Directory of the store.
+            emb_dict (Dict[int, torch.Tensor]): The embedding dictionary, e.g., loaded from `candidate_emb_dict.pt`.
+            ids (List[int]): Row order of the store, e.g., `kb.candidate_ids`. Ids missing from `emb_dict` are skipped.
+                             Defaults to the order of `emb_dict`.
+            **kwargs: Arguments passed to `create`.
+
+        Returns:
+            EmbeddingStore: The new store.
+        """
+        ids = list(emb_dict.keys()) if ids is None else [idx for idx in ids if idx in emb_dict]
+        embs = [emb_dict[idx] for idx in ids]
+        dim = embs[0].size(-1)
+        store = cls.create(path, dim=dim, **kwargs)
+        counts = [emb.numel() // dim for emb in embs]
+        store.append(ids, torch.cat([emb.reshape(-1, dim) for emb in embs], dim=0), counts=counts)
+        return store
+
+    @classmethod
+    def load_or_convert(cls, 
+                        path: str, 
+                        emb_dict_path: str = None, 
+                        ids: List[int] = None, 
+                        **kwargs) -> Union['EmbeddingStore', None]:
+        """
+        Open the store at `path`. If it does not exist, convert the pickled embedding dictionary
+        at `emb_dict_path` into a store once, so later processes can memory-map it.
+
+        Args:
+            path (str): Directory of the store.
+            emb_dict_path (str): Path to a pickled `{id: embedding}` dictionary.
+            ids (List[int]): Row order of the converted store, see `from_emb_dict`.
+            **kwargs: Arguments passed to `create`.
+
+        Returns:
+            EmbeddingStore: The store, or None if neither the store nor the dictionary exists.
+        """
+        if cls.exists(path):
+            return cls(path)
+        if emb_dict_path is None or not osp.exists(emb_dict_path):
+            return None
+        print(f'Converting {emb_dict_path} into an embedding store at {path}...')
+        # Build aside and rename, so that concurrent workers never see a half-written store
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        cls.from_emb_dict(tmp_path, torch.load(emb_dict_path), ids=ids, **kwargs)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process converted it first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return cls(path)
+
+    def refresh(self) -> None:
+        """
+        (Re)map the store files, e.g., after another process appended to the store.
+        """
+        with open(osp.join(self.path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.dim = self.meta['dim']
+        self.dtype = self.meta['dtype']
+        self.num_rows = self.meta['num_rows']
+        self.ids = np.load(osp.join(self.path, 'ids.npy'))
+        self.offsets = np.load(osp.join(self.path, 'offsets.npy'))
+        # The id arrays may be rewritten after the meta file by an appending process
+        num_ids = int(np.searchsorted(self.offsets, self.num_rows, side='right')) - 1
+        self.ids, self.offsets = self.ids[:num_ids], self.offsets[:num_ids + 1]
+
+        self.scales = None
+        if self.num_rows > 0:
+            # copy-on-write mapping: pages are shared until written, which we never do
+            self._mmap = np.memmap(osp.join(self.path, 'embs.bin'), dtype=_NUMPY_DTYPES[self.dtype],
+                                   mode='c', shape=(self.num_rows, self.dim))
+            self.embs = torch.from_numpy(self._mmap)
+            if self.dtype == 'bfloat16':
+                self.embs = self.embs.view(torch.bfloat16)
+            if self.dtype == 'int8':
+                self.scales = torch.from_numpy(np.memmap(osp.join(self.path, 'scales.bin'), dtype=np.float32,
+                                                         mode='c', shape=(self.num_rows,)))
+        else:
+            self._mmap = None
+            self.embs = torch.zeros(0, self.dim, dtype=getattr(torch, self.dtype))
+            if self.dtype == 'int8':
+                self.scales = torch.zeros(0)
+
+        self.id_to_pos = np.full(int(self.ids.max()) + 1 if len(self.ids) else 0, -1, dtype=np.int64)
+        self.id_to_pos[self.ids] = np.arange(len(self.ids))
+
+    @classmethod
+    def open(cls, path: str) -> Union['EmbeddingStore', None]:
+        """
+        Open the store at `path`, or return None if it does not exist.
+        """
+        return cls(path) if cls.exists(path) else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, idx: int) -> bool:
+        return 0 <= idx < len(self.id_to_pos) and self.id_to_pos[idx] >= 0
+
+    def positions(self, ids: Union[List[int], np.ndarray, torch.Tensor]) -> np.ndarray:
+        """
+        Map ids to their positions in the store. Missing ids are mapped to -1.
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        pos = np.full(len(ids), -1, dtype=np.int64)
+        in_range = (ids >= 0) & (ids < len(self.id_to_pos))
+        pos[in_range] = self.id_to_pos[ids[in_range]]
+        return pos
+
+    def get(self, ids: Union[List[int], np.ndarray, torch.Tensor]) -> torch.Tensor:
+        """
+        Gather the embeddings of ids that own a single row each.
+
+        Args:
+            ids (Union[List[int], np.ndarray, torch.Tensor]): Ids to gather.
+
+        Returns:
+            torch.FloatTensor: Dequantized embeddings of size (len(ids), dim).
+        """
+        pos = self.positions(ids)
+        assert (pos >= 0).all(), f'ids {np.asarray(ids).reshape(-1)[pos < 0][:10].tolist()} are not in the store {self.path}'
+        return self.get_rows(torch.from_numpy(self.offsets[pos]))
+
+    def get_rows(self, rows: torch.LongTensor) -> torch.FloatTensor:
+        """
+        Gather and dequantize rows of the matrix.
+        """
+        return dequantize(self.embs[rows], None if self.scales is None else self.scales[rows])
+
+    def get_ragged(self, ids: Union[List[int], np.ndarray, torch.Tensor]) -> Tuple[torch.Tensor, torch.LongTensor]:
+        """
+        Gather all rows of each id, e.g., the chunk embeddings of several nodes.
+
+        Args:
+            ids (Union[List[int], np.ndarray, torch.Tensor]): Ids to gather.
+
+        Returns:
+            embs (torch.FloatTensor): Concatenated dequantized rows of all ids, of size (sum(counts), dim).
+            counts (torch.LongTensor): Number of rows of each id.
+        """
+        pos = self.positions(ids)
+        assert (pos >= 0).all(), f'ids {np.asarray(ids).reshape(-1)[pos < 0][:10].tolist()} are not in the store {self.path}'
+        starts, ends = self.offsets[pos], self.offsets[pos + 1]
+        counts = ends - starts
+        rows = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return self.get_rows(torch.from_numpy(rows)), torch.from_numpy(counts)
+
+    def append(self,
+               ids: List[int],
+               embs: torch.Tensor,
+               counts: List[int] = None) -> None:
+        """
+        Append new ids and their rows to the store. Only the delta is written to `embs.bin`.
+
+        Args:
+            ids (List[int]): New ids. Ids that are already in the store, e.g., added by another process 
+                             in the meantime, are skipped.
+            embs (torch.Tensor): Rows of the new ids, of size (sum(counts), dim).
+            counts (List[int]): Number of rows of each id. Defaults to one row per id.
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        counts = np.ones(len(ids), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        embs, scales = self._encode(embs)
+        assert len(ids) == len(counts) and counts.sum() == len(embs), 'ids, counts and embs do not match'
+        assert len(np.unique(ids)) == len(ids), 'ids should be unique'
+
+        with self._lock(self.path):
+            self.refresh()
+            is_new = self.positions(ids) < 0
+            if not is_new.all():
+                row_mask = torch.from_numpy(np.repeat(is_new, counts))
+                ids, counts, embs = ids[is_new], counts[is_new], embs[row_mask]
+                scales = None if scales is None else scales[row_mask]
+            self._write_rows(self.num_rows, embs, scales)
+            new_ids = np.concatenate([self.ids, ids])
+            new_offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(counts)])
+            self._save_array('ids.npy', new_ids)
+            self._save_array('offsets.npy', new_offsets)
+            self._write_meta(self.path, dict(self.meta, num_rows=self.num_rows + len(embs),
+                                             version=self.meta.get('version', 0) + 1))
+        self.refresh()
+
+    def update(self, ids: List[int], embs: torch.Tensor) -> None:
+        """
+        Overwrite the rows of ids that are already in the store and own a single row each, in place.
+
+        Args:
+            ids (List[int]): Ids in the store.
+            embs (torch.Tensor): New rows of size (len(ids), dim).
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        embs, scales = self._encode(embs)
+        assert len(ids) == len(embs), 'ids and embs do not match'
+
+        with self._lock(self.path):
+            self.refresh()
+            pos = self.positions(ids)
+            assert (pos >= 0).all(), 'some ids are not in the store'
+            assert (self.offsets[pos + 1] - self.offsets[pos] == 1).all(), 'only ids with a single row can be updated'
+            for row, idx in zip(self.offsets[pos], range(len(ids))):
+                self._write_rows(int(row), embs[idx:idx + 1], None if scales is None else scales[idx:idx + 1])
+            self._write_meta(self.path, dict(self.meta, version=self.meta.get('version', 0) + 1))
+        self.refresh()
+
+    def _encode(self, embs: torch.Tensor) -> Tuple[torch.Tensor, Union[torch.FloatTensor, None]]:
+        embs = embs.reshape(-1, self.dim).cpu()
+        if embs.dtype != getattr(torch, self.dtype):
+            embs, scales = quantize(embs, self.dtype)
+        else:
+            # already in the storage dtype, e.g., when converting between stores
+            scales = None
+        if self.dtype == 'int8':
+            assert scales is not None, 'int8 rows must be written as float embeddings'
+        return embs.contiguous(), scales
+
+    def _write_rows(self, start: int, embs: torch.Tensor, scales: torch.FloatTensor = None) -> None:
+        with open(osp.join(self.path, 'embs.bin'), 'r+b') as f:
+            f.seek(start * self.dim * embs.element_size())
+            f.write(embs.view(torch.int16).numpy().tobytes() if self.dtype == 'bfloat16' else embs.numpy().tobytes())
+        if scales is not None:
+            with open(osp.join(self.path, 'scales.bin'), 'r+b') as f:
+                f.seek(start * 4)
+                f.write(scales.float().contiguous().numpy().tobytes())
+
+    def quantize_to(self, path: str, dtype: str, block_size: int = 65536) -> 'EmbeddingStore':
+        """
+        Open the copy of this store in another dtype at `path`, (re)building it if it is missing or stale.
+
+        Args:
+            path (str): Directory of the converted store.
+            dtype (str): Storage dtype of the converted store, one of `EMB_DTYPES`.
+            block_size (int): Number of rows converted at a time.
+
+        Returns:
+            EmbeddingStore: The converted store with the same ids and offsets.
+        """
+        if EmbeddingStore.exists(path):
+            store = EmbeddingStore(path)
+            if store.dtype == dtype and store.meta.get('source_version') == self.meta.get('version', 0) \
+                    and np.array_equal(store.ids, self.ids) and np.array_equal(store.offsets, self.offsets):
+                return store
+            print(f'Embedding store at {path} is stale, rebuilding...')
+            shutil.rmtree(path, ignore_errors=True)
+
+        print(f'Converting {self.path} into {dtype} at {path}...')
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        store = EmbeddingStore.create(tmp_path, dim=self.dim, dtype=dtype)
+        for start in range(0, len(self), block_size):
+            ids = self.ids[start:start + block_size]
+            offsets = self.offsets[start:start + block_size + 1]
+            embs = self.get_rows(torch.arange(offsets[0], offsets[-1]))
+            store.append(ids, embs, counts=np.diff(offsets))
+        self._write_meta(tmp_path, dict(store.meta, source_version=self.meta.get('version', 0)))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return EmbeddingStore(path)
+
+    def _save_array(self, name: str, array: np.ndarray) -> None:
+        tmp_path = osp.join(self.path, f'{name}.tmp.npy')
+        np.save(tmp_path, array)
+        os.replace(tmp_path, osp.join(self.path, name))
+
+    @staticmethod
+    def _write_meta(path: str, meta: Dict) -> None:
+        tmp_path = osp.join(path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, osp.join(path, 'meta.json'))
+
+    @staticmethod
+    @contextmanager
+    def _lock(path: str):
+        """
+        Exclusive lock so that concurrent eval workers do not write the same store at the same time.
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(osp.join(path, '.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def candidate_store_path(node_emb_dir: str) -> str:
+    return osp.join(node_emb_dir, 'candidate_emb_store')
+
+
+def all_node_store_path(node_emb_dir: str) -> str:
+    return osp.join(node_emb_dir, 'all_node_emb_store')
+
+
+def extra_node_store_path(node_emb_dir: str) -> str:
+    return osp.join(node_emb_dir, 'extra_node_emb_store')
+
+
+def query_store_path(query_emb_dir: str) -> str:
+    return osp.join(query_emb_dir, 'query_emb_store')
+
+
+def chunk_store_path(chunk_emb_dir: str, chunk_size: int) -> str:
+    return osp.join(chunk_emb_dir, f'chunk_emb_store_size={chunk_size}')
+
+
+# Process-wide registry of opened stores, so that all tools and models share one memory-mapped matrix per store
+_store_registry: Dict[Tuple[str, str], EmbeddingStore] = {}
+_store_registry_lock = threading.RLock()
+
+
+def load_store(path: str, 
+               emb_dict_path: str = None, 
+               ids: List[int] = None, 
+               dtype: str = 'float32') -> Union[EmbeddingStore, None]:
+    """
+    Open the float32 store at `path` (converting `emb_dict_path` if needed) and return its `dtype` copy,
+    which lives next to it at `{path}_{dtype}`. Stores are opened once per process: later calls with the 
+    same `path` and `dtype` return the same instance, see `release_store`.
+
+    Args:
+        path (str): Directory of the float32 store.
+        emb_dict_path (str): Path to a pickled `{id: embedding}` dictionary, see `EmbeddingStore.load_or_convert`.
+        ids (List[int]): Row order of the converted store, see `EmbeddingStore.from_emb_dict`.
+        dtype (str): Storage dtype, one of `EMB_DTYPES`.
+
+    Returns:
+        EmbeddingStore: The store, or None if neither the store nor the dictionary exists.
+    """
+    key = (osp.realpath(path), dtype)
+    with _store_registry_lock:
+        store = _store_registry.get(key)
+        if dtype == 'float32':
+            if store is None:
+                store = EmbeddingStore.load_or_convert(path, emb_dict_path, ids=ids)
+        else:
+            source = load_store(path, emb_dict_path, ids=ids)
+            if source is None:
+                return None
+            # Requantize if the float32 store was updated since
+            if store is None or store.meta.get('source_version') != source.meta.get('version', 0):
+                store = source.quantize_to(f'{path}_{dtype}', dtype)
+        if store is not None:
+            _store_registry[key] = store
+        return store
+
+
+def release_store(path: str = None) -> None:
+    """
+    Drop stores from the process-wide registry, e.g., after they were rebuilt from scratch on disk.
+
+    Args:
+        path (str): Directory of the float32 store whose instances (in all dtypes) are dropped. 
+                    If None, the registry is cleared.
+    """
+    with _store_registry_lock:
+        for key in list(_store_registry):
+            if path is None or key[0] == osp.realpath(path):
+                del _store_registry[key]
+
+
+def build_store_from_files(path: str,
+                           ids: List[int],
+                           file_path_fn: Callable[[int], str],
+                           check_stale: bool = True,
+                           num_workers: int = 16,
+                           batch_size: int = 4096) -> Union[EmbeddingStore, None]:
+    """
+    Incrementally build a store from per-id embedding files, e.g., `{node_emb_dir}/{idx}.pt`.
+
+    Only ids that are missing from the store, or whose file changed since it was added, are loaded.
+    Files are loaded by a thread pool, and each batch is committed to the store (new ids appended,
+    changed ids overwritten in place) together with the file modification times in `manifest.npz`,
+    so an interrupted build resumes where it stopped. Ids without a file are skipped and reported.
+
+    Args:
+        path (str): Directory of the store.
+        ids (List[int]): Ids to include, in the row order used for a fresh build.
+        file_path_fn (Callable[[int], str]): Maps an id to its embedding file.
+        check_stale (bool): Whether to stat the files of ids already in the store to detect changed ones.
+        num_workers (int): Number of threads loading files.
+        batch_size (int): Number of files committed at a time.
+
+    Returns:
+        EmbeddingStore: The store, or None if it does not exist and no file was found.
+    """
+    ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+    manifest_path = osp.join(path, 'manifest.npz')
+    store = EmbeddingStore.open(path)
+    manifest = {}
+    if store is not None and osp.exists(manifest_path):
+        with np.load(manifest_path) as data:
+            manifest = dict(zip(data['ids'].tolist(), data['mtimes'].tolist()))
+
+    def get_mtime(idx: int) -> float:
+        try:
+            return os.stat(file_path_fn(idx)).st_mtime
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        in_store = np.zeros(len(ids), dtype=bool) if store is None else store.positions(ids) >= 0
+        todo_ids = ids if check_stale else ids[~in_store]
+        mtimes = dict(zip(todo_ids.tolist(), executor.map(get_mtime, todo_ids.tolist())))
+        missing = [idx for idx, mtime in mtimes.items() if mtime is None]
+        # ids added before the manifest existed (e.g., converted from a dictionary) date from the store creation
+        created = 0. if store is None else store.meta.get('created', 0.)
+        todo = [idx for idx, mtime in mtimes.items() if mtime is not None and 
+                (store is None or idx not in store or mtime > manifest.get(idx, created))]
+        if len(missing) > 0:
+            print(f'{len(missing)} ids have no embedding file, e.g., {missing[:10]}')
+        if len(todo) == 0:
+            return store
+        print(f'Loading {len(todo)} new or changed embeddings into {path}...')
+
+        for start in tqdm(range(0, len(todo), batch_size)):
+            batch = todo[start:start + batch_size]
+            embs = list(executor.map(lambda idx: torch.load(file_path_fn(idx)).float().view(1, -1), batch))
+            if store is None:
+                store = EmbeddingStore.open_or_create(path, dim=embs[0].size(-1))
+            is_new = [idx not in store for idx in batch]
+            new_ids = [idx for idx, new in zip(batch, is_new) if new]
+            if len(new_ids) > 0:
+                store.append(new_ids, torch.cat([emb for emb, new in zip(embs, is_new) if new], dim=0))
+            if len(new_ids) < len(batch):
+                store.update([idx for idx, new in zip(batch, is_new) if not new], 
+                             torch.cat([emb for emb, new in zip(embs, is_new) if not new], dim=0))
+
+            manifest.update({idx: mtimes[idx] for idx in batch})
+            tmp_path = osp.join(path, 'manifest.tmp.npz')
+            np.savez(tmp_path, ids=np.asarray(list(manifest.keys()), dtype=np.int64),
+                     mtimes=np.asarray(list(manifest.values()), dtype=np.float64))
+            os.replace(tmp_path, manifest_path)
+    return store
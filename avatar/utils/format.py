@@ -1,7 +1,117 @@
+import inspect
+import os
+import typing
 from functools import wraps
+from typing import Any, Callable, Union
 from typeguard import typechecked
 
 
+# 'full':   typeguard checks of all arguments and the return value on every call
+# 'sample': argument checks compiled once per function, sampling elements of large containers
+# 'outer':  argument checks compiled once per function, of the outer types only
+# 'off':    no type checks
+# 'full' is the default, while evaluation runs may opt into a cheaper mode with AVATAR_FORMAT_CHECK or --format_check.
+# The non-emptiness checks run in every mode, while return values are only checked in 'full' mode. In 'sample'
+# and 'outer' modes a failed check reruns the call through typeguard, so that errors are reported with exactly
+# the same messages as in 'full' mode.
+FORMAT_CHECK_MODES = ['full', 'sample', 'outer', 'off']
+_format_check_mode = os.getenv('AVATAR_FORMAT_CHECK', 'full')
+assert _format_check_mode in FORMAT_CHECK_MODES, f'AVATAR_FORMAT_CHECK should be one of {FORMAT_CHECK_MODES}'
+
+# Number of container elements checked in 'sample' mode
+NUM_SAMPLES = 8
+
+
+def set_format_check_mode(mode: str) -> None:
+    """
+    Set the type checking mode of all `format_checked` functions, see `FORMAT_CHECK_MODES`.
+    """
+    global _format_check_mode
+    assert mode in FORMAT_CHECK_MODES, f'mode should be one of {FORMAT_CHECK_MODES}, but got {mode}'
+    _format_check_mode = mode
+
+
+def get_format_check_mode() -> str:
+    return _format_check_mode
+
+
+def _sample(values: Union[list, tuple]) -> Union[list, tuple]:
+    if len(values) <= NUM_SAMPLES:
+        return values
+    step = (len(values) - 1) / (NUM_SAMPLES - 1)
+    return [values[round(i * step)] for i in range(NUM_SAMPLES)]
+
+
+def _compile_check(hint: Any, deep: bool) -> Union[Callable[[Any], bool], None]:
+    """
+    Compile `hint` into a predicate on values, checking sampled container elements if `deep`.
+    Returns None for hints that are not supported, which are then checked by typeguard.
+    """
+    if hint is Any:
+        return lambda value: True
+    origin, type_args = typing.get_origin(hint), typing.get_args(hint)
+    if origin is Union:
+        checks = [_compile_check(arg, deep) for arg in type_args]
+        if any(check is None for check in checks):
+            return None
+        return lambda value: any(check(value) for check in checks)
+    if origin is None:
+        if not isinstance(hint, type):
+            return None
+        # int is accepted for float and complex, as in typeguard
+        if hint is float:
+            return lambda value: isinstance(value, (int, float))
+        if hint is complex:
+            return lambda value: isinstance(value, (int, float, complex))
+        return lambda value: isinstance(value, hint)
+
+    if origin in (list, set, frozenset) or (origin is tuple and len(type_args) == 2 and type_args[1] is Ellipsis):
+        item_check = _compile_check(type_args[0], deep) if deep and type_args else None
+        if deep and type_args and item_check is None:
+            return None
+        if item_check is None:
+            return lambda value: isinstance(value, origin)
+        if origin is list or origin is tuple:
+            return lambda value: isinstance(value, origin) and all(item_check(item) for item in _sample(value))
+        return lambda value: isinstance(value, origin) and all(item_check(item) for item in _sample(list(value)))
+    if origin is dict:
+        key_check = _compile_check(type_args[0], deep) if deep and type_args else None
+        value_check = _compile_check(type_args[1], deep) if deep and type_args else None
+        if deep and type_args and (key_check is None or value_check is None):
+            return None
+        if key_check is None:
+            return lambda value: isinstance(value, dict)
+        return lambda value: isinstance(value, dict) and \
+            all(key_check(k) and value_check(v) for k, v in _sample(list(value.items())))
+    if origin is tuple:
+        item_checks = [_compile_check(arg, deep) for arg in type_args] if deep else []
+        if any(check is None for check in item_checks):
+            return None
+        return lambda value: isinstance(value, tuple) and (not deep or len(value) == len(item_checks)) and \
+            all(check(item) for check, item in zip(item_checks, value))
+    return None
+
+
+def _compile_checks(func: Callable, deep: bool) -> Union[dict, None]:
+    """
+    Compile the argument annotations of `func` into `{name: (position, predicate)}`, or return None
+    if any of them is not supported.
+    """
+    try:
+        hints = typing.get_type_hints(func)
+    except Exception:
+        return None
+    checks = {}
+    for position, (name, param) in enumerate(inspect.signature(func).parameters.items()):
+        if name in hints:
+            check = _compile_check(hints[name], deep)
+            # typeguard also checks default values
+            if check is None or (param.default is not param.empty and not check(param.default)):
+                return None
+            checks[name] = (position, check)
+    return checks
+
+
 def format_checked(func):
     """
     Decorator for checking types and non-emptiness of specific argument types for a function.
@@ -14,18 +124,37 @@ def format_checked(func):
     """
     checked_func = typechecked(func)
     function_name = func.__name__
+    arg_names = func.__code__.co_varnames
     types_to_check = (str, list, dict, tuple, set)
+    # Compiled lazily per mode, so that forward references are resolved at the first call
+    compiled = {}
+
+    def args_pass(mode, args, kwargs):
+        if mode not in compiled:
+            compiled[mode] = _compile_checks(func, deep=mode == 'sample')
+        checks = compiled[mode]
+        if checks is None:
+            return False
+        for name, (position, check) in checks.items():
+            if position < len(args):
+                if not check(args[position]):
+                    return False
+            elif name in kwargs and not check(kwargs[name]):
+                return False
+        return True
 
     @wraps(func)
     def wrapper(*args, **kwargs):
         # After type checking, check for non-emptiness
         for idx, arg in enumerate(args):
-            arg_name = func.__code__.co_varnames[idx]
             if isinstance(arg, types_to_check) and len(arg) == 0:
-                raise ValueError(f"Argument '{arg_name}' in function '{function_name}' has zero length")
+                raise ValueError(f"Argument '{arg_names[idx]}' in function '{function_name}' has zero length")
         for key, value in kwargs.items():
             if isinstance(value, types_to_check) and len(value) == 0:
                 raise ValueError(f"Argument '{key}' in function '{function_name}' is empty")
+        mode = _format_check_mode
+        if mode == 'off' or (mode != 'full' and args_pass(mode, args, kwargs)):
+            return func(*args, **kwargs)
         return checked_func(*args, **kwargs)
 
     return wrapper
@@ -0,0 +1,122 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from avatar.utils.doc_cache import get_doc_info
+from stark_qa.tools.process_text import normalize_answer
+
+
+class LexicalIndex:
+    """
+    Token-level view of node documents for lexical matching. Each document is tokenized once, exactly like
+    `stark_qa.tools.process_text.f1_score` does, and kept as sorted unique token ids with their counts,
+    so that a string can be scored against many nodes with a few vectorized operations.
+
+    Args:
+        kb: The knowledge base.
+        add_rel (bool): Whether documents include the relation information of the nodes.
+        compact (bool): Whether documents are rendered in their compact version.
+        capacity (int): Maximum number of documents kept.
+    """
+
+    def __init__(self, kb, add_rel: bool = False, compact: bool = True, capacity: int = 100000):
+        self.kb = kb
+        self.add_rel = add_rel
+        self.compact = compact
+        self.capacity = capacity
+        self.vocab: Dict[str, int] = {}
+        # node_id -> (unique token ids, token counts, number of tokens, lowercased text)
+        self.docs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_doc(self, node_id: int) -> Tuple[np.ndarray, np.ndarray, int, str]:
+        node_id = int(node_id)
+        with self.lock:
+            if node_id in self.docs:
+                self.docs.move_to_end(node_id)
+                return self.docs[node_id]
+        text = get_doc_info(self.kb, node_id, add_rel=self.add_rel, compact=self.compact).lower()
+        tokens = normalize_answer(text).split()
+        with self.lock:
+            token_ids = np.fromiter((self.vocab.setdefault(token, len(self.vocab)) for token in tokens),
+                                    dtype=np.int64, count=len(tokens))
+            unique_ids, counts = np.unique(token_ids, return_counts=True)
+            doc = (unique_ids, counts, len(tokens), text)
+            self.docs[node_id] = doc
+            while len(self.docs) > self.capacity:
+                self.docs.popitem(last=False)
+        return doc
+
+    def overlaps(self, string: str, node_ids: List[int]) -> Tuple[np.ndarray, int, np.ndarray]:
+        """
+        Count the common tokens (with multiplicity) between `string` and the document of each node.
+
+        Args:
+            string (str): The string to match.
+            node_ids (List[int]): Node IDs.
+
+        Returns:
+            num_same (np.ndarray): Number of common tokens with each document, of size (len(node_ids),).
+            string_len (int): Number of tokens in `string`.
+            doc_lens (np.ndarray): Number of tokens in each document, of size (len(node_ids),).
+        """
+        docs = [self.get_doc(node_id) for node_id in node_ids]
+        doc_lens = np.array([doc[2] for doc in docs], dtype=np.float64)
+        tokens = normalize_answer(string.lower()).split()
+        # Tokens that are in no document cannot match
+        token_ids = np.array([self.vocab[token] for token in tokens if token in self.vocab], dtype=np.int64)
+        query_ids, query_counts = np.unique(token_ids, return_counts=True)
+        if len(query_ids) == 0 or len(docs) == 0:
+            return np.zeros(len(docs)), len(tokens), doc_lens
+
+        doc_ids = np.concatenate([doc[0] for doc in docs])
+        doc_counts = np.concatenate([doc[1] for doc in docs])
+        segments = np.repeat(np.arange(len(docs)), [len(doc[0]) for doc in docs])
+        pos = np.minimum(np.searchsorted(query_ids, doc_ids), len(query_ids) - 1)
+        hit = query_ids[pos] == doc_ids
+        num_same = np.bincount(segments[hit], weights=np.minimum(doc_counts[hit], query_counts[pos[hit]]),
+                               minlength=len(docs))
+        return num_same, len(tokens), doc_lens
+
+    def f1_scores(self, string: str, node_ids: List[int]) -> List[float]:
+        """
+        Same as `[f1_score(string, doc) for doc in docs]` over the documents of `node_ids`.
+        """
+        num_same, string_len, doc_lens = self.overlaps(string, node_ids)
+        f1 = np.zeros(len(num_same))
+        match = num_same > 0
+        precision = 1.0 * num_same[match] / string_len
+        recall = 1.0 * num_same[match] / doc_lens[match]
+        f1[match] = (2 * precision * recall) / (precision + recall)
+        return f1.tolist()
+
+    def recall_scores(self, string: str, node_ids: List[int]) -> List[float]:
+        """
+        Same as `[recall_score(string, doc) for doc in docs]` over the documents of `node_ids`.
+        """
+        num_same, _, doc_lens = self.overlaps(string, node_ids)
+        recall = np.zeros(len(num_same))
+        match = num_same > 0
+        recall[match] = 1.0 * num_same[match] / doc_lens[match]
+        return recall.tolist()
+
+    def exact_match_scores(self, string: str, node_ids: List[int]) -> List[int]:
+        """
+        Whether the lowercased `string` is a substring of the lowercased document of each node.
+        """
+        string = string.lower()
+        return [int(string in self.get_doc(node_id)[3]) for node_id in node_ids]
+
+
+_lexical_indices: Dict[Tuple[int, bool, bool], LexicalIndex] = {}
+
+
+def get_lexical_index(kb, add_rel: bool = False, compact: bool = True) -> LexicalIndex:
+    """
+    Get the process-wide lexical index of `kb` over documents rendered with `add_rel` and `compact`.
+    """
+    key = (id(kb), add_rel, compact)
+    if key not in _lexical_indices:
+        _lexical_indices[key] = LexicalIndex(kb, add_rel=add_rel, compact=compact)
+    return _lexical_indices[key]
@@ -0,0 +1,113 @@
+import os
+import re
+from typing import Any, Callable, Dict, List, Union
+
+from avatar.utils.api import iter_llm_outputs
+
+
+# Number of candidates packed into one prompt by the LLM tools, 0 or 1 to prompt for each candidate separately
+DEFAULT_LISTWISE_WINDOW = int(os.getenv('AVATAR_LISTWISE_WINDOW', 0))
+# Budget of the candidate documents of one prompt, in tokens of about 4 characters
+DEFAULT_LISTWISE_MAX_PROMPT_TOKENS = int(os.getenv('AVATAR_LISTWISE_MAX_PROMPT_TOKENS', 12000))
+
+LISTWISE_LINE_PATTERN = re.compile(r'^\s*\[(\d+)\]\s*:?\s*(.*?)\s*$')
+
+
+def pack_windows(doc_lens: List[int], window_size: int, max_prompt_tokens: int = DEFAULT_LISTWISE_MAX_PROMPT_TOKENS) -> List[List[int]]:
+    """
+    Split candidates into consecutive windows of at most `window_size` candidates whose documents fit in
+    `max_prompt_tokens`. A document larger than the budget gets a window of its own.
+
+    Args:
+        doc_lens (List[int]): Number of characters of the document of each candidate.
+        window_size (int): Maximum number of candidates per window.
+        max_prompt_tokens (int): Token budget of the documents of a window.
+
+    Returns:
+        List[List[int]]: Positions of the candidates in each window.
+    """
+    windows, window, budget = [], [], 4 * max_prompt_tokens
+    for pos, doc_len in enumerate(doc_lens):
+        if len(window) > 0 and (len(window) == window_size or budget < doc_len):
+            windows.append(window)
+            window, budget = [], 4 * max_prompt_tokens
+        window.append(pos)
+        budget -= doc_len
+    if len(window) > 0:
+        windows.append(window)
+    return windows
+
+
+def format_candidates(docs: List[str], node_types: List[str]) -> str:
+    """
+    Number the candidate documents of a window from 1, as referred to by the answer lines.
+    """
+    return '\n\n'.join(f'[{i + 1}] ({node_type})\n{doc}' for i, (doc, node_type) in enumerate(zip(docs, node_types)))
+
+
+def parse_listwise_answer(answer: str, n: int) -> Dict[int, str]:
+    """
+    Parse an answer with one line "[i] ..." per candidate of a window of `n` candidates.
+
+    Returns:
+        Dict[int, str]: The rest of the line of each candidate found, by its position (from 0) in the window.
+    """
+    lines = {}
+    for line in answer.split('\n'):
+        match = LISTWISE_LINE_PATTERN.match(line)
+        if match is not None and 1 <= int(match.group(1)) <= n:
+            lines.setdefault(int(match.group(1)) - 1, match.group(2))
+    return lines
+
+
+def run_listwise(build_prompt: Callable[[List[int]], str],
+                 parse_line: Callable[[str], Any],
+                 doc_lens: List[int],
+                 model: str,
+                 window_size: int,
+                 max_prompt_tokens: int = DEFAULT_LISTWISE_MAX_PROMPT_TOKENS,
+                 max_cnt: int = 3,
+                 temperature: Union[float, Callable[[int], float]] = 1,
+                 max_tokens_per_candidate: int = 16) -> Dict[int, Any]:
+    """
+    Judge many candidates with one prompt per window of candidates, sending all windows concurrently, and
+    re-packing only the candidates without a usable answer for each retry.
+
+    Args:
+        build_prompt (Callable[[List[int]], str]): Builds the prompt of a window from the positions of its candidates,
+            numbering them from 1 (see `format_candidates`) and asking for one line "[i] <answer>" per candidate.
+        parse_line (Callable[[str], Any]): Parses the answer of one candidate, returning None if it is unusable.
+        doc_lens (List[int]): Number of characters of the document of each candidate.
+        model (str): The LLM to use.
+        window_size (int): Maximum number of candidates per prompt.
+        max_prompt_tokens (int): Token budget of the documents of a prompt.
+        max_cnt (int): Maximum number of rounds.
+        temperature (Union[float, Callable[[int], float]]): Sampling temperature, or a function of the round (from 1).
+        max_tokens_per_candidate (int): Completion budget per candidate.
+
+    Returns:
+        Dict[int, Any]: The parsed answers by candidate position. Candidates without a usable answer are missing.
+    """
+    results = {}
+    todo = list(range(len(doc_lens)))
+    for cnt in range(1, max_cnt + 1):
+        if len(todo) == 0:
+            break
+        windows = [[todo[i] for i in window]
+                   for window in pack_windows([doc_lens[pos] for pos in todo], window_size, max_prompt_tokens)]
+        prompts = [build_prompt(window) for window in windows]
+        max_tokens = max_tokens_per_candidate * max(len(window) for window in windows) + 16
+        for idx, answer in iter_llm_outputs(prompts,
+                                            model=model,
+                                            max_tokens=max_tokens,
+                                            temperature=temperature(cnt) if callable(temperature) else temperature,
+                                            read_cache=cnt == 1):
+            if isinstance(answer, Exception):
+                print(f'listwise - request failed: {answer}')
+                continue
+            for i, line in parse_listwise_answer(answer, len(windows[idx])).items():
+                value = parse_line(line)
+                if value is not None:
+                    results[windows[idx][i]] = value
+        todo = [pos for pos in todo if pos not in results]
+    return results
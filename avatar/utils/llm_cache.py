@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import os.path as osp
+import sqlite3
+import threading
+import time
+from typing import Any, Union
+
+
+DEFAULT_LLM_CACHE_PATH = os.getenv('AVATAR_LLM_CACHE_PATH', osp.join(osp.expanduser('~'), '.cache', 'avatar', 'llm_cache.db'))
+# Caching is opt-in: only calls sampled at a temperature up to this value are cached, and none if it is unset
+DEFAULT_LLM_CACHE_MAX_TEMPERATURE = float(os.environ['AVATAR_LLM_CACHE_MAX_TEMPERATURE']) \
+    if os.getenv('AVATAR_LLM_CACHE_MAX_TEMPERATURE') else None
+# Responses older than this many seconds are discarded, 0 keeps them forever
+DEFAULT_LLM_CACHE_TTL = float(os.getenv('AVATAR_LLM_CACHE_TTL', 0))
+# Least recently used responses are evicted beyond this many megabytes
+DEFAULT_LLM_CACHE_MAX_MB = float(os.getenv('AVATAR_LLM_CACHE_MAX_MB', 1024))
+
+# Number of writes between two evictions
+EVICT_EVERY = 200
+
+
+class LLMCache:
+    """
+    A persistent cache of LLM responses keyed by a hash of the full request (messages, model and sampling parameters),
+    stored in a SQLite table that is shared by all processes using the same `path`.
+
+    Args:
+        path (str): Path to the SQLite database. If None or empty, nothing is cached.
+        max_temperature (float): Only requests with a temperature up to `max_temperature` are cached. If None, nothing is cached.
+        ttl (float): Time to live of the responses in seconds, 0 to keep them until evicted.
+        max_mb (float): Maximum total size of the responses in megabytes, beyond which the least recently used ones are evicted.
+    """
+
+    def __init__(self,
+                 path: str = DEFAULT_LLM_CACHE_PATH,
+                 max_temperature: float = DEFAULT_LLM_CACHE_MAX_TEMPERATURE,
+                 ttl: float = DEFAULT_LLM_CACHE_TTL,
+                 max_mb: float = DEFAULT_LLM_CACHE_MAX_MB):
+        self.path = path
+        self.max_temperature = max_temperature
+        self.ttl = ttl
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.lock = threading.Lock()
+        self.n_writes = 0
+        self._conn = None
+        self._conn_pid = None
+
+    @staticmethod
+    def key(**request: Any) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @property
+    def conn(self) -> Union[sqlite3.Connection, None]:
+        if not self.path:
+            return None
+        # connections cannot be shared with forked worker processes
+        if self._conn is None or self._conn_pid != os.getpid():
+            os.makedirs(osp.dirname(osp.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                               '(hash TEXT PRIMARY KEY, response TEXT, size INTEGER, created REAL, accessed REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def caches(self, temperature: float) -> bool:
+        """
+        Whether requests sampled at `temperature` are cached.
+        """
+        return bool(self.path) and self.max_temperature is not None and temperature <= self.max_temperature
+
+    def get(self, key: str) -> Any:
+        """
+        Look up the response of the request hashed to `key`, or return None if it is not cached or expired.
+        """
+        now = time.time()
+        with self.lock:
+            if self.conn is None:
+                return None
+            row = self.conn.execute('SELECT response, created FROM responses WHERE hash = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                if self.ttl > 0 and row[1] < now - self.ttl:
+                    self.conn.execute('DELETE FROM responses WHERE hash = ?', (key,))
+                    return None
+                self.conn.execute('UPDATE responses SET accessed = ? WHERE hash = ?', (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Any) -> None:
+        """
+        Cache `response`, which must be JSON serializable, as the response of the request hashed to `key`.
+        """
+        value, now = json.dumps(response), time.time()
+        with self.lock:
+            if self.conn is None:
+                return
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                  (key, value, len(value), now, now))
+            self.n_writes += 1
+            if self.n_writes % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        with self.conn:
+            if self.ttl > 0:
+                self.conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # Evict down to 90% of the limit, so that evictions do not run on every write
+            excess, stale = total - int(0.9 * self.max_bytes), []
+            for key, size in self.conn.execute('SELECT hash, size FROM responses ORDER BY accessed'):
+                if excess <= 0:
+                    break
+                stale.append((key,))
+                excess -= size
+            self.conn.executemany('DELETE FROM responses WHERE hash = ?', stale)
+
+
+_llm_cache = None
+
+
+def get_llm_cache() -> LLMCache:
+    """
+    Get the process-wide LLM response cache.
+    """
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def set_llm_cache(path: str = DEFAULT_LLM_CACHE_PATH,
+                  max_temperature: float = DEFAULT_LLM_CACHE_MAX_TEMPERATURE,
+                  ttl: float = DEFAULT_LLM_CACHE_TTL,
+                  max_mb: float = DEFAULT_LLM_CACHE_MAX_MB) -> LLMCache:
+    """
+    Replace the process-wide LLM response cache, e.g., to opt in with `max_temperature` or to move its database.
+    """
+    global _llm_cache
+    _llm_cache = LLMCache(path, max_temperature=max_temperature, ttl=ttl, max_mb=max_mb)
+    return _llm_cache
@@ -0,0 +1,328 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from functools import partial
+from typing import Any, Coroutine, Dict, Iterator, List, Tuple, Union
+
+from avatar.utils.retry import RetryPolicy, acall_with_retry, get_circuit_breaker
+
+
+# Default limits of every model, overridden per model by the JSON dictionary in $AVATAR_LLM_LIMITS,
+# e.g., '{"gpt-4o": {"max_concurrency": 32, "rpm": 5000, "tpm": 800000}}'. A rate of 0 means unlimited.
+DEFAULT_MAX_CONCURRENCY = int(os.getenv('AVATAR_LLM_MAX_CONCURRENCY', 8))
+DEFAULT_RPM = float(os.getenv('AVATAR_LLM_RPM', 0))
+DEFAULT_TPM = float(os.getenv('AVATAR_LLM_TPM', 0))
+DEFAULT_LIMITS = json.loads(os.getenv('AVATAR_LLM_LIMITS', '{}'))
+# Seconds a blocking call waits for its requests, retries included, 0 for no timeout
+DEFAULT_TIMEOUT = float(os.getenv('AVATAR_LLM_TIMEOUT', 0))
+
+# Rough number of tokens of an image, for rate limiting only
+IMAGE_TOKENS = 1000
+
+
+class TokenBucket:
+    """
+    A token bucket refilled at `rate` tokens per minute, holding at most `capacity` tokens.
+    Waiters are served in order, so that a large request is not starved by small ones.
+
+    Args:
+        rate (float): Tokens added per minute.
+        capacity (float): Maximum number of tokens. Defaults to `rate`, i.e., one minute of quota.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate / 60.
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.):
+        # Requests larger than the bucket would never fit otherwise
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ModelGate:
+    """
+    Concurrency cap and requests/tokens per minute buckets of one model.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rpm = TokenBucket(rpm) if rpm > 0 else None
+        self.tpm = TokenBucket(tpm) if tpm > 0 else None
+
+
+def _text_of(content: Union[str, List[Dict]]) -> Tuple[str, int]:
+    if isinstance(content, str):
+        return content, 0
+    texts = [part.get('text', '') for part in content if isinstance(part, dict)]
+    n_images = sum(1 for part in content if isinstance(part, dict) and part.get('type') in ('image', 'image_url'))
+    return ''.join(texts), n_images
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int) -> int:
+    """
+    Estimate the tokens a request counts against a tokens per minute quota, i.e., about 4 characters
+    per prompt token plus the completion budget.
+    """
+    n_chars, n_images = 0, 0
+    for message in messages:
+        text, images = _text_of(message.get('content', ''))
+        n_chars, n_images = n_chars + len(text), n_images + images
+    return n_chars // 4 + n_images * IMAGE_TOKENS + max_tokens
+
+
+class AsyncLLMClient:
+    """
+    An asyncio client of the LLM APIs. Requests of each model are bounded by a concurrency cap and optional
+    requests and tokens per minute buckets, and share one connection pool per provider. The client runs on
+    a background event loop, so it is used the same way from scripts, worker threads and notebooks.
+
+    Args:
+        max_concurrency (int): Default maximum number of concurrent requests per model.
+        rpm (float): Default requests per minute per model, 0 for unlimited.
+        tpm (float): Default tokens per minute per model, 0 for unlimited.
+        limits (Dict[str, Dict]): Per-model overrides of `max_concurrency`, `rpm` and `tpm`.
+        retry_policy (RetryPolicy): How failed requests are retried, see `avatar.utils.retry`.
+        timeout (float): Default seconds the blocking methods wait before cancelling their requests, 0 for no timeout.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 rpm: float = DEFAULT_RPM,
+                 tpm: float = DEFAULT_TPM,
+                 limits: Dict[str, Dict] = None,
+                 retry_policy: RetryPolicy = None,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.default_limits = {'max_concurrency': max_concurrency, 'rpm': rpm, 'tpm': tpm}
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self._gates: Dict[str, ModelGate] = {}
+        self._clients: Dict[str, Any] = {}
+        self._loop, self._loop_pid = None, None
+
+    def set_limits(self, model: str, **limits: float) -> None:
+        """
+        Override the limits of `model`, e.g., `set_limits('gpt-4o', rpm=500, tpm=30000)`.
+        """
+        self.limits[model] = {**self.limits.get(model, {}), **limits}
+        # Rebuilt in the event loop on the next request
+        self._gates.pop(model, None)
+
+    def _gate(self, model: str) -> ModelGate:
+        if model not in self._gates:
+            self._gates[model] = ModelGate(**{**self.default_limits, **self.limits.get(model, {})})
+        return self._gates[model]
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        # Neither the loop thread nor the connections survive a fork
+        with self.lock:
+            if self._loop is None or self._loop_pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._loop_pid = os.getpid()
+                self._gates, self._clients = {}, {}
+                threading.Thread(target=self._loop.run_forever, daemon=True, name='llm-client').start()
+            return self._loop
+
+    def run(self, coro: Coroutine, timeout: float = None) -> Any:
+        """
+        Run `coro` on the event loop of the client and wait for its result. If the wait times out or is
+        interrupted, `coro` is cancelled, so that its requests do not keep running in the background.
+
+        Args:
+            coro (Coroutine): The coroutine to run.
+            timeout (float): Seconds to wait, 0 for no timeout. Defaults to the timeout of the client.
+
+        Returns:
+            Any: The result of `coro`.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout=timeout or None)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def _client(self, provider: str) -> Any:
+        if provider not in self._clients:
+            if provider == 'openai':
+                import openai
+                self._clients[provider] = openai.AsyncOpenAI(api_key=openai.api_key, organization=openai.organization)
+            else:
+                import anthropic
+                from stark_qa.tools.api_lib import anthropic_client
+                api_key = anthropic_client.api_key if anthropic_client is not None else None
+                self._clients[provider] = anthropic.AsyncAnthropic(api_key=api_key)
+        return self._clients[provider]
+
+    @staticmethod
+    def _messages(message: Union[str, List[Dict]], model: str, json_object: bool) -> List[Dict]:
+        # Same prompt conventions as `stark_qa.tools.api_lib`
+        if isinstance(message, str):
+            if json_object and 'claude' in model:
+                message = "You are a helpful assistant designed to output in JSON format." + message
+            elif json_object and 'gpt' in model and 'json' not in message.lower():
+                message = 'You are a helpful assistant designed to output JSON. ' + message
+            return [{"role": "user", "content": message}]
+        return message
+
+    async def _request(self, messages: List[Dict], model: str, max_tokens: int,
+                       temperature: float, json_object: bool) -> Tuple[str, Union[int, None]]:
+        """
+        Send one request, returning the completion and the number of tokens it used, if reported.
+        """
+        if 'claude' in model:
+            response = await self._client('anthropic').messages.create(
+                messages=messages, model=model, max_tokens=max_tokens, temperature=temperature)
+            return response.content[0].text, response.usage.input_tokens + response.usage.output_tokens
+        if 'gpt' in model:
+            kwargs = {"response_format": {"type": "json_object"}} if json_object else {}
+            response = await self._client('openai').chat.completions.create(
+                messages=messages, model=model, max_tokens=max_tokens, temperature=temperature, **kwargs)
+            usage = response.usage.total_tokens if response.usage is not None else None
+            return response.choices[0].message.content, usage
+        if 'huggingface' in model:
+            # No async client, run the blocking call aside
+            from stark_qa.tools.api import get_llm_output
+            message = messages[0]['content'] if len(messages) == 1 else messages
+            output = await asyncio.get_running_loop().run_in_executor(None, partial(
+                get_llm_output, message, model=model, max_tokens=max_tokens, temperature=temperature, json_object=json_object))
+            return output, None
+        raise ValueError(f"Model {model} not recognized.")
+
+    async def acomplete(self,
+                        message: Union[str, List[Dict]],
+                        model: str = "gpt-4-0125-preview",
+                        max_tokens: int = 2048,
+                        temperature: float = 1,
+                        json_object: bool = False) -> str:
+        """
+        Complete a prompt within the limits of `model`, retrying failed requests with `retry_policy`. Requests fail fast
+        while the circuit of `model` is open, see `avatar.utils.retry.CircuitBreaker`.
+
+        Args:
+            message (Union[str, List[Dict]]): The input message or a list of message dicts.
+            model (str): The model to use for completion.
+            max_tokens (int): Maximum number of tokens to generate.
+            temperature (float): Sampling temperature.
+            json_object (bool): Whether to output in JSON format.
+
+        Returns:
+            str: The completed text generated by the model.
+        """
+        messages = self._messages(message, model, json_object)
+        gate = self._gate(model)
+        estimate = estimate_tokens(messages, max_tokens)
+
+        async def _attempt():
+            # The backoff between attempts is spent without holding a slot of the model
+            async with gate.semaphore:
+                if gate.rpm is not None:
+                    await gate.rpm.acquire()
+                if gate.tpm is not None:
+                    await gate.tpm.acquire(estimate)
+                output, used = await self._request(messages, model, max_tokens, temperature, json_object)
+            if gate.tpm is not None and used is not None:
+                gate.tpm.refund(estimate - used)
+            return output
+
+        return await acall_with_retry(_attempt, self.retry_policy, get_circuit_breaker(model), description=model)
+
+    def complete(self, message: Union[str, List[Dict]], timeout: float = None, **kwargs: Any) -> str:
+        """
+        Blocking version of `acomplete`, cancelled after `timeout` seconds, see `run`.
+        """
+        return self.run(self.acomplete(message, **kwargs), timeout=timeout)
+
+    def complete_many(self, messages: List[Union[str, List[Dict]]], timeout: float = None, **kwargs: Any) -> List[str]:
+        """
+        Complete all `messages` concurrently, see `acomplete` for the arguments. All requests run to the end
+        even if some fail, and the first failure is raised once they are done.
+
+        Args:
+            messages (List[Union[str, List[Dict]]]): The input messages.
+            timeout (float): Seconds to wait for all completions before cancelling them, see `run`.
+
+        Returns:
+            List[str]: The completions in the order of `messages`.
+        """
+        async def _gather():
+            return await asyncio.gather(*[self.acomplete(message, **kwargs) for message in messages],
+                                        return_exceptions=True)
+        outputs = self.run(_gather(), timeout=timeout)
+        for output in outputs:
+            if isinstance(output, BaseException):
+                raise output
+        return outputs
+
+    def iter_complete(self, messages: List[Union[str, List[Dict]]], **kwargs: Any) -> Iterator[Tuple[int, Union[str, Exception]]]:
+        """
+        Complete all `messages` concurrently and yield the completions as they arrive, see `acomplete` for the arguments.
+        A request that fails after all retries yields its exception instead of stopping the others.
+
+        Yields:
+            Tuple[int, Union[str, Exception]]: The index of a message in `messages` and its completion or exception.
+        """
+        results = queue.Queue()
+
+        async def _complete(idx, message):
+            try:
+                results.put((idx, await self.acomplete(message, **kwargs)))
+            except Exception as e:
+                results.put((idx, e))
+
+        for idx, message in enumerate(messages):
+            asyncio.run_coroutine_threadsafe(_complete(idx, message), self.loop)
+        for _ in range(len(messages)):
+            yield results.get()
+
+
+_llm_client = None
+
+
+def get_llm_client() -> AsyncLLMClient:
+    """
+    Get the process-wide LLM client.
+    """
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = AsyncLLMClient()
+    return _llm_client
+
+
+def set_llm_client(max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                   rpm: float = DEFAULT_RPM,
+                   tpm: float = DEFAULT_TPM,
+                   limits: Dict[str, Dict] = None,
+                   retry_policy: RetryPolicy = None,
+                   timeout: float = DEFAULT_TIMEOUT) -> AsyncLLMClient:
+    """
+    Replace the process-wide LLM client, e.g., to change its default limits.
+    """
+    global _llm_client
+    _llm_client = AsyncLLMClient(max_concurrency=max_concurrency, rpm=rpm, tpm=tpm, limits=limits, 
+                                 retry_policy=retry_policy, timeout=timeout)
+    return _llm_client
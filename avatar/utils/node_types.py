@@ -0,0 +1,103 @@
+import threading
+import numpy as np
+import torch
+from typing import Dict, List, Union
+
+
+class NodeTypeIndex:
+    """
+    Node types of a knowledge base as an array of type codes, plus the sorted node IDs of each type,
+    built once from `kb.node_types` and `kb.node_type_dict`, so that type lookups and type filtering
+    of many nodes are array operations instead of one `kb` call per node.
+
+    Args:
+        kb: The knowledge base, with `node_types` and `node_type_dict` as in `stark_qa.skb.SKB`.
+    """
+
+    def __init__(self, kb):
+        self.codes = torch.as_tensor(kb.node_types).cpu().numpy().astype(np.int64)
+        self.type_names: Dict[int, str] = dict(kb.node_type_dict)
+        self.type_codes: Dict[str, int] = {name: code for code, name in self.type_names.items()}
+        # Lookup table from type code to type name, over the codes in use
+        self.names = np.empty(max(self.type_names) + 1 if self.type_names else 0, dtype=object)
+        for code, name in self.type_names.items():
+            self.names[code] = name
+        order = np.argsort(self.codes, kind='stable')
+        sorted_codes = self.codes[order]
+        self.ids_by_type: Dict[str, np.ndarray] = {
+            name: order[np.searchsorted(sorted_codes, code, 'left'):np.searchsorted(sorted_codes, code, 'right')]
+            for code, name in self.type_names.items()
+        }
+
+    def node_type_lst(self) -> List[str]:
+        return list(self.type_names.values())
+
+    def _check(self, node_ids: np.ndarray):
+        if len(node_ids) and (node_ids.min() < 0 or node_ids.max() >= len(self.codes)):
+            raise IndexError(f'node ids should be in [0, {len(self.codes)}), but got {node_ids[(node_ids < 0) | (node_ids >= len(self.codes))][:5].tolist()}')
+
+    def _check_type(self, node_type: str):
+        if node_type not in self.type_codes:
+            raise ValueError(f'node_type must be in {self.node_type_lst()}, but got {node_type}')
+
+    def get_node_ids_by_type(self, node_type: str) -> np.ndarray:
+        """
+        Get the sorted IDs of all nodes of `node_type`.
+        """
+        self._check_type(node_type)
+        return self.ids_by_type[node_type]
+
+    def get_node_types(self, node_ids: Union[List[int], np.ndarray]) -> List[str]:
+        """
+        Get the type of each node in `node_ids`.
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64).reshape(-1)
+        self._check(node_ids)
+        return self.names[self.codes[node_ids]].tolist()
+
+    def filter(self, node_ids: Union[List[int], np.ndarray], node_types: List[str]) -> np.ndarray:
+        """
+        Keep the nodes in `node_ids` whose type is one of `node_types`, in their original order.
+
+        Args:
+            node_ids (Union[List[int], np.ndarray]): Node IDs.
+            node_types (List[str]): Node types to keep.
+
+        Returns:
+            np.ndarray: The kept node IDs.
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64).reshape(-1)
+        self._check(node_ids)
+        for node_type in node_types:
+            self._check_type(node_type)
+        return node_ids[np.isin(self.codes[node_ids], [self.type_codes[t] for t in node_types])]
+
+
+_node_type_indices: Dict[int, NodeTypeIndex] = {}
+_node_type_lock = threading.Lock()
+
+
+def get_node_type_index(kb) -> Union[NodeTypeIndex, None]:
+    """
+    Get the process-wide node type index of `kb`, built on first use.
+
+    Returns:
+        NodeTypeIndex: The index, or None if `kb` does not expose its node types.
+    """
+    if not (hasattr(kb, 'node_types') and hasattr(kb, 'node_type_dict')):
+        return None
+    with _node_type_lock:
+        if id(kb) not in _node_type_indices:
+            _node_type_indices[id(kb)] = NodeTypeIndex(kb)
+        return _node_type_indices[id(kb)]
+
+
+def get_node_types(kb, node_ids: List[int]) -> List[str]:
+    """
+    Get the type of each node in `node_ids`, from the node type index of `kb` when it exposes
+    its node types, and from `kb.get_node_type_by_id` otherwise.
+    """
+    index = get_node_type_index(kb)
+    if index is None:
+        return [kb.get_node_type_by_id(node_id) for node_id in node_ids]
+    return index.get_node_types(node_ids)
@@ -0,0 +1,341 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Tuple, Union
+
+
+# Retry settings shared by all API calls (LLMs, vision models and embeddings)
+DEFAULT_MAX_ATTEMPTS = int(os.getenv('AVATAR_RETRY_MAX_ATTEMPTS', 6))
+# Exponential backoff from `base_delay` seconds, capped at `max_delay` seconds, with random jitter
+DEFAULT_BASE_DELAY = float(os.getenv('AVATAR_RETRY_BASE_DELAY', 1))
+DEFAULT_MAX_DELAY = float(os.getenv('AVATAR_RETRY_MAX_DELAY', 60))
+# Longest Retry-After header that is honored, in seconds
+DEFAULT_MAX_RETRY_AFTER = float(os.getenv('AVATAR_RETRY_MAX_RETRY_AFTER', 120))
+# Consecutive failures of a model that open its circuit, 0 to never open it, and seconds before it is probed again
+DEFAULT_CIRCUIT_FAILURES = int(os.getenv('AVATAR_CIRCUIT_FAILURES', 10))
+DEFAULT_CIRCUIT_RESET = float(os.getenv('AVATAR_CIRCUIT_RESET', 30))
+
+# Error classes, see `classify_error`
+RATE_LIMIT, SERVER, CONNECTION, TIMEOUT, INVALID_OUTPUT, CLIENT, CIRCUIT_OPEN, UNKNOWN = \
+    'rate_limit', 'server', 'connection', 'timeout', 'invalid_output', 'client', 'circuit_open', 'unknown'
+RETRYABLE_ERRORS = (RATE_LIMIT, SERVER, CONNECTION, TIMEOUT, INVALID_OUTPUT, UNKNOWN)
+# Errors showing that a service is down, as opposed to busy (rate limits) or misused (client errors)
+OUTAGE_ERRORS = (SERVER, CONNECTION, TIMEOUT, UNKNOWN)
+
+
+class InvalidOutputError(Exception):
+    """
+    Raised when a response cannot be used, e.g., invalid JSON, so that the request is sent again without waiting.
+    """
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a service whose circuit is open.
+
+    Args:
+        key (str): The service, e.g., a model name.
+        retry_in (float): Seconds before the circuit is probed again.
+    """
+
+    def __init__(self, key: str, retry_in: float):
+        self.key = key
+        self.retry_in = retry_in
+        super().__init__(f'Circuit of {key} is open after repeated failures, retry in {retry_in:.0f} seconds')
+
+
+def _status_code(error: Exception) -> Union[int, None]:
+    # openai and anthropic errors carry `status_code`, requests errors carry their `response`
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Classify an API error by its HTTP status if any, or by its type otherwise, without importing the API clients.
+
+    Returns:
+        str: One of 'rate_limit', 'server', 'connection', 'timeout', 'invalid_output', 'client', 'circuit_open' or 'unknown'.
+    """
+    if isinstance(error, InvalidOutputError):
+        return INVALID_OUTPUT
+    if isinstance(error, CircuitOpenError):
+        return CIRCUIT_OPEN
+    status = _status_code(error)
+    if status is not None:
+        if status == 429:
+            return RATE_LIMIT
+        if status in (408, 409) or status >= 500:
+            return SERVER
+        if status >= 400:
+            return CLIENT
+    name = type(error).__name__
+    if 'RateLimit' in name:
+        return RATE_LIMIT
+    if 'Timeout' in name or isinstance(error, TimeoutError):
+        return TIMEOUT
+    if 'Connection' in name or isinstance(error, ConnectionError):
+        return CONNECTION
+    if isinstance(error, (ValueError, TypeError, KeyError, AttributeError, AssertionError, NotImplementedError)):
+        return CLIENT
+    return UNKNOWN
+
+
+def get_retry_after(error: Exception) -> Union[float, None]:
+    """
+    Read the Retry-After(-ms) header of the response of an API error, in seconds, or None if there is none.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers is None:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0., parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before sending a failed request again: rate limited requests wait as long as
+    the Retry-After header asks, or back off exponentially from `base_delay` with jitter; transient errors back
+    off exponentially with full jitter; invalid outputs are sent again at once; client errors are not retried.
+
+    Args:
+        max_attempts (int): Maximum number of attempts, including the first one.
+        base_delay (float): Backoff of the first retry in seconds, doubled for each following one.
+        max_delay (float): Maximum backoff in seconds.
+        max_retry_after (float): Maximum wait in seconds asked by a Retry-After header.
+        retry_on (Tuple[str]): Error classes that are retried, see `classify_error`.
+    """
+
+    def __init__(self,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY,
+                 max_retry_after: float = DEFAULT_MAX_RETRY_AFTER,
+                 retry_on: Tuple[str] = RETRYABLE_ERRORS):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.retry_on = retry_on
+
+    def delay(self, attempt: int, error: Exception) -> Union[float, None]:
+        """
+        Seconds to wait after the failed `attempt` (from 1) before the next one, or None to give up.
+        """
+        kind = classify_error(error)
+        if kind == CIRCUIT_OPEN:
+            # Wait for the circuit to be probed, or for the probe to close it
+            if attempt >= self.max_attempts:
+                return None
+            return min(max(error.retry_in, self.base_delay), self.max_delay) + random.uniform(0, self.base_delay)
+        if kind not in self.retry_on or attempt >= self.max_attempts:
+            return None
+        if kind == INVALID_OUTPUT:
+            return 0.
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if kind == RATE_LIMIT:
+            retry_after = get_retry_after(error)
+            if retry_after is not None:
+                # Jittered so that the workers told to wait the same time do not come back at once
+                return min(retry_after, self.max_retry_after) + random.uniform(0, self.base_delay)
+            # Wait at least half the backoff, the quota is unlikely to be back right away
+            return backoff / 2 + random.uniform(0, backoff / 2)
+        return random.uniform(0, backoff)
+
+
+class CircuitBreaker:
+    """
+    Stop calling a service after `failure_threshold` consecutive outage errors, raising `CircuitOpenError` instead,
+    and let one call probe the service every `reset_timeout` seconds until it succeeds. See `call_with_retry` for
+    how calls handle an open circuit.
+
+    Args:
+        key (str): The service, e.g., a model name.
+        failure_threshold (int): Consecutive outage errors that open the circuit, 0 to never open it.
+        reset_timeout (float): Seconds before an open circuit is probed.
+    """
+
+    def __init__(self, key: str, failure_threshold: int = DEFAULT_CIRCUIT_FAILURES, reset_timeout: float = DEFAULT_CIRCUIT_RESET):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def before_call(self) -> bool:
+        """
+        Raise `CircuitOpenError` if the service should not be called now.
+
+        Returns:
+            bool: Whether the call probes the service, in which case it must end with `record_success`,
+                `record_failure` or `release_probe`.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+            if retry_in > 0 or self.probing:
+                raise CircuitOpenError(self.key, max(retry_in, 0))
+            self.probing = True
+            return True
+
+    def release_probe(self) -> None:
+        """
+        Let another call probe the service, after a probe was interrupted without an answer.
+        """
+        with self.lock:
+            self.probing = False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures, self.opened_at, self.probing = 0, None, False
+
+    def record_failure(self, error: Exception) -> None:
+        if classify_error(error) not in OUTAGE_ERRORS:
+            # The service answered, e.g., with a rate limit
+            if self.probing:
+                self.record_success()
+            return
+        with self.lock:
+            self.failures += 1
+            if self.failure_threshold > 0 and (self.probing or self.failures >= self.failure_threshold):
+                if self.opened_at is None or self.probing:
+                    print(f'Circuit of {self.key} opened after {self.failures} consecutive failures: {error}')
+                self.opened_at, self.probing = time.monotonic(), False
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(key: str) -> CircuitBreaker:
+    """
+    Get the process-wide circuit breaker of the service `key`, e.g., a model name.
+    """
+    with _circuit_breakers_lock:
+        if key not in _circuit_breakers:
+            _circuit_breakers[key] = CircuitBreaker(key)
+        return _circuit_breakers[key]
+
+
+def _wait_for_circuit(policy: RetryPolicy,
+                      breaker: Union[CircuitBreaker, None],
+                      attempt: int,
+                      waits: int,
+                      description: str) -> Tuple[Union[float, None], bool]:
+    """
+    Seconds to wait before calling a service whose circuit is open, or None to call it now, and whether the
+    call probes the service. New calls (`attempt` 0) fail fast, calls already retrying wait up to
+    `policy.max_attempts` times for the circuit to close, without using their attempts.
+    """
+    if breaker is None:
+        return None, False
+    try:
+        return None, breaker.before_call()
+    except CircuitOpenError as e:
+        delay = policy.delay(attempt, e) if 0 < attempt and waits < policy.max_attempts else None
+        if delay is None:
+            raise
+        print(f'{description} - {e}. Waiting {delay:.1f} seconds...')
+        return delay, False
+
+
+def call_with_retry(fn: Callable[[], Any],
+                    policy: RetryPolicy = None,
+                    breaker: CircuitBreaker = None,
+                    description: str = 'API call') -> Any:
+    """
+    Call `fn` until it succeeds, retrying failures as decided by `policy`. While the circuit of `breaker` is open,
+    new calls fail fast with `CircuitOpenError` and calls already retrying wait for it to close.
+
+    Args:
+        fn (Callable[[], Any]): The call, without arguments, e.g., a `functools.partial`.
+        policy (RetryPolicy): The retry policy, defaults to `RetryPolicy()`.
+        breaker (CircuitBreaker): The circuit breaker of the service called, if any.
+        description (str): Name of the call in the logs.
+
+    Returns:
+        Any: The result of `fn`. The last error is raised if all attempts fail.
+    """
+    policy = policy or RetryPolicy()
+    attempt, waits = 0, 0
+    while True:
+        delay, probe = _wait_for_circuit(policy, breaker, attempt, waits, description)
+        if delay is not None:
+            waits += 1
+            time.sleep(delay)
+            continue
+        attempt += 1
+        try:
+            result = fn()
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # Interrupted, e.g., by KeyboardInterrupt, without an answer of the service
+                if probe:
+                    breaker.release_probe()
+                raise
+            if breaker is not None:
+                breaker.record_failure(e)
+            delay = policy.delay(attempt, e)
+            if delay is None:
+                raise
+            print(f'{description} - attempt {attempt} failed: {e}. Retrying after {delay:.1f} seconds...')
+            time.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+async def acall_with_retry(fn: Callable[[], Awaitable[Any]],
+                           policy: RetryPolicy = None,
+                           breaker: CircuitBreaker = None,
+                           description: str = 'API call') -> Any:
+    """
+    Async version of `call_with_retry`, where `fn` returns a new awaitable for each attempt.
+    """
+    policy = policy or RetryPolicy()
+    attempt, waits = 0, 0
+    while True:
+        delay, probe = _wait_for_circuit(policy, breaker, attempt, waits, description)
+        if delay is not None:
+            waits += 1
+            await asyncio.sleep(delay)
+            continue
+        attempt += 1
+        try:
+            result = await fn()
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # Interrupted, e.g., by cancellation, without an answer of the service
+                if probe:
+                    breaker.release_probe()
+                raise
+            if breaker is not None:
+                breaker.record_failure(e)
+            delay = policy.delay(attempt, e)
+            if delay is None:
+                raise
+            print(f'{description} - attempt {attempt} failed: {e}. Retrying after {delay:.1f} seconds...')
+            await asyncio.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
@@ -1,4 +1,6 @@
 import torch
+from collections.abc import Mapping
+from typing import Dict, List, Tuple, Union
 
 
 def get_top_k_indices(emb: torch.FloatTensor, 
@@ -34,3 +36,130 @@ def get_top_k_indices(emb: torch.FloatTensor,
     if return_similarity:
         return indices, sim[indices].tolist()
     return indices
+
+
+def aggregate_segments(scores: torch.FloatTensor, 
+                       counts: torch.LongTensor, 
+                       aggregate: str = 'max') -> torch.FloatTensor:
+    """
+    Aggregate the scores of contiguous segments, e.g., the chunk scores of each node.
+
+    Args:
+        scores (torch.FloatTensor): Concatenated scores of all segments, of size (sum(counts),).
+        counts (torch.LongTensor): Length of each segment.
+        aggregate (str): 'max', 'avg' or 'top{k}_avg' (the mean of the k highest scores of each segment).
+
+    Returns:
+        torch.FloatTensor: One aggregated score per segment, of size (len(counts),).
+    """
+    counts = counts.to(scores.device)
+    num_segments = len(counts)
+    segment_ids = torch.repeat_interleave(torch.arange(num_segments, device=scores.device), counts)
+    if aggregate == 'max':
+        out = torch.full((num_segments,), float('-inf'), device=scores.device)
+        return out.scatter_reduce(0, segment_ids, scores, reduce='amax')
+    if aggregate == 'avg':
+        out = torch.zeros(num_segments, device=scores.device).scatter_add(0, segment_ids, scores)
+        return out / counts.clamp(min=1)
+    if aggregate.startswith('top') and aggregate.endswith('_avg'):
+        k = int(aggregate.split('_')[0][len('top'):])
+        # Scatter into a (num_segments, max_count) matrix padded with -inf
+        starts = torch.cumsum(counts, dim=0) - counts
+        positions = torch.arange(len(scores), device=scores.device) - starts[segment_ids]
+        padded = torch.full((num_segments, max(int(counts.max()), 1) if num_segments else 1), float('-inf'), 
+                            device=scores.device)
+        padded[segment_ids, positions] = scores
+        values = torch.topk(padded, k=min(k, padded.size(1)), dim=-1).values
+        values = torch.where(torch.isinf(values), torch.zeros_like(values), values)
+        return values.sum(dim=-1) / counts.clamp(min=1, max=k)
+    raise ValueError(f"aggregate should be 'max', 'avg' or 'top{{k}}_avg', but got {aggregate}")
+
+
+class RankedResult(Mapping):
+    """
+    A compact ranking of candidates stored as parallel id/score tensors.
+
+    It behaves like a read-only `{node_id: score}` dictionary, so it can be passed wherever a 
+    prediction dictionary is expected, but the Python dictionary is only built on demand.
+
+    Args:
+        ids (torch.LongTensor): Candidate ids.
+        scores (torch.FloatTensor): Scores aligned with `ids`.
+        is_sorted (bool): Whether `ids` and `scores` are already sorted by descending score.
+    """
+
+    def __init__(self, 
+                 ids: Union[torch.LongTensor, List[int]], 
+                 scores: Union[torch.FloatTensor, List[float]], 
+                 is_sorted: bool = False):
+        self.ids = torch.as_tensor(ids, dtype=torch.long).view(-1).cpu()
+        self.scores = torch.as_tensor(scores, dtype=torch.float).view(-1).cpu()
+        assert len(self.ids) == len(self.scores), 'ids and scores should have the same length'
+        self.is_sorted = is_sorted
+        self._dict = None
+
+    @classmethod
+    def from_dict(cls, pred_dict: Dict[int, float]) -> 'RankedResult':
+        """
+        Build a ranked result from a `{node_id: score}` dictionary.
+
+        Args:
+            pred_dict (Dict[int, float]): A dictionary of node ids and their scores.
+
+        Returns:
+            RankedResult: The ranked result.
+        """
+        if isinstance(pred_dict, RankedResult):
+            return pred_dict
+        return cls(torch.LongTensor(list(pred_dict.keys())), torch.FloatTensor(list(pred_dict.values())))
+
+    def topk(self, k: int) -> 'RankedResult':
+        """
+        Get the top-k candidates, sorted by descending score.
+
+        Args:
+            k (int): Number of top candidates to keep. If k <= 0, keep all candidates.
+
+        Returns:
+            RankedResult: A sorted ranked result with at most k candidates.
+        """
+        k = len(self) if k <= 0 else min(k, len(self))
+        if self.is_sorted:
+            return RankedResult(self.ids[:k], self.scores[:k], is_sorted=True)
+        scores, idx = torch.topk(self.scores, k=k, dim=-1, sorted=True)
+        return RankedResult(self.ids[idx], scores, is_sorted=True)
+
+    def to_dict(self) -> Dict[int, float]:
+        """
+        Build (and cache) the `{node_id: score}` dictionary.
+
+        Returns:
+            Dict[int, float]: A dictionary of node ids and their scores.
+        """
+        if self._dict is None:
+            self._dict = dict(zip(self.ids.tolist(), self.scores.tolist()))
+        return self._dict
+
+    def keys(self) -> List[int]:
+        return self.ids.tolist()
+
+    def values(self) -> List[float]:
+        return self.scores.tolist()
+
+    def items(self) -> List[Tuple[int, float]]:
+        return list(zip(self.ids.tolist(), self.scores.tolist()))
+
+    def __getitem__(self, node_id: int) -> float:
+        return self.to_dict()[node_id]
+
+    def __contains__(self, node_id: object) -> bool:
+        return node_id in self.to_dict()
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __repr__(self) -> str:
+        return f'RankedResult(num_candidates={len(self)}, is_sorted={self.is_sorted})'
@@ -16,12 +16,24 @@ def parse_args():
     parser.add_argument('--split', default='test', choices=["train", "val", "test", "human_generated_eval"])
     parser.add_argument('--group_idx', default=0, type=int)
     parser.add_argument('--seed', default=0, type=int)
-    parser.add_argument('--model', default='avatar', choices=["avatar", "VSS", "MultiVSS", "LLMReranker", "LLMvReranker", "React"])
+    parser.add_argument('--model', default='avatar', choices=["avatar", "VSS", "MultiVSS", "Hybrid", "LLMReranker", "LLMvReranker", "React"])
 
     # for vss and multivss
     parser.add_argument('--chunk_size', type=int, default=None)
     parser.add_argument("--multi_vss_topk", type=int, default=None)
     parser.add_argument('--aggregate', type=str, default='max')
+    parser.add_argument('--device', type=str, default=None, help='device to score candidates on, e.g., cuda or cpu')
+    parser.add_argument('--ann_index', type=str, default=None, choices=['ivfpq', 'hnswpq'], 
+                        help='approximate nearest-neighbour index for parent retrieval (requires faiss)')
+    parser.add_argument('--ann_probe', type=int, default=32, help='recall-vs-latency knob of the ANN index')
+    parser.add_argument('--emb_dtype', type=str, default='float32', choices=['float32', 'float16', 'bfloat16', 'int8'],
+                        help='storage dtype of candidate/node embeddings, dequantized on the fly when scoring')
+
+    # for hybrid retrieval (dense + BM25)
+    parser.add_argument('--fusion', type=str, default='rrf', choices=['rrf', 'linear'])
+    parser.add_argument('--hybrid_alpha', type=float, default=0.5, help='weight of the dense scores in the fusion')
+    parser.add_argument('--parent_retriever', type=str, default='VSS', choices=['VSS', 'Hybrid'],
+                        help='retriever of the initial candidates of avatar')
 
     # avatar
     parser.add_argument("--emb_model", type=str, default="text-embedding-ada-002")
@@ -43,6 +55,13 @@ def parse_args():
 
     # for eval 
     parser.add_argument("--test_ratio", type=float, default=1.0)
+    parser.add_argument("--format_check", type=str, default=None, choices=['full', 'sample', 'outer', 'off'],
+                        help='type checking mode of tool calls, defaults to $AVATAR_FORMAT_CHECK or full')
+    parser.add_argument("--query_batch_size", type=int, default=256, help='number of queries scored per batch (VSS only)')
+    parser.add_argument("--llm_cache_max_temperature", type=float, default=None,
+                        help='cache LLM responses sampled at temperatures up to this value, defaults to $AVATAR_LLM_CACHE_MAX_TEMPERATURE or no caching')
+    parser.add_argument("--llm_cache_path", type=str, default=None,
+                        help='SQLite database of the LLM response cache, defaults to $AVATAR_LLM_CACHE_PATH or ~/.cache/avatar/llm_cache.db')
 
     # for baselines
     # LLMReranker specific settings
@@ -51,6 +70,11 @@ def parse_args():
     parser.add_argument("--vlm_model", type=str, default="gpt-4-1106-preview", help='the VLM to rerank candidates.')
     parser.add_argument("--llm_topk", type=int, default=10)
     parser.add_argument("--max_retry", type=int, default=3)
+    parser.add_argument("--rerank_mode", type=str, default='pointwise', choices=['pointwise', 'listwise'],
+                        help='score each candidate with its own prompt, or windows of candidates with one prompt each')
+    parser.add_argument("--rerank_window", type=int, default=10, help='number of candidates per prompt in listwise mode')
+    parser.add_argument("--rerank_max_prompt_tokens", type=int, default=12000,
+                        help='token budget of the candidate documents per prompt in listwise mode')
     # React specific settings
     parser.add_argument("--n_init_candidates", type=int, default=20, help='the number of candidates to rerank.')
     parser.add_argument("--vision", type=bool, default=False, help='whether or not include vision input')
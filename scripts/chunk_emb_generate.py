@@ -0,0 +1,78 @@
+import os
+import os.path as osp
+import sys
+import argparse
+
+from tqdm import tqdm
+
+sys.path.append('.')
+from avatar.utils.emb_store import EmbeddingStore, chunk_store_path
+from stark_qa import load_skb
+from avatar.utils.api import get_openai_embeddings
+from stark_qa.tools.process_text import chunk_text
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Chunk and embed all candidate documents into a chunk embedding store.')
+
+    # Dataset and embedding model selection
+    parser.add_argument('--dataset', default='amazon', choices=['amazon', 'prime', 'mag'])
+    parser.add_argument('--emb_model', default='text-embedding-ada-002',
+                        choices=[
+                            'text-embedding-ada-002',
+                            'text-embedding-3-small',
+                            'text-embedding-3-large'
+                            ]
+                        )
+
+    # Path settings
+    parser.add_argument("--emb_dir", default="emb/", type=str)
+
+    # Chunk settings, which must match the `chunk_size` used at runtime
+    parser.add_argument('--chunk_size', nargs='+', type=int, default=[256])
+
+    # Batch and node settings
+    parser.add_argument("--batch_size", default=2048, type=int, help='number of chunks embedded and saved at a time')
+    parser.add_argument("--n_max_nodes", default=10, type=int)
+
+    return parser.parse_args()
+
+
+def embed_and_append(store_path: str, node_ids: list, node_chunks: list, args) -> EmbeddingStore:
+    chunks = sum(node_chunks, [])
+    embs = get_openai_embeddings(chunks, model=args.emb_model, n_max_nodes=args.n_max_nodes)
+    embs = embs.view(len(chunks), -1).cpu()
+    store = EmbeddingStore.open_or_create(store_path, dim=embs.size(-1))
+    store.append(node_ids, embs, counts=[len(c) for c in node_chunks])
+    return store
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    chunk_emb_dir = osp.join(args.emb_dir, args.dataset, args.emb_model, 'chunk')
+    print(f'Chunk embedding directory: {chunk_emb_dir}')
+    os.makedirs(chunk_emb_dir, exist_ok=True)
+    kb = load_skb(args.dataset)
+
+    for chunk_size in args.chunk_size:
+        store_path = chunk_store_path(chunk_emb_dir, chunk_size)
+        store = EmbeddingStore.open(store_path)
+        # Resume: nodes already in the store are skipped
+        remaining_ids = [idx for idx in kb.candidate_ids if store is None or idx not in store]
+        print(f'chunk_size={chunk_size}: {len(kb.candidate_ids) - len(remaining_ids)} nodes done, '
+              f'{len(remaining_ids)} remaining')
+
+        node_ids, node_chunks, num_chunks = [], [], 0
+        for idx in tqdm(remaining_ids):
+            # Same text and chunking as `MultiVSS` and `GetRelevantChunk` at runtime
+            doc = kb.get_doc_info(idx, add_rel=True, compact=True)
+            node_ids.append(idx)
+            node_chunks.append(chunk_text(doc, chunk_size=chunk_size))
+            num_chunks += len(node_chunks[-1])
+            if num_chunks >= args.batch_size:
+                store = embed_and_append(store_path, node_ids, node_chunks, args)
+                node_ids, node_chunks, num_chunks = [], [], 0
+        if len(node_ids) > 0:
+            store = embed_and_append(store_path, node_ids, node_chunks, args)
+        if store is not None:
+            print(f'Saved chunk embeddings of {len(store)} nodes ({store.num_rows} chunks) to {store_path}!')
@@ -0,0 +1,44 @@
+import os
+import os.path as osp
+import sys
+import argparse
+
+from tqdm import tqdm
+
+sys.path.append('.')
+from avatar.utils.doc_cache import DocTextStore, doc_text_store_path
+from stark_qa import load_skb
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pre-render the document texts of all nodes into document text stores.')
+
+    # Dataset selection
+    parser.add_argument('--dataset', default='amazon', choices=['amazon', 'prime', 'mag'])
+
+    # Path settings
+    parser.add_argument("--emb_dir", default="emb/", type=str)
+
+    # Text settings, as (add_rel, compact) pairs used by the tools
+    parser.add_argument('--variants', nargs='+', default=['1,1', '0,1', '1,0', '0,0'],
+                        help='comma-separated add_rel,compact flags of each store to render')
+    parser.add_argument('--candidates_only', action='store_true', help='only render the candidate nodes')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    text_store_dir = osp.join(args.emb_dir, args.dataset, 'doc_text')
+    print(f'Document text directory: {text_store_dir}')
+    os.makedirs(text_store_dir, exist_ok=True)
+    kb = load_skb(args.dataset)
+    node_ids = list(kb.candidate_ids) if args.candidates_only else list(range(kb.num_nodes()))
+
+    for variant in args.variants:
+        add_rel, compact = [bool(int(flag)) for flag in variant.split(',')]
+        store_path = doc_text_store_path(text_store_dir, add_rel, compact)
+        texts = [kb.get_doc_info(idx, add_rel=add_rel, compact=compact) 
+                 for idx in tqdm(node_ids, desc=f'add_rel={add_rel}, compact={compact}')]
+        store = DocTextStore.write(store_path, node_ids, texts)
+        print(f'Saved {len(store)} texts to {store_path}!')
@@ -0,0 +1,95 @@
+import os.path as osp
+import re
+import sys
+import argparse
+from glob import glob
+
+import torch
+from tqdm import tqdm
+
+sys.path.append('.')
+from avatar.utils.emb_store import (
+    EmbeddingStore,
+    all_node_store_path,
+    build_store_from_files,
+    candidate_store_path,
+    chunk_store_path,
+    query_store_path
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert pickled embeddings into memory-mapped embedding stores, or update them incrementally.')
+
+    # Path settings
+    parser.add_argument('--node_emb_dir', default=None, type=str, help='directory with candidate_emb_dict.pt / all_node_emb_dict.pt')
+    parser.add_argument('--query_emb_dir', default=None, type=str, help='directory with query_emb_dict.pt')
+    parser.add_argument('--chunk_emb_dir', default=None, type=str, help='directory with {node_id}_size={chunk_size}.pt files')
+    parser.add_argument('--chunk_size', default=256, type=int)
+
+    # Incremental build from per-node {idx}.pt files in node_emb_dir
+    parser.add_argument('--node_files', action='store_true', help='add new or changed {idx}.pt files to the candidate store')
+    parser.add_argument('--dataset', default=None, choices=['amazon', 'prime', 'mag'],
+                        help='restrict --node_files to the candidates of this dataset (default: all files)')
+    parser.add_argument('--num_workers', default=16, type=int, help='number of threads loading files')
+
+    return parser.parse_args()
+
+
+def convert_dict(emb_dict_path: str, store_path: str) -> None:
+    if EmbeddingStore.exists(store_path):
+        print(f'{store_path} already exists, skipping')
+        return
+    if not osp.exists(emb_dict_path):
+        return
+    store = EmbeddingStore.load_or_convert(store_path, emb_dict_path)
+    print(f'Saved {len(store)} embeddings to {store_path}')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.node_emb_dir is not None:
+        convert_dict(osp.join(args.node_emb_dir, 'candidate_emb_dict.pt'), candidate_store_path(args.node_emb_dir))
+        convert_dict(osp.join(args.node_emb_dir, 'all_node_emb_dict.pt'), all_node_store_path(args.node_emb_dir))
+
+    if args.node_files:
+        if args.dataset is not None:
+            from stark_qa import load_skb
+            node_ids = load_skb(args.dataset).candidate_ids
+        else:
+            node_ids = sorted(int(osp.basename(path)[:-len('.pt')]) for path in glob(osp.join(args.node_emb_dir, '*.pt'))
+                              if osp.basename(path)[:-len('.pt')].isdigit())
+        store = build_store_from_files(candidate_store_path(args.node_emb_dir), node_ids,
+                                       lambda idx: osp.join(args.node_emb_dir, f'{idx}.pt'),
+                                       num_workers=args.num_workers)
+        if store is not None:
+            print(f'{len(store)} embeddings in {store.path}')
+
+    if args.query_emb_dir is not None:
+        convert_dict(osp.join(args.query_emb_dir, 'query_emb_dict.pt'), query_store_path(args.query_emb_dir))
+
+    if args.chunk_emb_dir is not None:
+        store_path = chunk_store_path(args.chunk_emb_dir, args.chunk_size)
+        pattern = re.compile(rf'^(\d+)_size={args.chunk_size}\.pt$')
+        chunk_paths = {}
+        for path in glob(osp.join(args.chunk_emb_dir, f'*_size={args.chunk_size}.pt')):
+            match = pattern.match(osp.basename(path))
+            if match:
+                chunk_paths[int(match.group(1))] = path
+
+        chunk_emb_dict = {}
+        for node_id in tqdm(sorted(chunk_paths)):
+            chunk_emb_dict[node_id] = torch.load(chunk_paths[node_id])
+        if len(chunk_emb_dict) > 0:
+            if EmbeddingStore.exists(store_path):
+                store = EmbeddingStore(store_path)
+                chunk_emb_dict = {node_id: embs for node_id, embs in chunk_emb_dict.items() if node_id not in store}
+                if len(chunk_emb_dict) > 0:
+                    node_ids = list(chunk_emb_dict.keys())
+                    store.append(node_ids,
+                                 torch.cat([chunk_emb_dict[node_id].view(-1, store.dim) for node_id in node_ids], dim=0),
+                                 counts=[chunk_emb_dict[node_id].view(-1, store.dim).size(0) for node_id in node_ids])
+            else:
+                store = EmbeddingStore.from_emb_dict(store_path, chunk_emb_dict)
+            print(f'Saved chunk embeddings of {len(store)} nodes to {store_path}')
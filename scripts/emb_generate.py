@@ -12,7 +12,7 @@ from avatar.kb import Flickr30kEntities
 from avatar.tools import GetCLIPImageEmbedding, GetCLIPTextEmbedding
 from avatar.qa_datasets import QADataset
 from stark_qa import load_skb, load_qa
-from stark_qa.tools.api import get_openai_embeddings
+from avatar.utils.api import get_openai_embeddings
 
 
 def parse_args():
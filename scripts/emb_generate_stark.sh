@@ -3,4 +3,10 @@ CUDA_VISIBLE_DEVICES=0 python scripts/emb_generate.py --dataset amazon --emb_mod
 CUDA_VISIBLE_DEVICES=0 python scripts/emb_generate.py --dataset mag --emb_model text-embedding-ada-002 --mode query
 CUDA_VISIBLE_DEVICES=0 python scripts/emb_generate.py --dataset mag --emb_model text-embedding-ada-002 --mode doc
 CUDA_VISIBLE_DEVICES=0 python scripts/emb_generate.py --dataset prime --emb_model text-embedding-ada-002 --mode query
-CUDA_VISIBLE_DEVICES=0 python scripts/emb_generate.py --dataset prime --emb_model text-embedding-ada-002 --mode doc
\ No newline at end of file
+CUDA_VISIBLE_DEVICES=0 python scripts/emb_generate.py --dataset prime --emb_model text-embedding-ada-002 --mode doc
+CUDA_VISIBLE_DEVICES=0 python scripts/chunk_emb_generate.py --dataset amazon --emb_model text-embedding-ada-002 --chunk_size 256
+CUDA_VISIBLE_DEVICES=0 python scripts/chunk_emb_generate.py --dataset mag --emb_model text-embedding-ada-002 --chunk_size 256
+CUDA_VISIBLE_DEVICES=0 python scripts/chunk_emb_generate.py --dataset prime --emb_model text-embedding-ada-002 --chunk_size 256
+CUDA_VISIBLE_DEVICES=0 python scripts/doc_text_generate.py --dataset amazon
+CUDA_VISIBLE_DEVICES=0 python scripts/doc_text_generate.py --dataset mag
+CUDA_VISIBLE_DEVICES=0 python scripts/doc_text_generate.py --dataset prime
\ No newline at end of file
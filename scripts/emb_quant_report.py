@@ -0,0 +1,95 @@
+import json
+import os
+import os.path as osp
+import sys
+import argparse
+
+import torch
+from tqdm import tqdm
+
+sys.path.append('.')
+from avatar.utils.emb_store import (
+    EMB_DTYPES,
+    candidate_store_path,
+    load_store,
+    query_store_path,
+    quantized_matmul
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare retrieval with quantized candidate embeddings against float32.')
+
+    # Path settings
+    parser.add_argument('--node_emb_dir', required=True, type=str, help='directory with the candidate embeddings')
+    parser.add_argument('--query_emb_dir', required=True, type=str, help='directory with the query embeddings')
+    parser.add_argument('--output_path', default=None, type=str, help='optional json file to save the report')
+
+    # Report settings
+    parser.add_argument('--dtypes', nargs='+', default=['float16', 'bfloat16', 'int8'], choices=EMB_DTYPES[1:])
+    parser.add_argument('--topk', nargs='+', type=int, default=[1, 10, 20, 100])
+    parser.add_argument('--num_queries', type=int, default=1000, help='number of queries to evaluate, -1 for all')
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--device', type=str, default=None)
+
+    return parser.parse_args()
+
+
+def store_bytes(store) -> int:
+    num_bytes = store.embs.numel() * store.embs.element_size()
+    if store.scales is not None:
+        num_bytes += store.scales.numel() * store.scales.element_size()
+    return num_bytes
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    device = torch.device(args.device if args.device else ('cuda' if torch.cuda.is_available() else 'cpu'))
+    max_k = max(args.topk)
+
+    path = candidate_store_path(args.node_emb_dir)
+    candidate_stores = {'float32': load_store(path, osp.join(args.node_emb_dir, 'candidate_emb_dict.pt'))}
+    assert candidate_stores['float32'] is not None, f'No candidate embeddings found in {args.node_emb_dir}'
+    for dtype in args.dtypes:
+        candidate_stores[dtype] = load_store(path, dtype=dtype)
+
+    query_store = load_store(query_store_path(args.query_emb_dir), osp.join(args.query_emb_dir, 'query_emb_dict.pt'))
+    assert query_store is not None, f'No query embeddings found in {args.query_emb_dir}'
+    query_ids = query_store.ids if args.num_queries < 0 else query_store.ids[:args.num_queries]
+
+    report = {}
+    for dtype, store in candidate_stores.items():
+        report[dtype] = {'bytes': store_bytes(store)}
+    overlaps = {dtype: {k: 0. for k in args.topk} for dtype in args.dtypes}
+    score_errors = {dtype: 0. for dtype in args.dtypes}
+
+    embs = {dtype: store.embs.to(device) for dtype, store in candidate_stores.items()}
+    scales = {dtype: None if store.scales is None else store.scales.to(device)
+              for dtype, store in candidate_stores.items()}
+    for start in tqdm(range(0, len(query_ids), args.batch_size)):
+        query_embs = query_store.get(query_ids[start:start + args.batch_size]).to(device)
+        exact = quantized_matmul(query_embs, embs['float32'])
+        exact_topk = torch.topk(exact, k=min(max_k, exact.size(1)), dim=-1).indices
+        for dtype in args.dtypes:
+            sim = quantized_matmul(query_embs, embs[dtype], scales[dtype])
+            score_errors[dtype] += (sim - exact).abs().mean(dim=1).sum().item()
+            approx_topk = torch.topk(sim, k=min(max_k, sim.size(1)), dim=-1).indices
+            for k in args.topk:
+                hits = (approx_topk[:, :k].unsqueeze(-1) == exact_topk[:, :k].unsqueeze(1)).any(-1)
+                overlaps[dtype][k] += (hits.float().sum(-1) / hits.size(1)).sum().item()
+
+    for dtype in args.dtypes:
+        report[dtype]['mean_abs_score_error'] = score_errors[dtype] / len(query_ids)
+        for k in args.topk:
+            report[dtype][f'recall@{k}'] = overlaps[dtype][k] / len(query_ids)
+
+    print(f'Recall of the float32 top-k over {len(query_ids)} queries and {len(candidate_stores["float32"])} candidates:')
+    for dtype, result in report.items():
+        print(f'{dtype:>9}: ' + ', '.join(
+            f'{key}={value / 2 ** 20:.1f}MB' if key == 'bytes' else f'{key}={value:.4f}' for key, value in result.items()
+        ))
+    if args.output_path is not None:
+        os.makedirs(osp.dirname(args.output_path) or '.', exist_ok=True)
+        with open(args.output_path, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'Saved report to {args.output_path}')
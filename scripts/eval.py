@@ -13,11 +13,20 @@ from tqdm import tqdm
 
 import stark_qa
 from avatar.models import get_model
+from avatar.utils.doc_cache import set_doc_cache
+from avatar.utils.format import set_format_check_mode
+from avatar.utils.llm_cache import set_llm_cache
+from avatar.utils.topk import RankedResult
 from scripts.args import parse_args_w_defaults
 
 
 if __name__ == "__main__":
     args = parse_args_w_defaults("config/default_args.json")
+    if args.format_check is not None:
+        set_format_check_mode(args.format_check)
+    if args.llm_cache_max_temperature is not None:
+        cache_kwargs = {'path': args.llm_cache_path} if args.llm_cache_path else {}
+        set_llm_cache(max_temperature=args.llm_cache_max_temperature, **cache_kwargs)
     
     if args.dataset in ['amazon', 'mag', 'prime']:
         emb_root = osp.join(args.emb_dir, args.dataset, args.emb_model)
@@ -30,6 +39,8 @@ if __name__ == "__main__":
         os.makedirs(args.chunk_emb_dir, exist_ok=True)
 
         kb = stark_qa.load_skb(args.dataset)
+        # Pre-rendered document texts, see scripts/doc_text_generate.py
+        set_doc_cache(kb, text_store_dir=osp.join(args.emb_dir, args.dataset, 'doc_text'))
         qa_dataset = stark_qa.load_qa(args.dataset, human_generated_eval=args.split=='human_generated_eval')
         surfix = args.llm_model if args.model == 'LLMReranker' else args.emb_model
 
@@ -89,27 +100,39 @@ if __name__ == "__main__":
     indices = split_idx[args.split].tolist()
     remaining_indices = set(indices) - set(existing_idx)
 
-    for idx in tqdm(remaining_indices):
-        query, query_id, answer_ids, meta_info = qa_dataset[idx]
-        kwargs = {"seed": args.seed, "split": args.split} if args.model == "avatar" else {}
-        if 'React' in args.model:
-            pred_dict, fail_flag, history = model.forward(query, query_id, **kwargs)
-        else:
-            pred_dict = model.forward(query, query_id, **kwargs)
-
-        answer_ids = torch.LongTensor(answer_ids)
-        result = model.evaluate(pred_dict, answer_ids, metrics=eval_metrics)
-
-        result["idx"], result["query_id"] = idx, query_id
-        result["pred_rank"] = torch.LongTensor(list(pred_dict.keys()))[
-            torch.argsort(torch.tensor(list(pred_dict.values())), descending=True)[
-                :args.save_topk
-            ]
-        ].tolist()
-        if 'React' in args.model:
-            result['fail_flag'] = fail_flag
-
-        eval_csv = pd.concat([eval_csv, pd.DataFrame([result])], ignore_index=True)
+    remaining_indices = list(remaining_indices)
+
+    # VSS scores a whole batch of queries with one matmul
+    query_batch_size = args.query_batch_size if args.model == 'VSS' else 1
+    for start in tqdm(range(0, len(remaining_indices), query_batch_size)):
+        batch_indices = remaining_indices[start:start + query_batch_size]
+        batch = [qa_dataset[idx] for idx in batch_indices]
+        if args.model == 'VSS':
+            topk_ids, topk_scores = model.forward_batch(
+                [query for query, _, _, _ in batch],
+                [query_id for _, query_id, _, _ in batch],
+                topk=-1
+            )
+            pred_dicts = [RankedResult(ids, scores, is_sorted=True) for ids, scores in zip(topk_ids, topk_scores)]
+
+        for i, (idx, (query, query_id, answer_ids, meta_info)) in enumerate(zip(batch_indices, batch)):
+            kwargs = {"seed": args.seed, "split": args.split} if args.model == "avatar" else {}
+            if args.model == 'VSS':
+                pred_dict = pred_dicts[i]
+            elif 'React' in args.model:
+                pred_dict, fail_flag, history = model.forward(query, query_id, **kwargs)
+            else:
+                pred_dict = model.forward(query, query_id, **kwargs)
+
+            answer_ids = torch.LongTensor(answer_ids)
+            result = model.evaluate(pred_dict, answer_ids, metrics=eval_metrics)
+
+            result["idx"], result["query_id"] = idx, query_id
+            result["pred_rank"] = RankedResult.from_dict(pred_dict).topk(args.save_topk).ids.tolist()
+            if 'React' in args.model:
+                result['fail_flag'] = fail_flag
+
+            eval_csv = pd.concat([eval_csv, pd.DataFrame([result])], ignore_index=True)
 
         if args.save_pred:
             eval_csv.to_csv(eval_csv_path, index=False)
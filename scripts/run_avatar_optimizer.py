@@ -16,6 +16,8 @@ from multiprocessing import Pool
 import torch
 import stark_qa
 from avatar.models import get_model
+from avatar.utils.doc_cache import set_doc_cache
+from avatar.utils.llm_cache import set_llm_cache
 from stark_qa.tools.seed import set_seed
 from avatar.kb import Flickr30kEntities
 from avatar.qa_datasets import QADataset
@@ -25,6 +27,9 @@ from scripts.args import parse_args_w_defaults
 if __name__ == '__main__':
     args = parse_args_w_defaults('config/default_args.json')
     set_seed(args.seed)
+    if args.llm_cache_max_temperature is not None:
+        cache_kwargs = {'path': args.llm_cache_path} if args.llm_cache_path else {}
+        set_llm_cache(max_temperature=args.llm_cache_max_temperature, **cache_kwargs)
     
     if args.dataset in ['amazon', 'mag', 'prime']:
         emb_root = osp.join(args.emb_dir, args.dataset, args.emb_model)
@@ -36,6 +41,8 @@ if __name__ == '__main__':
         os.makedirs(args.chunk_emb_dir, exist_ok=True)
 
         kb = stark_qa.load_skb(args.dataset)
+        # Pre-rendered document texts, see scripts/doc_text_generate.py
+        set_doc_cache(kb, text_store_dir=osp.join(args.emb_dir, args.dataset, 'doc_text'))
         qa_dataset = stark_qa.load_qa(args.dataset)
 
     elif  args.dataset == 'flickr30k_entities':
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+import types
+import unittest
+
+from avatar.utils.retry import CircuitBreaker, CircuitOpenError, RetryPolicy, acall_with_retry, call_with_retry
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.response = types.SimpleNamespace(status_code=status_code, headers={})
+        super().__init__(f'HTTP {status_code}')
+
+
+def flaky_service(outage: float):
+    """
+    A service answering 503 for the first `outage` seconds.
+    """
+    start = time.monotonic()
+
+    def call():
+        if time.monotonic() - start < outage:
+            raise HTTPError(503)
+        return 'ok'
+    return call
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=6, base_delay=0.2, max_delay=2)
+
+    def test_short_outage_with_concurrent_callers(self):
+        breaker = CircuitBreaker('model', failure_threshold=10, reset_timeout=0.5)
+        service = flaky_service(1.5)
+        results = [None] * 8
+
+        def worker(i):
+            try:
+                results[i] = call_with_retry(service, self.policy, breaker)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['ok'] * len(results))
+        self.assertIsNone(breaker.opened_at)
+
+    def test_short_outage_with_concurrent_async_callers(self):
+        breaker = CircuitBreaker('model', failure_threshold=10, reset_timeout=0.5)
+        service = flaky_service(1.5)
+
+        async def call():
+            return service()
+
+        async def run():
+            return await asyncio.gather(*[acall_with_retry(call, self.policy, breaker) for _ in range(8)],
+                                        return_exceptions=True)
+        self.assertEqual(asyncio.run(run()), ['ok'] * 8)
+
+    def test_new_calls_fail_fast_while_open(self):
+        breaker = CircuitBreaker('model', failure_threshold=2, reset_timeout=10)
+        for _ in range(2):
+            breaker.record_failure(HTTPError(503))
+        calls = []
+        with self.assertRaises(CircuitOpenError):
+            call_with_retry(lambda: calls.append(1), self.policy, breaker)
+        self.assertEqual(calls, [])
+
+    def test_gives_up_once_attempts_are_used(self):
+        breaker = CircuitBreaker('model', failure_threshold=3, reset_timeout=0.1)
+        policy = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.05)
+        with self.assertRaises((HTTPError, CircuitOpenError)):
+            call_with_retry(flaky_service(60), policy, breaker)
+
+    def test_interrupted_probe_is_released(self):
+        breaker = CircuitBreaker('model', failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            breaker.record_failure(HTTPError(503))
+        time.sleep(0.1)
+
+        def interrupted():
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            call_with_retry(interrupted, self.policy, breaker)
+        self.assertFalse(breaker.probing)
+        self.assertEqual(call_with_retry(lambda: 'ok', self.policy, breaker), 'ok')
+        self.assertIsNone(breaker.opened_at)
+
+    def test_cancelled_async_probe_is_released(self):
+        breaker = CircuitBreaker('model', failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            breaker.record_failure(HTTPError(503))
+        time.sleep(0.1)
+
+        async def hang():
+            await asyncio.sleep(60)
+
+        async def call():
+            return 'ok'
+
+        async def run():
+            task = asyncio.ensure_future(acall_with_retry(hang, self.policy, breaker))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return await acall_with_retry(call, self.policy, breaker)
+        self.assertEqual(asyncio.run(run()), 'ok')
+        self.assertIsNone(breaker.opened_at)
+
+
+if __name__ == '__main__':
+    unittest.main()